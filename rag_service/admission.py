@@ -0,0 +1,150 @@
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from metrics import ADMISSION_TOTAL, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_SECONDS, QUERIES_IN_FLIGHT
+
+# - - - - -
+
+# Admission control for /query - a global cap on queries in flight, a per-user cap, and a
+# bounded FIFO wait queue with a queue-time limit. Anything that cannot be admitted is turned
+# away at once with a Retry-After computed from the LLM rate-limit state and how fast the
+# queue is draining, instead of piling onto Groq and the embedding model. Runs on the event
+# loop (one controller per worker process), so no locking is needed.
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, message, status_code, retry_after, reason):
+        super().__init__(message)
+        self.status_code = status_code    # 429 (this user / the quota) or 503 (the service)
+        self.retry_after = retry_after    # whole seconds
+        self.reason = reason
+
+
+class AdmissionController:
+
+    def __init__(self, max_concurrent=8, per_user=2, max_queue=32, queue_timeout=5.0, quota_wait=None):
+        self.max_concurrent = max_concurrent  # 0 = no global cap
+        self.per_user = per_user              # in flight + queued per user, 0 = no cap
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout    # seconds a request may wait for a slot
+        self.quota_wait = quota_wait          # () -> seconds until the LLM quota has room
+        self.in_flight = 0
+        self._users = {}
+        self._waiters = deque()
+        self._service_seconds = 1.0           # moving average of how long a slot is held
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self, queued=0) -> int:
+        """Seconds until a retry is likely to be admitted"""
+        slots = max(1, self.max_concurrent or self.in_flight or 1)
+        drain = self._service_seconds * (queued + 1) / slots
+        quota = self.quota_wait() if self.quota_wait is not None else 0.0
+        return max(1, math.ceil(max(drain, quota)))
+
+    def _reject(self, message, status_code, reason, queued=0):
+        ADMISSION_TOTAL.inc(outcome=reason)
+        return AdmissionRejected(message, status_code, self.retry_after(queued), reason)
+
+    def quota_exhausted(self) -> bool:
+        """The LLM quota will not have room within the queue timeout"""
+        return self.quota_wait is not None and self.quota_wait() > self.queue_timeout
+
+    @asynccontextmanager
+    async def admit(self, user_id, max_wait=None, calls_llm=True):
+        """Hold a query slot for the body; AdmissionRejected when none comes up in time
+
+        calls_llm=False (a cached or stored answer) is admitted even while the LLM quota is exhausted.
+        """
+        if self.per_user and self._users.get(user_id, 0) >= self.per_user:
+            raise self._reject(f"Too many concurrent queries for this user (limit {self.per_user})", 429, "user_limit")
+        if calls_llm and self.quota_exhausted():
+            quota = self.quota_wait()
+            raise self._reject(f"LLM rate limit reached, capacity frees up in {quota:.0f}s", 429, "rate_limited")
+
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        try:
+            await self._acquire(max_wait)
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self._release(time.monotonic() - started)
+        finally:
+            self._users[user_id] -= 1
+            if not self._users[user_id]:
+                del self._users[user_id]
+
+    async def _acquire(self, max_wait):
+        if not self.max_concurrent or (self.in_flight < self.max_concurrent and not self._waiters):
+            self.in_flight += 1
+            QUERIES_IN_FLIGHT.set(self.in_flight)
+            ADMISSION_TOTAL.inc(outcome="admitted")
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("Server busy, query queue is full", 503, "queue_full", len(self._waiters))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        queued_at = time.monotonic()
+        timeout = self.queue_timeout if max_wait is None else min(self.queue_timeout, max_wait)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as the wait ran out - take it
+                pass
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+                raise self._reject(
+                    f"Server busy, no query slot within {timeout:.1f}s", 503, "queue_timeout", len(self._waiters)
+                )
+        except asyncio.CancelledError:
+            # client went away - pass on a slot that was already handed to us
+            if waiter.done() and not waiter.cancelled():
+                self._release(None)
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+            raise
+        ADMISSION_QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+        ADMISSION_TOTAL.inc(outcome="queued")
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    def _release(self, held_seconds):
+        if held_seconds is not None:
+            self._service_seconds += 0.2 * (held_seconds - self._service_seconds)
+        # hand the slot straight to the oldest live waiter, so newcomers cannot jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+                return
+        ADMISSION_QUEUE_DEPTH.set(0)
+        self.in_flight -= 1
+        QUERIES_IN_FLIGHT.set(self.in_flight)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "per_user": self.per_user,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+        }
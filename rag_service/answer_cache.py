@@ -0,0 +1,134 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+from metrics import CACHE_REQUESTS_TOTAL, CACHE_HIT_RATIO, CACHE_ENTRIES
+
+# - - - - -
+
+# Persistent answer cache for the direct-LLM branches (no retrieval, so the answer only
+# depends on the prompt). Keyed on (branch, model, normalized query, template version);
+# entries expire after a TTL and the least recently used are evicted past the size bounds.
+# SQLite in WAL mode so every worker process can share one file.
+
+NORMALIZE_PATTERN = re.compile(r"[^\w\s']")
+
+
+def normalize_query(query) -> str:
+    """Case, whitespace and punctuation insensitive form of a query"""
+    return " ".join(NORMALIZE_PATTERN.sub(" ", query.lower()).split())
+
+
+def template_version(template) -> str:
+    """Fingerprint of an unformatted prompt template - editing a branch's prompt invalidates its entries"""
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+
+
+class AnswerCache:
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=5000, max_bytes=50 * 2 ** 20, name="answer"):
+        self.path = Path(path).resolve()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, branch TEXT, model TEXT, response TEXT,"
+            " size INTEGER, created REAL, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        CACHE_ENTRIES.set(self._count(), cache=self.name)
+
+    @staticmethod
+    def make_key(branch, model, query, version) -> str:
+        raw = "\x1f".join((branch, model, normalize_query(query), version))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                self._db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self._record(row is not None)
+        return row[0] if row is not None else None
+
+    def contains(self, key) -> bool:
+        """A fresh entry exists - a peek: no hit/miss recorded, LRU order untouched"""
+        with self._lock:
+            row = self._db.execute("SELECT created FROM answers WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl_seconds
+
+    def put(self, key, branch, model, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, branch, model, response, size, now, now),
+            )
+            self._evict(now)
+            CACHE_ENTRIES.set(self._count(), cache=self.name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS_TOTAL.inc(cache=self.name, result="hit" if hit else "miss")
+        CACHE_HIT_RATIO.set(self.hits / (self.hits + self.misses), cache=self.name)
+
+    def close(self):
+        """Fold the WAL back into the database file and close it"""
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.close()
+
+    def _count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        # drop least recently used rows until both bounds hold again
+        excess_rows = max(0, entries - self.max_entries)
+        excess_bytes = max(0, size - self.max_bytes)
+        victims = []
+        freed = 0
+        for key, row_size in self._db.execute("SELECT key, size FROM answers ORDER BY last_used").fetchall():
+            if len(victims) >= excess_rows and freed >= excess_bytes:
+                break
+            victims.append((key,))
+            freed += row_size
+        self._db.executemany("DELETE FROM answers WHERE key = ?", victims)
+
@@ -0,0 +1,140 @@
+"""
+Synthetic PDF corpus generator for offline benchmarks.
+
+    python -m benchmarks.corpus --out /tmp/rag_corpus --docs 20 --pages 10
+
+Writes plain-text PDFs named like frontend uploads (<ms timestamp>-<id>-<name>.pdf) to
+<out>/documents and <out>/manifest.json with one planted fact per page, usable as a
+labelled question set. The manifest lives outside documents/ so it is never indexed.
+"""
+import json
+import time
+import random
+import string
+import argparse
+from pathlib import Path
+
+VOCABULARY = (
+    "system data model index query latency throughput cache memory vector embedding "
+    "document retrieval network service request response storage cluster replica shard "
+    "partition token batch pipeline stage worker process thread schedule budget capacity "
+    "design interview resume project experience analysis report summary section chapter"
+).split()
+
+LINES_PER_PAGE = 45
+CHARS_PER_LINE = 90
+
+
+def _sentence(rng) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def _wrap(text, width=CHARS_PER_LINE):
+    line = []
+    length = 0
+    for word in text.split():
+        if length + len(word) + 1 > width and line:
+            yield " ".join(line)
+            line, length = [], 0
+        line.append(word)
+        length += len(word) + 1
+    if line:
+        yield " ".join(line)
+
+
+def _escape_pdf(text) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one Helvetica text stream per page"""
+    objects = []
+
+    def add(body) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog_id = add(None)
+    pages_id = add(None)
+    font_id = add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 40 780 Td\n"
+        stream += "".join(f"({_escape_pdf(line)}) '\n" for line in lines)
+        stream += "ET"
+        content_id = add(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ))
+
+    objects[catalog_id - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>"
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog_id} 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode("latin-1")
+    Path(path).write_bytes(bytes(out))
+
+
+def generate_corpus(out_dir, docs=10, pages=5, seed=7) -> dict:
+    """Generate `docs` PDFs of `pages` pages each under out_dir/documents; returns the manifest"""
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    documents_dir = out_dir / "documents"
+    documents_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = {"seed": seed, "documents": [], "questions": []}
+    base_ms = int(time.time() * 1000)
+    for d in range(docs):
+        upload_id = "".join(rng.choices(string.ascii_lowercase + string.digits, k=9))
+        file_name = f"{base_ms + d}-{upload_id}-synthetic_doc_{d:03d}.pdf"
+        page_lines = []
+        for p in range(pages):
+            # one planted, uniquely answerable fact per page
+            part = f"PART-{rng.randint(1000, 9999)}-{d:03d}{p:02d}"
+            unit = f"unit {d}.{p}"
+            fact = f"The calibration code for {unit} is {part}."
+            sentences = [_sentence(rng) for _ in range(rng.randint(14, 22))]
+            sentences.insert(rng.randrange(len(sentences)), fact)
+            lines = list(_wrap(" ".join(sentences)))[:LINES_PER_PAGE]
+            if fact not in " ".join(lines):
+                lines[-1] = fact
+            page_lines.append(lines)
+            manifest["questions"].append({
+                "question": f"What is the calibration code for {unit} in the report?",
+                "answer": part,
+                "file_name": file_name,
+                "page_label": str(p + 1),
+            })
+        write_pdf(documents_dir / file_name, page_lines)
+        manifest["documents"].append({"file_name": file_name, "pages": pages})
+
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    manifest = generate_corpus(args.out, args.docs, args.pages, args.seed)
+    print(f"📄 Wrote {len(manifest['documents'])} documents ({args.docs * args.pages} pages) to {args.out}/documents")
+
+
+if __name__ == "__main__":
+    main()
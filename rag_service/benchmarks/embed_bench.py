@@ -0,0 +1,146 @@
+"""
+Embedding backends compared: throughput, query latency and retrieval quality.
+
+    cd rag_service
+    python -m benchmarks.embed_bench --docs 20 --pages 10 \
+        --setups BAAI/bge-large-en-v1.5:torch,BAAI/bge-large-en-v1.5:onnx-int8,BAAI/bge-small-en-v1.5:onnx
+
+Each setup is <model>:<backend> (backends from embeddings.EMBED_BACKENDS); the first one is
+the baseline. Per setup it embeds every node of the synthetic corpus (embeddings/sec),
+embeds each question one at a time like /query does (query-embedding latency) and replays
+the questions through retrieval with tune_index.evaluate, reporting hit rates and their
+delta against the baseline. Setups sharing the baseline's model also report the mean cosine
+similarity of their node vectors to the baseline's. ONNX exports are cached in --onnx-dir.
+
+Note the similarity cutoff was tuned for bge-large - other models score on their own scale,
+so rerun tune_index before switching models for real. Runs with HF_HUB_OFFLINE=1 unless
+--allow-download, like run_bench.
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.run_bench import percentile
+from benchmarks.tune_index import evaluate
+
+
+def parse_setups(value):
+    setups = []
+    for item in value.split(","):
+        if item.strip():
+            model, _, backend = item.strip().rpartition(":")
+            setups.append((model, backend))
+    return setups
+
+
+def bench_setup(model_name, backend, documents, questions, args):
+    from embeddings import create_embed_model
+    from index_store import DenseIndex, index_config, parse_nodes
+
+    started = time.perf_counter()
+    embed_model = create_embed_model(model_name, backend, cache_dir=args.onnx_dir, threads=args.threads or None)
+    load_seconds = time.perf_counter() - started
+
+    config = index_config(
+        window_size=args.window_size, similarity_top_k=args.top_k, similarity_cutoff=args.cutoff,
+        embed_model=model_name, embed_backend=backend,
+    )
+    nodes = parse_nodes(documents, config)
+    embed_model.get_text_embedding_batch(["warm up"])
+    started = time.perf_counter()
+    index = DenseIndex.build(nodes, embed_model, meta={"index_config": config})
+    embed_seconds = time.perf_counter() - started
+
+    query_embeddings, latencies = [], []
+    for question in questions:
+        started = time.perf_counter()
+        query_embeddings.append(embed_model.get_query_embedding(question["question"]))
+        latencies.append(time.perf_counter() - started)
+
+    row = {
+        "model": model_name,
+        "backend": backend,
+        "dim": index.dim,
+        "load_seconds": load_seconds,  # includes the one-off ONNX export / quantization
+        "nodes": len(index),
+        "embeddings_per_second": len(index) / embed_seconds,
+        "query_embedding_p50_ms": percentile(latencies, 50) * 1000,
+        "query_embedding_p95_ms": percentile(latencies, 95) * 1000,
+    }
+    row.update(evaluate(index, config, args.mode, questions, query_embeddings))
+    return row, index
+
+
+def run(args) -> dict:
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    from llama_index.core import SimpleDirectoryReader
+
+    work = Path(args.corpus) if args.corpus else Path(tempfile.mkdtemp(prefix="rag_embed_"))
+    if args.corpus:
+        manifest = json.loads((work / "manifest.json").read_text())
+    else:
+        manifest = generate_corpus(work, docs=args.docs, pages=args.pages, seed=args.seed)
+    questions = manifest["questions"][:args.questions] if args.questions else manifest["questions"]
+    documents = SimpleDirectoryReader(input_dir=str(work / "documents")).load_data()
+
+    results = {"documents": len(documents), "questions": len(questions), "setups": []}
+    baseline = baseline_index = None
+    for model_name, backend in parse_setups(args.setups):
+        row, index = bench_setup(model_name, backend, documents, questions, args)
+        if baseline is None:
+            baseline, baseline_index = row, index
+        else:
+            row["hit_rate_delta"] = row["hit_rate"] - baseline["hit_rate"]
+            row["page_hit_rate_delta"] = row["page_hit_rate"] - baseline["page_hit_rate"]
+            row["speedup"] = row["embeddings_per_second"] / baseline["embeddings_per_second"]
+            if model_name == baseline["model"] and index.dim == baseline_index.dim:
+                # both sides are L2-normalised, so the row-wise dot product is the cosine
+                row["cosine_to_baseline"] = float(np.mean(np.sum(
+                    np.asarray(index.embeddings) * np.asarray(baseline_index.embeddings), axis=1
+                )))
+        results["setups"].append(row)
+        print(
+            f"{model_name} [{backend}]: {row['embeddings_per_second']:.1f} emb/s, "
+            f"query p50 {row['query_embedding_p50_ms']:.1f} ms, hit {row['hit_rate']:.2f}"
+            + (f" ({row['hit_rate_delta']:+.2f})" if "hit_rate_delta" in row else "")
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding models / backends on speed and retrieval quality")
+    parser.add_argument("--setups", default="BAAI/bge-large-en-v1.5:torch,BAAI/bge-large-en-v1.5:onnx,"
+                                            "BAAI/bge-large-en-v1.5:onnx-int8,BAAI/bge-small-en-v1.5:onnx-int8")
+    parser.add_argument("--corpus", default=None, help="existing corpus dir (documents/ + manifest.json)")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--questions", type=int, default=0, help="use only the first N questions (0 = all)")
+    parser.add_argument("--window-size", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--cutoff", type=float, default=0.6)
+    parser.add_argument("--mode", default="hybrid", choices=["hybrid", "vector"])
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads (0 = default)")
+    parser.add_argument("--onnx-dir", default="./onnx_models")
+    parser.add_argument("--allow-download", action="store_true")
+    parser.add_argument("--out", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Memory per indexed page: nodes with stored sentence windows vs compact nodes.
+
+    cd rag_service
+    python -m benchmarks.node_memory_bench --docs 20 --pages 10 --window-size 5
+
+Parses the synthetic corpus with SentenceWindowNodeParser and builds a DenseIndex twice -
+once keeping every node's window / original_text metadata (the old layout), once compact
+(DenseIndex.add default: windows rebuilt from neighbouring rows on retrieval). Reports
+Python heap retained by the index (tracemalloc) and bytes on disk per page, and checks
+that every compact window matches the stored one. Embeddings come from MockEmbedding with
+the service model's dimension, so no model has to be loaded; they are the same in both
+layouts and are excluded from the heap figures.
+"""
+import gc
+import json
+import argparse
+import tempfile
+import tracemalloc
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.tune_index import directory_bytes
+
+EMBED_DIM = 1024  # BAAI/bge-large-en-v1.5
+
+
+def build(documents, config, compact):
+    """(index, heap bytes retained by its nodes and lookups)"""
+    from llama_index.core.embeddings import MockEmbedding
+    from index_store import DenseIndex, parse_nodes
+
+    embed_model = MockEmbedding(embed_dim=EMBED_DIM)
+    gc.collect()
+    tracemalloc.start()
+    nodes = parse_nodes(documents, config)
+    index = DenseIndex.build(nodes, embed_model, meta={"index_config": config}, compact=compact)
+    del nodes
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - index.embeddings.nbytes
+    tracemalloc.stop()
+    return index, retained
+
+
+def run(args) -> dict:
+    from llama_index.core import SimpleDirectoryReader
+    from index_store import index_config
+
+    work = tempfile.mkdtemp(prefix="rag_nodes_")
+    generate_corpus(work, docs=args.docs, pages=args.pages, seed=args.seed)
+    documents = SimpleDirectoryReader(input_dir=f"{work}/documents").load_data()
+    pages = len(documents)
+    config = index_config(window_size=args.window_size)
+
+    results = {"pages": pages, "window_size": args.window_size}
+    indexes = {}
+    for layout, compact in (("stored_windows", False), ("compact", True)):
+        index, retained = build(documents, config, compact)
+        with tempfile.TemporaryDirectory() as saved:
+            index.save(saved)
+            disk = directory_bytes(saved) - index.embeddings.nbytes
+        indexes[layout] = index
+        results[layout] = {
+            "nodes": len(index),
+            "heap_bytes_per_page": retained / pages,
+            "disk_bytes_per_page": disk / pages,  # nodes.jsonl + offsets, BM25 and bounds; embeddings excluded
+        }
+
+    stored, compact = indexes["stored_windows"], indexes["compact"]
+    mismatches = sum(
+        stored.window(a, args.window_size) != compact.window(b, args.window_size)
+        for a, b in zip(stored.nodes, compact.nodes)
+    )
+    results["window_mismatches"] = mismatches
+    results["heap_saving"] = 1 - results["compact"]["heap_bytes_per_page"] / results["stored_windows"]["heap_bytes_per_page"]
+    results["disk_saving"] = 1 - results["compact"]["disk_bytes_per_page"] / results["stored_windows"]["disk_bytes_per_page"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-page memory of stored vs compact sentence windows")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--window-size", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Offline benchmark for the RAG service.
+
+    cd rag_service
+    python -m benchmarks.run_bench --docs 20 --pages 10 --concurrency 1,4,16 --out bench.json
+
+Generates a synthetic corpus, starts the stub Groq API and the service (uvicorn subprocess),
+then measures cold start, reindex/ingest, /query latency and throughput per query type at
+each concurrency level, and the server's memory high-water mark. The embedding model must
+already be in the local HuggingFace cache (runs with HF_HUB_OFFLINE=1 unless --allow-download).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+import httpx
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.stub_groq import StubConfig, start_stub
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+# representative queries per intended classify_query branch - the branch each one actually
+# takes is recorded from the debug trace during warmup
+QUERY_SET = {
+    "greeting": ["hello"],
+    "farewell": ["goodbye"],
+    "unclear": ["?"],
+    "creative": ["brainstorm names for a bakery"],
+    "comparison": ["compare python and java"],
+    "technical": ["error when installing the package"],
+    "general": ["what is gravity"],
+    "hybrid": ["what is the main topic of the report"],
+    "document_specific": ["key takeaways from the report"],
+    "summary": ["summarize this document"],
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def latency_summary(latencies, wall_seconds) -> dict:
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": (sum(latencies) / len(latencies) * 1000) if latencies else 0.0,
+    }
+
+
+def read_memory(pid) -> dict:
+    """VmHWM / VmRSS of a process in MiB (Linux only)"""
+    status = Path(f"/proc/{pid}/status")
+    if not status.exists():
+        return {}
+    memory = {}
+    for line in status.read_text().splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmHWM", "VmRSS"):
+            memory[key.lower() + "_mib"] = int(value.split()[0]) / 1024
+    return memory
+
+
+def parse_metric_sums(text, name) -> dict:
+    """Pull <name>_sum samples out of the /metrics exposition, keyed by label string"""
+    sums = {}
+    prefix = f"{name}_sum"
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            labels, _, value = line[len(prefix):].rpartition(" ")
+            sums[labels or "{}"] = float(value)
+    return sums
+
+
+class ServiceProcess:
+
+    def __init__(self, documents_dir, groq_base, port, allow_download=False, extra_env=None):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.env = dict(os.environ)
+        self.env.update({
+            "DOCUMENTS_DIR": str(documents_dir),
+            "GROQ_API_KEY": "benchmark",
+            "GROQ_API_BASE": f"{groq_base}/openai/v1",
+            "TOKENIZERS_PARALLELISM": "false",
+        })
+        if not allow_download:
+            self.env.update({"HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1"})
+        self.env.update(extra_env or {})
+        self.process = None
+
+    def start(self, timeout=600.0) -> float:
+        """Spawn the service and return seconds until /ready answers (cold start, warmup included)"""
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port)],
+            cwd=str(SERVICE_DIR), env=self.env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Service exited during startup with code {self.process.returncode}")
+            try:
+                if httpx.get(f"{self.base_url}/ready", timeout=1.0).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise TimeoutError("Service did not become ready in time")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def _run_load(client, queries, concurrency, total_requests):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total_requests):
+        queue.put_nowait(queries[i % len(queries)])
+
+    async def worker(worker_id):
+        nonlocal errors
+        while True:
+            try:
+                query = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                response = await client.post("/query", json={"query": query, "user_id": f"bench-{worker_id}"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    summary = latency_summary(latencies, time.perf_counter() - started)
+    summary["errors"] = errors
+    return summary
+
+
+async def _classify_queries(client) -> dict:
+    """Ask the service (debug=true) which branch each benchmark query really takes"""
+    observed = {}
+    for label, queries in QUERY_SET.items():
+        for query in queries:
+            response = await client.post("/query", json={"query": query, "user_id": "bench", "debug": True})
+            response.raise_for_status()
+            spans = (response.json().get("debug") or {}).get("spans", [])
+            observed[query] = next(
+                (s["attributes"].get("query_type") for s in spans if s["name"] == "classify_query"), None
+            )
+    return observed
+
+
+async def _query_benchmarks(base_url, concurrency_levels, requests_per_level, timeout):
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        results = {"classified_as": await _classify_queries(client), "by_type": {}}
+        for label, queries in QUERY_SET.items():
+            per_level = {}
+            for concurrency in concurrency_levels:
+                per_level[str(concurrency)] = await _run_load(
+                    client, queries, concurrency, max(requests_per_level, concurrency)
+                )
+            results["by_type"][label] = per_level
+        return results
+
+
+def run(args) -> dict:
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="rag_bench_"))
+    manifest = generate_corpus(work_dir, args.docs, args.pages, args.seed)
+    documents_dir = work_dir / "documents"
+    total_pages = sum(d["pages"] for d in manifest["documents"])
+    corpus_bytes = sum(p.stat().st_size for p in documents_dir.glob("*.pdf"))
+
+    stub_config = StubConfig(args.llm_latency_ms, args.llm_tokens_per_sec, args.llm_completion_tokens)
+    stub_server, stub_url = start_stub(config=stub_config)
+    service = ServiceProcess(documents_dir, stub_url, args.port or _free_port(), args.allow_download)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": vars(args),
+        },
+        "corpus": {"documents": len(manifest["documents"]), "pages": total_pages, "bytes": corpus_bytes},
+    }
+    try:
+        # cold start - import, embedding model load and initial index build over the corpus
+        results["cold_start_seconds"] = service.start()
+        results["memory_after_start"] = read_memory(service.process.pid)
+
+        # ingest / index build - timed by the service itself per stage; diff the stage
+        # totals around /reindex since the cold start already built the index once
+        before = parse_metric_sums(httpx.get(f"{service.base_url}/metrics", timeout=10).text, "rag_reindex_seconds")
+        reindex = httpx.post(f"{service.base_url}/reindex", json={}, timeout=args.timeout).json()
+        after = parse_metric_sums(httpx.get(f"{service.base_url}/metrics", timeout=10).text, "rag_reindex_seconds")
+        stages = {k: v - before.get(k, 0.0) for k, v in after.items()}
+        ingest_seconds = sum(v for k, v in stages.items() if 'stage="total"' not in k)
+        results["reindex"] = {
+            "success": reindex.get("success"),
+            "seconds": reindex.get("processing_time"),
+            "stage_seconds": stages,
+            "pages_per_second": total_pages / ingest_seconds if ingest_seconds else None,
+            "mib_per_second": (corpus_bytes / 2 ** 20) / ingest_seconds if ingest_seconds else None,
+        }
+        results["memory_after_reindex"] = read_memory(service.process.pid)
+
+        levels = [int(c) for c in args.concurrency.split(",")]
+        results["query"] = asyncio.run(
+            _query_benchmarks(service.base_url, levels, args.requests, args.timeout)
+        )
+        results["memory_high_water"] = read_memory(service.process.pid)
+        results["stub_llm_requests"] = stub_config.requests
+    finally:
+        service.stop()
+        stub_server.shutdown()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=str(SERVICE_DIR), text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG service benchmark")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per type per level")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=250.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="defaults to a fresh temp dir")
+    parser.add_argument("--allow-download", action="store_true", help="let HuggingFace fetch models")
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    Path(args.out).write_text(json.dumps(results, indent=2))
+    print(f"📊 Benchmark results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Source metadata assembly + response serialization cost per /query response.
+
+    cd rag_service
+    python -m benchmarks.serialize_bench --sources 5 --iterations 20000
+
+Compares the per-node formatting the response path used to do (attribute probing, regex
+prefix strip, preview slicing, validated SourceInfo per node) with the ingest-time
+precomputed fields (index_store.annotate_sources / node_source), and times serializing
+the finished response - through FastAPI's response_model path and directly with
+model_dump_json as /query now does, full, slim and response-only (the fields / slim request
+options) - with the bytes on the wire before and after gzip / brotli. The models mirror
+main.SourceInfo / main.QueryResponse so the benchmark does not have to load the embedding
+model or the index.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import random
+import argparse
+from typing import Optional, List, Dict, Any
+
+from pydantic import BaseModel, TypeAdapter
+from fastapi.encoders import jsonable_encoder
+from llama_index.core.schema import TextNode, NodeWithScore
+
+from index_store import annotate_sources, node_source
+from compression import brotli
+from benchmarks.corpus import _sentence
+
+# main.SLIM_SOURCE_FIELDS / main.response_exclude
+SLIM_EXCLUDE = {"sources": {"__all__": {"original_filename", "file_size", "document_title", "content_preview"}}}
+RESPONSE_ONLY_EXCLUDE = {"sources": True, "model_used": True, "processing_time": True, "backend": True,
+                         "partial": True, "debug": True}
+
+
+class SourceInfo(BaseModel):
+    file_name: str
+    original_filename: Optional[str] = None
+    page_label: Optional[str] = "N/A"
+    file_size: Optional[int] = 0
+    document_title: Optional[str] = None
+    content_preview: Optional[str] = None
+    relevance_score: Optional[float] = 0.0
+
+
+class QueryResponse(BaseModel):
+    response: str
+    sources: List[SourceInfo] = []
+    model_used: str
+    processing_time: float
+    backend: Optional[str] = None
+    partial: bool = False
+    debug: Optional[Dict[str, Any]] = None
+
+
+def make_nodes(count, rng):
+    nodes = []
+    for i in range(count):
+        sentences = [_sentence(rng) for _ in range(11)]
+        file_name = f"{1700000000000 + i}-{i:09d}-synthetic_doc_{i:03d}.pdf"
+        node = TextNode(
+            text=sentences[5],
+            metadata={
+                "window": " ".join(sentences),
+                "original_text": sentences[5],
+                "file_name": file_name,
+                "file_path": f"/documents/{file_name}",
+                "file_size": 20000 + i,
+                "page_label": str(i % 10 + 1),
+            },
+            excluded_embed_metadata_keys=["window", "original_text"],
+            excluded_llm_metadata_keys=["window", "original_text"],
+        )
+        nodes.append(node)
+    return nodes
+
+
+def legacy_sources(source_nodes):
+    """The per-node formatting loop the response path ran before ingest-time precompute"""
+    enhanced_sources = []
+    for node in source_nodes:
+        try:
+            metadata = getattr(node.node, 'metadata', {}) if hasattr(node.node, 'metadata') else {}
+            file_path = metadata.get('file_path', '')
+            file_name = metadata.get('file_name', '')
+            if not file_name and file_path:
+                file_name = os.path.basename(file_path)
+            if file_name:
+                clean_name = re.sub(r'^\d+-[a-z0-9]+-', '', file_name)
+                if not clean_name:
+                    clean_name = file_name
+            else:
+                clean_name = "Unknown Document"
+            content_text = getattr(node.node, 'text', '') if hasattr(node.node, 'text') else ''
+            content_preview = content_text[:100] + "..." if len(content_text) > 100 else content_text
+            enhanced_sources.append(SourceInfo(
+                file_name=clean_name,
+                original_filename=file_name,
+                page_label=metadata.get('page_label', 'N/A'),
+                file_size=metadata.get('file_size', 0),
+                document_title=metadata.get('document_title', clean_name),
+                content_preview=content_preview,
+                relevance_score=getattr(node, 'score', 0.0) if hasattr(node, 'score') else 0.0
+            ))
+        except Exception:
+            enhanced_sources.append(SourceInfo(file_name="Document Reference"))
+    return enhanced_sources
+
+
+def precomputed_sources(source_nodes):
+    return [
+        SourceInfo(**node_source(node.node), relevance_score=node.score or 0.0)
+        for node in source_nodes
+    ]
+
+
+def time_per_call(fn, iterations) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    nodes = make_nodes(args.sources, rng)
+    annotate_sources(nodes)
+    # what the retriever hands back - window text swapped in by MetadataReplacementPostProcessor
+    source_nodes = []
+    for node in nodes:
+        window_node = node.model_copy()
+        window_node.text = node.metadata["window"]
+        source_nodes.append(NodeWithScore(node=window_node, score=rng.random()))
+
+    answer = " ".join(_sentence(rng) for _ in range(12))
+
+    def response_with(sources):
+        return QueryResponse(response=answer, sources=sources, model_used="bench", processing_time=0.1)
+
+    # what FastAPI does for a response_model endpoint: revalidate, dump to JSON-able python, json.dumps
+    adapter = TypeAdapter(QueryResponse)
+
+    def fastapi_serialize(response):
+        return json.dumps(adapter.dump_python(adapter.validate_python(response), mode="json")).encode()
+
+    sources = precomputed_sources(source_nodes)
+    assert [s.model_dump() for s in sources] == [s.model_dump() for s in legacy_sources(source_nodes)]
+    response = response_with(sources)
+
+    results = {
+        "sources_per_response": args.sources,
+        "iterations": args.iterations,
+        "assembly_us": {
+            "legacy_loop": time_per_call(lambda: legacy_sources(source_nodes), args.iterations),
+            "precomputed_lookup": time_per_call(lambda: precomputed_sources(source_nodes), args.iterations),
+        },
+        "serialize_us": {
+            "response_model_path": time_per_call(lambda: fastapi_serialize(response), args.iterations),
+            "jsonable_encoder": time_per_call(lambda: json.dumps(jsonable_encoder(response)), args.iterations),
+            "model_dump_json": time_per_call(response.model_dump_json, args.iterations),
+            "model_dump_json_slim": time_per_call(
+                lambda: response.model_dump_json(exclude=SLIM_EXCLUDE), args.iterations
+            ),
+            "model_dump_json_response_only": time_per_call(
+                lambda: response.model_dump_json(exclude=RESPONSE_ONLY_EXCLUDE), args.iterations
+            ),
+        },
+    }
+    results["bytes"] = {}
+    for name, exclude in (("full", None), ("slim", SLIM_EXCLUDE), ("response_only", RESPONSE_ONLY_EXCLUDE)):
+        body = response.model_dump_json(exclude=exclude).encode()
+        sizes = {"identity": len(body), "gzip": len(gzip.compress(body, 6))}
+        if brotli is not None:
+            sizes["br"] = len(brotli.compress(body, quality=4))
+        results["bytes"][name] = sizes
+    results["compress_us"] = {
+        "gzip": time_per_call(lambda: gzip.compress(response.model_dump_json().encode(), 6), args.iterations),
+    }
+    if brotli is not None:
+        results["compress_us"]["br"] = time_per_call(
+            lambda: brotli.compress(response.model_dump_json().encode(), quality=4), args.iterations
+        )
+    results["end_to_end_us"] = {
+        "legacy": time_per_call(
+            lambda: fastapi_serialize(response_with(legacy_sources(source_nodes))), args.iterations
+        ),
+        "precomputed": time_per_call(
+            lambda: fastapi_serialize(response_with(precomputed_sources(source_nodes))), args.iterations
+        ),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Source assembly / response serialization benchmark")
+    parser.add_argument("--sources", type=int, default=5, help="source nodes per response (similarity_top_k)")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
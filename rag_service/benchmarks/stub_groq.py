@@ -0,0 +1,157 @@
+"""
+Local stand-in for the Groq OpenAI-compatible chat completions API and the Ollama
+generate API (the local fallback backend).
+
+    python -m benchmarks.stub_groq --port 8900 --latency-ms 300 --tokens-per-sec 250
+
+Point the service at it with GROQ_API_BASE=http://127.0.0.1:8900/openai/v1 and/or
+RAG_LOCAL_LLM_URL=http://127.0.0.1:8900 - run two instances to give them different speeds.
+--error-status 429 makes the OpenAI endpoint fail, e.g. to simulate an exhausted quota.
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+
+    def __init__(self, latency_ms=300.0, tokens_per_sec=250.0, completion_tokens=200, error_status=None):
+        self.latency_ms = latency_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.completion_tokens = completion_tokens
+        self.error_status = error_status  # OpenAI endpoint answers with this status when set
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def delay(self, completion_tokens) -> float:
+        generation = completion_tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+        return self.latency_ms / 1000.0 + generation
+
+
+def _prompt_text(body) -> str:
+    if "messages" in body:
+        return "\n".join(str(m.get("content", "")) for m in body["messages"])
+    return str(body.get("prompt", ""))
+
+
+def _completion_text(prompt, tokens) -> str:
+    # deterministic filler so responses are comparable across runs
+    words = (prompt.split() or ["stub"])[:40]
+    filler = " ".join(words[i % len(words)] for i in range(tokens))
+    return f"Stub answer: {filler}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._send_json(200, {"object": "list", "data": []})
+        if self.path == "/api/tags":
+            return self._send_json(200, {"models": [{"name": "stub", "model": "stub"}]})
+        if self.path == "/stats":
+            return self._send_json(200, {"requests": self.config.requests})
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._read_json()
+        with self.config.lock:
+            self.config.requests += 1
+
+        if self.path == "/api/generate":
+            return self._ollama_generate(body)
+        if self.path.endswith("/chat/completions") or self.path.endswith("/completions"):
+            if self.config.error_status:
+                return self._send_json(self.config.error_status, {"error": {"message": "stub error"}})
+            return self._openai_completion(body)
+        self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _openai_completion(self, body):
+        prompt = _prompt_text(body)
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = min(int(body.get("max_tokens") or self.config.completion_tokens),
+                                self.config.completion_tokens)
+        time.sleep(self.config.delay(completion_tokens))
+
+        text = _completion_text(prompt, completion_tokens)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+    def _ollama_generate(self, body):
+        prompt = str(body.get("prompt", ""))
+        requested = (body.get("options") or {}).get("num_predict")
+        completion_tokens = min(int(requested or self.config.completion_tokens), self.config.completion_tokens)
+        time.sleep(self.config.delay(completion_tokens))
+
+        self._send_json(200, {
+            "model": body.get("model", "stub"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": _completion_text(prompt, completion_tokens),
+            "done": True,
+            "prompt_eval_count": max(1, len(prompt) // 4),
+            "eval_count": completion_tokens,
+        })
+
+
+def start_stub(host="127.0.0.1", port=0, config=None):
+    """Start the stub in a daemon thread; returns (server, base_url)"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Groq API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fixed time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="generation rate")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--error-status", type=int, default=None, help="fail OpenAI calls with this status")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.tokens_per_sec, args.completion_tokens, args.error_status)
+    server, base_url = start_stub(args.host, args.port, config)
+    print(f"🧪 Stub Groq API listening on {base_url}/openai/v1 (Ollama API on {base_url}/api)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
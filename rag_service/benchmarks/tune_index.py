@@ -0,0 +1,199 @@
+"""
+Offline sweep of the index build configuration over a labelled question set.
+
+    cd rag_service
+    python -m benchmarks.tune_index --docs 20 --pages 10 --window-sizes 1,3,5,8 \
+        --top-k 3,5,8 --cutoffs 0.5,0.6,0.7 --out tune.json
+
+Builds one index per window size over the synthetic corpus (benchmarks/corpus.py - one
+planted fact per page) or an existing one (--corpus, a directory holding documents/ and
+manifest.json), then replays every question through retrieval and postprocessing for each
+top_k / cutoff / mode combination. Per configuration it reports index size on disk, build
+time, retrieval latency, context tokens handed to REFINE synthesis and the hit rate (the
+planted answer appears in the synthesized context) - no LLM is called.
+
+The embedded text of a node is its sentence, whatever the window, so embeddings are computed
+once and shared across window sizes; the one-off embedding cost is reported separately.
+Query embeddings are also computed once up front since they do not depend on the settings.
+Runs with HF_HUB_OFFLINE=1 unless --allow-download, like run_bench.
+"""
+import os
+import json
+import time
+import argparse
+import itertools
+import tempfile
+from pathlib import Path
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.run_bench import percentile
+
+DEFAULT_EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+
+
+class MemoEmbedding:
+    """get_text_embedding_batch with a per-text cache - what DenseIndex.build needs"""
+
+    def __init__(self, embed_model):
+        self.embed_model = embed_model
+        self.cache = {}
+        self.seconds = 0.0
+
+    def get_text_embedding_batch(self, texts, **kwargs):
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        if missing:
+            started = time.perf_counter()
+            embeddings = self.embed_model.get_text_embedding_batch(missing, **kwargs)
+            self.seconds += time.perf_counter() - started
+            self.cache.update(zip(missing, embeddings))
+        return [self.cache[text] for text in texts]
+
+
+def directory_bytes(path) -> int:
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def _floats(value):
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def evaluate(index, config, mode, questions, query_embeddings):
+    """Replay the question set through one retriever configuration"""
+    from llama_index.core.schema import QueryBundle, MetadataMode
+    from index_store import make_retriever, make_postprocessors
+
+    retriever = make_retriever(index, config, mode)
+    postprocessors = make_postprocessors(index, config, mode)
+
+    latencies, node_counts, context_tokens = [], [], []
+    hits = page_hits = 0
+    for question, embedding in zip(questions, query_embeddings):
+        bundle = QueryBundle(query_str=question["question"], embedding=embedding)
+        started = time.perf_counter()
+        nodes = retriever.retrieve(bundle)
+        for postprocessor in postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=bundle)
+        latencies.append(time.perf_counter() - started)
+
+        contents = [node.node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes]
+        node_counts.append(len(nodes))
+        # ~4 chars per token, the same estimate the service's rate limiter uses
+        context_tokens.append(sum(len(content) for content in contents) // 4)
+        hits += any(question["answer"] in content for content in contents)
+        page_hits += any(
+            node.node.metadata.get("file_name") == question["file_name"]
+            and str(node.node.metadata.get("page_label")) == question["page_label"]
+            for node in nodes
+        )
+
+    count = len(questions)
+    return {
+        "retrieval_p50_ms": percentile(latencies, 50) * 1000,
+        "retrieval_p95_ms": percentile(latencies, 95) * 1000,
+        "llm_calls_per_query": sum(node_counts) / count,  # REFINE makes one call per node
+        "context_tokens_per_query": sum(context_tokens) / count,
+        "hit_rate": hits / count,
+        "page_hit_rate": page_hits / count,
+    }
+
+
+def run(args) -> dict:
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    from llama_index.core import Settings, SimpleDirectoryReader
+    from embeddings import create_embed_model
+    from index_store import DenseIndex, index_config, parse_nodes
+
+    work = Path(args.corpus) if args.corpus else Path(tempfile.mkdtemp(prefix="rag_tune_"))
+    if args.corpus:
+        manifest = json.loads((work / "manifest.json").read_text())
+    else:
+        manifest = generate_corpus(work, docs=args.docs, pages=args.pages, seed=args.seed)
+    questions = manifest["questions"][:args.questions] if args.questions else manifest["questions"]
+
+    Settings.embed_model = create_embed_model(args.embed_model, args.embed_backend)
+    embed_model = MemoEmbedding(Settings.embed_model)
+    documents = SimpleDirectoryReader(input_dir=str(work / "documents")).load_data()
+
+    started = time.perf_counter()
+    query_embeddings = [Settings.embed_model.get_query_embedding(q["question"]) for q in questions]
+    query_embed_seconds = time.perf_counter() - started
+
+    results = {
+        "documents": len(documents),
+        "questions": len(questions),
+        "embed_model": args.embed_model,
+        "embed_backend": args.embed_backend,
+        "query_embedding_ms": query_embed_seconds / max(1, len(questions)) * 1000,
+        "configs": [],
+    }
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for window_size in _ints(args.window_sizes):
+        build_config = index_config(window_size=window_size)
+        started = time.perf_counter()
+        embed_before = embed_model.seconds
+        nodes = parse_nodes(documents, build_config)
+        index = DenseIndex.build(nodes, embed_model, meta={"documents_count": len(documents)})
+        build_seconds = time.perf_counter() - started - (embed_model.seconds - embed_before)
+
+        with tempfile.TemporaryDirectory() as saved:
+            index.save(saved)
+            index_bytes = directory_bytes(saved)
+
+        for top_k, cutoff, mode in itertools.product(_ints(args.top_k), _floats(args.cutoffs), modes):
+            config = index_config(window_size=window_size, similarity_top_k=top_k, similarity_cutoff=cutoff)
+            row = {
+                "config": config,
+                "mode": mode,
+                "nodes": len(index),
+                "index_bytes": index_bytes,
+                "build_seconds": build_seconds,  # parse + index assembly, embedding excluded
+            }
+            row.update(evaluate(index, config, mode, questions, query_embeddings))
+            results["configs"].append(row)
+            print(
+                f"window={window_size} top_k={top_k} cutoff={cutoff} mode={mode}: "
+                f"hit {row['hit_rate']:.2f}, {row['context_tokens_per_query']:.0f} ctx tokens, "
+                f"{row['retrieval_p50_ms']:.2f} ms p50"
+            )
+
+    results["embedding"] = {"texts": len(embed_model.cache), "seconds": embed_model.seconds}
+    # best hit rate first, then the cheapest prompt
+    ranked = sorted(results["configs"], key=lambda r: (-r["hit_rate"], r["context_tokens_per_query"]))
+    results["best"] = ranked[0] if ranked else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep index build configuration over a labelled question set")
+    parser.add_argument("--corpus", default=None, help="existing corpus dir (documents/ + manifest.json)")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--questions", type=int, default=0, help="use only the first N questions (0 = all)")
+    parser.add_argument("--window-sizes", default="1,3,5,8")
+    parser.add_argument("--top-k", default="3,5,8")
+    parser.add_argument("--cutoffs", default="0.5,0.6,0.7")
+    parser.add_argument("--modes", default="hybrid", help="comma separated: hybrid,vector")
+    parser.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL)
+    parser.add_argument("--embed-backend", default="torch", help="torch, onnx or onnx-int8")
+    parser.add_argument("--allow-download", action="store_true")
+    parser.add_argument("--out", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results["best"], indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
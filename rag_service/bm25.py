@@ -0,0 +1,166 @@
+import re
+import json
+import math
+import threading
+from array import array
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+# - - - - -
+
+# BM25 inverted index over the same sentence-window nodes as the vector index
+# postings are compact int32 arrays per term (row ids + term frequencies); rows are the
+# node positions in DenseIndex, so both retrieval legs speak the same ids.
+# Indexes grow incrementally with add(); a loaded index serves its postings straight from
+# memory-mapped arrays and only copies a term's postings when new rows are appended to it.
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SPLIT_PATTERN = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can do does for from had has have how i if in into is it "
+    "its me my of on or our so than that the their them then there these they this to was we were "
+    "what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercased terms; identifiers like PART-4821-007 are kept whole and also split"""
+    tokens = []
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        if match in STOPWORDS:
+            continue
+        tokens.append(match)
+        if SPLIT_PATTERN.search(match):
+            tokens.extend(part for part in SPLIT_PATTERN.split(match) if part and part not in STOPWORDS)
+    return tokens
+
+
+def _int32_view(values):
+    return np.frombuffer(values, dtype=np.int32) if isinstance(values, array) else values
+
+
+class BM25Index:
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms = {}          # term -> term id
+        self._docs = []           # term id -> row ids
+        self._tfs = []            # term id -> term frequency per row
+        self._lengths = array("i")
+        self._total_length = 0
+        self._length_norm = None  # cached k1 * (1 - b + b * len / avg_len)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, texts):
+        """Append one row per text - rows continue from the current length"""
+        with self._lock:
+            if not isinstance(self._lengths, array):
+                self._lengths = array("i", self._lengths)
+            for text in texts:
+                row = len(self._lengths)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    term_id = self._terms.get(term)
+                    if term_id is None:
+                        term_id = self._terms[term] = len(self._docs)
+                        self._docs.append(array("i"))
+                        self._tfs.append(array("i"))
+                    elif not isinstance(self._docs[term_id], array):
+                        # copy-on-write for postings served from a memory-mapped file
+                        self._docs[term_id] = array("i", self._docs[term_id])
+                        self._tfs[term_id] = array("i", self._tfs[term_id])
+                    self._docs[term_id].append(row)
+                    self._tfs[term_id].append(tf)
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._total_length += length
+            self._length_norm = None
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the postings, lengths and term table"""
+        with self._lock:
+            postings = sum(len(docs) for docs in self._docs)
+            return postings * 8 + len(self._lengths) * 4 + len(self._terms) * 64
+
+    def search(self, query, top_k, rows=None):
+        """Return [(row, score)] best first; rows optionally restricts scoring to a subset"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms or top_k <= 0:
+                return []
+            if self._length_norm is None:
+                avg_length = (self._total_length / n) or 1.0
+                lengths = _int32_view(self._lengths).astype(np.float32)
+                self._length_norm = self.k1 * (1.0 - self.b + self.b * lengths / avg_length)
+            length_norm = self._length_norm
+
+            scores = np.zeros(n, dtype=np.float32)
+            for term in terms:
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    continue
+                docs = _int32_view(self._docs[term_id])
+                tfs = _int32_view(self._tfs[term_id]).astype(np.float32)
+                df = docs.shape[0]
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + length_norm[docs])
+                del docs, tfs
+
+        if rows is not None:
+            mask = np.zeros(n, dtype=bool)
+            mask[rows] = True
+            scores[~mask] = 0.0
+        candidates = np.flatnonzero(scores)
+        if candidates.shape[0] > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(row), float(scores[row])) for row in candidates]
+
+    def save(self, path):
+        """Flatten postings into CSR arrays (term offsets, row ids, tfs)"""
+        path = Path(path)
+        with self._lock:
+            offsets = np.zeros(len(self._docs) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(d) for d in self._docs])
+            docs = np.concatenate([_int32_view(d) for d in self._docs]) if self._docs else np.zeros(0, np.int32)
+            tfs = np.concatenate([_int32_view(t) for t in self._tfs]) if self._tfs else np.zeros(0, np.int32)
+            np.save(path / "bm25_offsets.npy", offsets)
+            np.save(path / "bm25_docs.npy", docs.astype(np.int32, copy=False))
+            np.save(path / "bm25_tfs.npy", tfs.astype(np.int32, copy=False))
+            np.save(path / "bm25_lengths.npy", _int32_view(self._lengths))
+            terms = sorted(self._terms, key=self._terms.get)
+            with open(path / "bm25_meta.json", "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "total_length": self._total_length, "terms": terms}, f)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        with open(path / "bm25_meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(k1=meta["k1"], b=meta["b"])
+        offsets = np.load(path / "bm25_offsets.npy")
+        docs = np.load(path / "bm25_docs.npy", mmap_mode="r")
+        tfs = np.load(path / "bm25_tfs.npy", mmap_mode="r")
+        index._terms = {term: i for i, term in enumerate(meta["terms"])}
+        index._docs = [docs[offsets[i]:offsets[i + 1]] for i in range(len(meta["terms"]))]
+        index._tfs = [tfs[offsets[i]:offsets[i + 1]] for i in range(len(meta["terms"]))]
+        index._lengths = np.load(path / "bm25_lengths.npy", mmap_mode="r")
+        index._total_length = meta["total_length"]
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked row lists - score(row) = sum(1 / (k + rank)) over the lists it appears in"""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
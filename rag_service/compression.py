@@ -0,0 +1,141 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional - gzip only without it
+    brotli = None
+
+# - - - - -
+
+# Negotiated response compression (ASGI middleware) - brotli when the client accepts it and
+# the brotli package is installed, else gzip. Small bodies go out as they are; streamed
+# bodies (NDJSON from /query/batch) are compressed chunk by chunk and flushed, so each
+# record still reaches the client as soon as it is ready.
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding) -> str:
+    """Best supported encoding for an Accept-Encoding header, or None"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():  # preference order breaks ties
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+
+    def __init__(self, encoding, gzip_level, brotli_quality):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data) -> bytes:
+        """Compressed data, flushed so the client can decode it right away"""
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b"") -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app, minimum_size=500, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value for name, value in scope["headers"] if name == b"accept-encoding"), b"")
+        encoding = negotiate(accept.decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, self))
+
+
+class _CompressingSend:
+
+    def __init__(self, send, encoding, settings):
+        self.send = send
+        self.encoding = encoding
+        self.settings = settings
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            # first body chunk - decide now that the headers and the first bytes are known
+            headers = {name.lower(): value for name, value in self.start["headers"]}
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES) \
+                    or (not more_body and len(body) < self.settings.minimum_size):
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding, self.settings.gzip_level, self.settings.brotli_quality)
+            if more_body:
+                compressed = self.compressor.chunk(body)
+            else:
+                compressed = self.compressor.finish(body)
+            await self.send(self._compressed_start(None if more_body else len(compressed)))
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            return
+
+        compressed = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    def _compressed_start(self, content_length):
+        headers = [(name, value) for name, value in self.start["headers"] if name.lower() != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        vary = [value for name, value in headers if name.lower() == b"vary"]
+        if not vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif b"accept-encoding" not in vary[0].lower():
+            headers = [(name, value) for name, value in headers if name.lower() != b"vary"]
+            headers.append((b"vary", vary[0] + b", Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return dict(self.start, headers=headers)
@@ -0,0 +1,39 @@
+import time
+import contextvars
+
+# - - - - -
+
+# Per-request deadlines - set once where a request enters (/query, batch items) and read by
+# every stage below it, so retrieval and each LLM call only spend what is left of the budget.
+# Lives in a context variable: worker threads started with a copied context see it too.
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def start(seconds):
+    """Set the current request's deadline (None = no deadline); returns a token for reset()"""
+    return _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left (never negative), or None when the request has no deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def check(stage):
+    """Raise DeadlineExceeded once the deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(stage)
@@ -0,0 +1,201 @@
+import re
+import json
+import zlib
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# - - - - -
+
+# Ingest-time duplicate detection. The frontend stores every upload under a fresh
+# <timestamp>-<id>- prefix, so the same PDF uploaded twice used to be parsed, embedded and
+# retrieved twice. Before parsing, each file is checked by content hash (byte-identical
+# copies) and each page by MinHash over word shingles (re-exports, re-scans, revisions
+# that left most pages alone). Duplicate pages are not indexed; the alias is recorded
+# against the page that was kept, so filters on either file name find the same rows.
+#
+# Pages rather than sentence nodes are the unit: sentence windows are joined from the
+# neighbouring rows of a page, so a page is kept or dropped whole. Repeated sentences
+# that survive (boilerplate shared by different documents) are collapsed at retrieval
+# time instead - see unique_hits.
+
+DEFAULT_DEDUP_THRESHOLD = 0.9  # estimated Jaccard similarity of two pages' shingle sets
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 16                     # LSH bands of NUM_PERM / BANDS rows - candidates from ~0.7 similarity up
+MERSENNE_PRIME = (1 << 31) - 1
+
+_random = np.random.RandomState(20240611)  # fixed - signatures are persisted with the index
+PERM_A = _random.randint(1, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+PERM_B = _random.randint(0, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_text(text) -> str:
+    """Lowercase words only - layout, punctuation and spacing differences do not count"""
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def minhash(normalized) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32) of the word shingles of normalized text"""
+    words = normalized.split()
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {normalized}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) & MERSENNE_PRIME for shingle in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    return ((hashes[:, None] * PERM_A + PERM_B) % MERSENNE_PRIME).min(axis=0).astype(np.uint32)
+
+
+def unique_hits(hits, text_of, limit):
+    """The first limit hits with distinct normalized text, best first; also returns how many were dropped"""
+    seen, kept, dropped = set(), [], 0
+    for hit in hits:
+        key = normalize_text(text_of(hit))
+        if key and key in seen:
+            dropped += 1
+            continue
+        seen.add(key)
+        kept.append(hit)
+        if len(kept) == limit:
+            break
+    return kept, dropped
+
+
+class DuplicateIndex:
+    """MinHash signatures of the pages kept in one index, and the aliases of the ones dropped
+
+    threshold 0 turns detection off (every document is kept).
+    """
+
+    def __init__(self, threshold=DEFAULT_DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.keys = []        # position -> [file name, page label]
+        self.digests = []     # position -> sha1 of the normalized page text
+        self.signatures = []  # position -> minhash signature
+        self.files = {}       # byte-identical file -> file it duplicates
+        self.pages = {}       # file -> {page label: [file, page label] it duplicates}
+        self._exact = {}      # digest -> position
+        self._buckets = {}    # (band, band bytes) -> [positions]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.signatures) * NUM_PERM * 4 + len(self.keys) * 160
+
+    def _band_keys(self, signature):
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def _find(self, digest, signature):
+        position = self._exact.get(digest)
+        if position is not None or signature is None:
+            return position
+        best, best_similarity = None, self.threshold
+        for key in self._band_keys(signature):
+            for candidate in self._buckets.get(key, ()):
+                similarity = float(np.mean(self.signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        return best
+
+    def _add(self, key, digest, signature):
+        position = len(self.keys)
+        self.keys.append(key)
+        self.digests.append(digest)
+        self.signatures.append(signature)
+        self._exact.setdefault(digest, position)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(position)
+
+    def filter_documents(self, documents, content_hashes, known_hashes=None):
+        """The documents (pages) to index - duplicates of earlier ones are dropped and aliased
+
+        content_hashes: {file name: sha256} of the files behind documents; known_hashes the
+        same for files already in the index.
+        """
+        if not self.threshold:
+            return list(documents), {"files": 0, "pages": 0}
+        dropped = {"files": 0, "pages": 0}
+        kept = []
+        with self._lock:
+            canonical_files = {
+                content_hash: name for name, content_hash in (known_hashes or {}).items() if name not in self.files
+            }
+            for document in documents:
+                metadata = document.metadata
+                file_name = metadata.get("file_name") or Path(metadata.get("file_path", "unknown")).name
+                content_hash = content_hashes.get(file_name)
+                original = canonical_files.setdefault(content_hash, file_name) if content_hash else file_name
+                if original != file_name:
+                    if file_name not in self.files:
+                        self.files[file_name] = original
+                        dropped["files"] += 1
+                    continue
+
+                normalized = normalize_text(document.text)
+                if not normalized:
+                    kept.append(document)
+                    continue
+                page_label = str(metadata.get("page_label", ""))
+                digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+                # exact matches only at threshold 1 - the signature is an estimate
+                signature = minhash(normalized)
+                position = self._find(digest, signature if self.threshold < 1 else None)
+                if position is not None:
+                    self.pages.setdefault(file_name, {})[page_label] = list(self.keys[position])
+                    dropped["pages"] += 1
+                    continue
+                self._add([file_name, page_label], digest, signature)
+                kept.append(document)
+        return kept, dropped
+
+    def aliases(self):
+        """(file aliases, page aliases) - copies, safe to read while documents are added"""
+        with self._lock:
+            return dict(self.files), {name: dict(pages) for name, pages in self.pages.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pages": len(self.keys),
+                "duplicate_files": len(self.files),
+                "duplicate_pages": sum(len(pages) for pages in self.pages.values()),
+                "threshold": self.threshold,
+            }
+
+    def save(self, path):
+        path = Path(path)
+        with self._lock:
+            signatures = np.stack(self.signatures) if self.signatures else np.zeros((0, NUM_PERM), np.uint32)
+            np.save(path / "minhash.npy", signatures)
+            with open(path / "duplicates.json", "w", encoding="utf-8") as f:
+                json.dump({
+                    "threshold": self.threshold, "keys": self.keys, "digests": self.digests,
+                    "files": self.files, "pages": self.pages,
+                }, f)
+
+    @classmethod
+    def load(cls, path, threshold=DEFAULT_DEDUP_THRESHOLD):
+        """Saved state, or an empty index for versions saved before deduplication"""
+        path = Path(path)
+        try:
+            with open(path / "duplicates.json", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(threshold)
+        duplicates = cls(data["threshold"])
+        duplicates.files = data["files"]
+        duplicates.pages = data["pages"]
+        for key, digest, signature in zip(data["keys"], data["digests"], np.load(path / "minhash.npy")):
+            duplicates._add(key, digest, signature)
+        return duplicates
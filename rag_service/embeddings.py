@@ -0,0 +1,150 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# - - - - -
+
+# Embedding backends. "torch" is the stock HuggingFaceEmbedding (fp32 PyTorch); "onnx" runs
+# the same model exported to ONNX under onnxruntime, "onnx-int8" a dynamically quantized copy
+# of that export (int8 weights, fp32 activations) - the CPU-friendly options.
+#
+# optional dependencies for the ONNX backends:  pip install "optimum[onnxruntime]"
+# (the export needs optimum + torch once; serving only needs onnxruntime + transformers)
+
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+
+# BGE retrieval models embed queries with an instruction prefix and pool on [CLS]
+BGE_QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
+
+
+def is_bge(model_name) -> bool:
+    return "bge-" in model_name.lower() and "-en" in model_name.lower()
+
+
+def onnx_model_dir(cache_dir, model_name) -> Path:
+    return Path(cache_dir) / model_name.replace("/", "--")
+
+
+def export_onnx(model_name, target_dir, quantize=False) -> Path:
+    """Export model_name to ONNX under target_dir (once); returns the .onnx file to load"""
+    target_dir = Path(target_dir)
+    model_path = target_dir / "model.onnx"
+    quantized_path = target_dir / "model_int8.onnx"
+
+    if not model_path.exists():
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                'Exporting an embedding model to ONNX needs optimum: pip install "optimum[onnxruntime]"'
+            ) from e
+        print(f"📦 Exporting {model_name} to ONNX in {target_dir}")
+        target_dir.mkdir(parents=True, exist_ok=True)
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(target_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(target_dir)
+
+    if not quantize:
+        return model_path
+    if not quantized_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print(f"📦 Quantizing {model_name} to int8")
+        tmp = quantized_path.with_suffix(f".{os.getpid()}.tmp")
+        quantize_dynamic(str(model_path), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, quantized_path)
+    return quantized_path
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """Sentence embeddings from an ONNX export of a HuggingFace model, run by onnxruntime"""
+
+    backend: str = "onnx"
+    max_length: int = 512
+    pooling: str = "cls"
+    query_instruction: str = ""
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names = PrivateAttr()
+    _lock = PrivateAttr()
+
+    def __init__(self, model_name=DEFAULT_EMBED_MODEL, backend="onnx", cache_dir="./onnx_models",
+                 threads=None, max_length=512, embed_batch_size=32, **kwargs):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                f'The {backend} embedding backend needs onnxruntime: pip install "optimum[onnxruntime]"'
+            ) from e
+        bge = is_bge(model_name)
+        super().__init__(
+            model_name=model_name,
+            backend=backend,
+            max_length=max_length,
+            pooling="cls" if bge else "mean",
+            query_instruction=BGE_QUERY_INSTRUCTION if bge else "",
+            embed_batch_size=embed_batch_size,
+            **kwargs,
+        )
+        model_dir = onnx_model_dir(cache_dir, model_name)
+        model_path = export_onnx(model_name, model_dir, quantize=backend == "onnx-int8")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self._tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, sentences, prompt_name=None):
+        """One forward pass over sentences - prompt_name="query" adds the query instruction"""
+        if prompt_name == "query" and self.query_instruction:
+            sentences = [self.query_instruction + sentence for sentence in sentences]
+        with self._lock:
+            encoded = self._tokenizer(
+                list(sentences), padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+        feed = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+        hidden = self._session.run(None, feed)[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.where(norms == 0, 1.0, norms)).tolist()
+
+    def _get_query_embedding(self, query):
+        return self._embed([query], prompt_name="query")[0]
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed(texts)
+
+
+def create_embed_model(model_name=DEFAULT_EMBED_MODEL, backend="torch", cache_dir="./onnx_models", threads=None):
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBED_BACKENDS}")
+    if backend == "torch":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        return HuggingFaceEmbedding(model_name=model_name)
+    return OnnxEmbedding(model_name, backend=backend, cache_dir=cache_dir, threads=threads)
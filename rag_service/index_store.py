@@ -0,0 +1,865 @@
+import os
+import re
+import copy
+import json
+import time
+import mmap
+import fcntl
+import shutil
+import hashlib
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+import numpy as np
+
+import tracing
+from bm25 import BM25Index, reciprocal_rank_fusion
+from dedup import DEFAULT_DEDUP_THRESHOLD, DuplicateIndex, unique_hits
+from metrics import RETRIEVAL_SECONDS, RETRIEVAL_DUPLICATES_TOTAL
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.node_parser import SentenceWindowNodeParser
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import NodeWithScore, MetadataMode, RelatedNodeInfo
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+# - - - - -
+
+# Dense vector index - node embeddings kept in one contiguous float32 matrix
+# rows are L2-normalised at build time, so a dot product is the cosine similarity the
+# default llamaindex vector store used. Persisted as a plain .npy so worker processes
+# can memory-map the same file and share its pages read-only.
+# A BM25 index over the same rows (bm25.py) backs the lexical leg of hybrid retrieval.
+# A per-document row index (file -> rows, row -> page, file -> upload time) lets
+# filtered queries score only the rows of the documents they are scoped to.
+# Sentence windows are not stored per node: every sentence is kept once (the node text) and
+# each row records the row range of its source page, so a window is joined from neighbouring
+# rows only when a node is retrieved (SentenceWindowPostprocessor).
+# Duplicate files and pages are dropped before parsing (dedup.py); the index keeps their
+# aliases, and retrievers collapse hits with the same sentence text before postprocessing.
+# A loaded index keeps its nodes on disk too (NodeStore): one serialized node per line of a
+# memory-mapped file, decoded only for the rows a query actually reads.
+
+# frontend uploads are stored as <ms timestamp>-<id>-<original name>
+UPLOAD_PREFIX_PATTERN = re.compile(r"^(\d+)-[a-z0-9]+-")
+
+# metadata key holding the precomputed response fields of a node (see annotate_sources)
+SOURCE_KEY = "source"
+
+# SentenceWindowNodeParser metadata that compact nodes drop (rebuilt from neighbouring rows)
+WINDOW_KEYS = ("window", "original_text")
+
+# upper bound on the score matrix of one search_batch block (float32 elements, ~64 MiB)
+BATCH_SCORE_ELEMENTS = 16 * 2 ** 20
+
+# rough per-node object overhead beyond its text - node, metadata and relationship objects
+NODE_OVERHEAD_BYTES = 3072
+
+# rough per-row memory of a loaded index's node id lookup (rows_by_id entry)
+NODE_ID_BYTES = 160
+
+
+def clean_file_name(file_name):
+    """Strip the upload timestamp/id prefix from a stored file name"""
+    return UPLOAD_PREFIX_PATTERN.sub("", file_name) or file_name
+
+
+def source_fields(metadata, text=""):
+    """Response-ready source fields for a node - computed once at ingest and stored on it"""
+    file_name = metadata.get("file_name") or os.path.basename(metadata.get("file_path", ""))
+    clean_name = clean_file_name(file_name) if file_name else "Unknown Document"
+    preview = metadata.get("window") or text
+    return {
+        "file_name": clean_name,
+        "original_filename": file_name,
+        "page_label": str(metadata.get("page_label", "N/A")),
+        "file_size": metadata.get("file_size", 0),
+        "document_title": metadata.get("document_title", clean_name),
+        "content_preview": preview[:100] + "..." if len(preview) > 100 else preview,
+    }
+
+
+def annotate_sources(nodes):
+    """Store source_fields() under metadata["source"], hidden from the embedding and the LLM"""
+    for node in nodes:
+        node.metadata[SOURCE_KEY] = source_fields(node.metadata, node.get_content(metadata_mode=MetadataMode.NONE))
+        for excluded in (node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys):
+            if SOURCE_KEY not in excluded:
+                excluded.append(SOURCE_KEY)
+
+
+def node_source(node):
+    """Precomputed source fields of a node (computed on the fly for indexes built before them)"""
+    return node.metadata.get(SOURCE_KEY) or source_fields(node.metadata, node.get_content(metadata_mode=MetadataMode.NONE))
+
+
+def upload_time(file_name, metadata):
+    """Upload time (epoch seconds) from the file name prefix, else the reader's file dates"""
+    match = UPLOAD_PREFIX_PATTERN.match(file_name)
+    if match and len(match.group(1)) == 13:
+        return int(match.group(1)) / 1000.0
+    for key in ("creation_date", "last_modified_date"):
+        value = metadata.get(key)
+        if value:
+            try:
+                return datetime.strptime(str(value), "%Y-%m-%d").timestamp()
+            except ValueError:
+                continue
+    return None
+
+
+def node_line(node) -> bytes:
+    """One node serialized as a line of nodes.jsonl"""
+    return json.dumps(doc_to_json(node)).encode("utf-8") + b"\n"
+
+
+class NodeStore:
+    """Nodes of a saved index, decoded from the memory-mapped nodes.jsonl when a row is read
+
+    node_offsets.npy holds the byte offset of every line, so workers share the file's pages
+    instead of each holding every node object. Nodes added after load stay in memory until
+    the next save. Behaves like the node list of a built index (len, [row], iteration, extend).
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        self.offsets = np.load(path / "node_offsets.npy", mmap_mode="r")
+        with open(path / "nodes.jsonl", "rb") as f:
+            # mmap refuses empty files - an empty index has no lines to map
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+        self._saved = len(self.offsets) - 1
+        self._added = []
+
+    def _record(self, row):
+        return json.loads(self._data[self.offsets[row]:self.offsets[row + 1]])
+
+    def __len__(self):
+        return self._saved + len(self._added)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if row >= self._saved:
+            return self._added[row - self._saved]
+        return json_to_doc(self._record(row))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def extend(self, nodes):
+        self._added.extend(nodes)
+
+    def text(self, row) -> str:
+        """Text of a row without building its node"""
+        if row >= self._saved:
+            return self._added[row - self._saved].text
+        return self._record(row)["__data__"]["text"]
+
+    def headers(self):
+        """(node id, metadata) of every row - what the row index is built from"""
+        for row in range(self._saved):
+            data = self._record(row)["__data__"]
+            yield data["id_"], data["metadata"]
+        for node in self._added:
+            yield node.node_id, node.metadata
+
+    def lines(self):
+        """nodes.jsonl lines of every row - saved rows are copied as stored"""
+        for row in range(self._saved):
+            yield self._data[self.offsets[row]:self.offsets[row + 1]]
+        for node in self._added:
+            yield node_line(node)
+
+    @property
+    def nbytes(self) -> int:
+        """Mapped file and offsets, plus the objects of nodes added since load"""
+        added = sum(len(node.text) + NODE_OVERHEAD_BYTES for node in self._added)
+        return len(self._data) + int(self.offsets.nbytes) + added
+
+
+class DenseIndex:
+
+    def __init__(self, nodes, embeddings, meta=None, lexical=None, window_bounds=None, duplicates=None):
+        self.nodes = nodes
+        self.embeddings = embeddings
+        self.meta = meta or {}
+        self.lexical = lexical if lexical is not None else BM25Index()
+        self.duplicates = duplicates if duplicates is not None else DuplicateIndex(
+            (self.meta.get("index_config") or {}).get("dedup_threshold", DEFAULT_DEDUP_THRESHOLD)
+        )
+        # row arrays are never resized in place - queries hold views of them, so add() builds
+        # the grown arrays aside and swaps the references in (see _publish)
+        self.doc_rows = {}                       # file name -> int32 rows
+        self.doc_uploaded = {}                   # file name -> epoch seconds (or None)
+        self.pages = np.zeros(0, dtype=np.int32)  # row -> numeric page label, -1 when unknown
+        self.rows_by_id = {}                     # node id -> row
+        # row -> first / last row of its source page, -1 when the node keeps its own window
+        if window_bounds is not None:
+            self.window_first = np.array(window_bounds[0], dtype=np.int32)
+            self.window_last = np.array(window_bounds[1], dtype=np.int32)
+        else:
+            self.window_first = np.full(len(nodes), -1, dtype=np.int32)
+            self.window_last = np.full(len(nodes), -1, dtype=np.int32)
+        self._publish(*self._register(nodes, 0))
+
+    def _register(self, nodes, start):
+        """(rows by node id, rows per file, upload times of new files, page numbers) of nodes added at start"""
+        ids, file_rows, uploaded, pages = {}, {}, {}, []
+        headers = nodes.headers() if isinstance(nodes, NodeStore) else ((node.node_id, node.metadata) for node in nodes)
+        for row, (node_id, metadata) in enumerate(headers, start):
+            ids[node_id] = row
+            file_name = metadata.get("file_name") or os.path.basename(metadata.get("file_path", "")) or "unknown"
+            if file_name not in file_rows:
+                file_rows[file_name] = []
+                if file_name not in self.doc_rows:
+                    uploaded[file_name] = upload_time(file_name, metadata)
+            file_rows[file_name].append(row)
+            page_label = str(metadata.get("page_label", ""))
+            pages.append(int(page_label) if page_label.isdigit() else -1)
+
+        doc_rows = dict(self.doc_rows)
+        for file_name, rows in file_rows.items():
+            rows = np.asarray(rows, dtype=np.int32)
+            doc_rows[file_name] = np.concatenate([doc_rows[file_name], rows]) if file_name in doc_rows else rows
+        return ids, doc_rows, uploaded, np.concatenate([self.pages, np.asarray(pages, dtype=np.int32)])
+
+    def _publish(self, ids, doc_rows, uploaded, pages):
+        # pages before doc_rows: every row a filter can find has its page number
+        self.rows_by_id.update(ids)
+        self.pages = pages
+        self.doc_uploaded.update(uploaded)
+        self.doc_rows = doc_rows
+
+    def rows_for(self, file_names=None, uploaded_after=None, uploaded_before=None,
+                 page_from=None, page_to=None):
+        """Rows matching document filters (sorted), or None when no filter is set
+
+        Files dropped as duplicates match through the rows of the pages they duplicate.
+        """
+        if not (file_names or uploaded_after or uploaded_before or page_from is not None or page_to is not None):
+            return None
+        after = uploaded_after.timestamp() if uploaded_after else None
+        before = uploaded_before.timestamp() if uploaded_before else None
+        names = {name.lower() for name in file_names} if file_names else None
+        paged = page_from is not None or page_to is not None
+
+        selected = []
+        for file_name, rows, page in self._documents():
+            if names is not None and file_name.lower() not in names \
+                    and clean_file_name(file_name).lower() not in names:
+                continue
+            uploaded = self.doc_uploaded[file_name] if file_name in self.doc_uploaded else upload_time(file_name, {})
+            if after is not None and (uploaded is None or uploaded < after):
+                continue
+            if before is not None and (uploaded is None or uploaded > before):
+                continue
+            if page is not None and paged:
+                # a duplicated page is filtered by its own page number, not the kept copy's
+                if page < 0 or (page_from is not None and page < page_from) or (page_to is not None and page > page_to):
+                    continue
+                page = None
+            selected.append((rows, page is None))
+        if not selected:
+            return np.zeros(0, dtype=np.int64)
+
+        kept = []
+        for rows, filter_pages in selected:
+            if paged and filter_pages:
+                pages = self.pages[rows]
+                mask = pages >= 0
+                if page_from is not None:
+                    mask &= pages >= page_from
+                if page_to is not None:
+                    mask &= pages <= page_to
+                rows = rows[mask]
+            kept.append(rows)
+        return np.unique(np.concatenate(kept)).astype(np.int64)
+
+    def _documents(self):
+        """(file name, rows, page number or None) for every indexed file and every duplicate alias"""
+        doc_rows = self.doc_rows
+        for file_name, rows in doc_rows.items():
+            yield file_name, rows, None
+        file_aliases, page_aliases = self.duplicates.aliases()
+        for file_name, original in file_aliases.items():
+            if original in doc_rows:
+                yield file_name, doc_rows[original], None
+        for file_name, pages in page_aliases.items():
+            for page_label, (original, original_label) in pages.items():
+                yield file_name, self.page_rows(original, original_label), int(page_label) if page_label.isdigit() else -1
+
+    def page_rows(self, file_name, page_label):
+        """Rows of one page of an indexed file"""
+        rows = self.doc_rows.get(file_name)
+        if rows is None:
+            return np.zeros(0, dtype=np.int32)
+        page = int(page_label) if str(page_label).isdigit() else -1
+        return rows[self.pages[rows] == page]
+
+    @classmethod
+    def build(cls, nodes, embed_model, meta=None, compact=True, duplicates=None):
+        index = cls([], np.zeros((0, 0), dtype=np.float32), dict(meta or {}), duplicates=duplicates)
+        index.add(nodes, embed_model, compact)
+        return index
+
+    def add(self, nodes, embed_model, compact=True):
+        """Append nodes - embeddings and BM25 postings grow incrementally
+
+        compact drops the stored sentence windows (WINDOW_KEYS, and the copies of neighbour
+        metadata in node relationships) in favour of per-row page bounds; source previews
+        are taken from the full window before that.
+        """
+        if not nodes:
+            return
+        annotate_sources(nodes)
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1.0, norms)
+        if self.embeddings.shape[0] and embeddings.shape[1] != self.embeddings.shape[1]:
+            raise ValueError(
+                f"Embedding dimension {embeddings.shape[1]} does not match index dimension {self.embeddings.shape[1]}"
+            )
+
+        # everything is built aside first, so a failure leaves the index as it was; then rows
+        # are published in dependency order - a query racing the add never scores a row
+        # without its node or window bounds, and filters only return scored rows
+        start = len(self.nodes)
+        window_first, window_last = self._window_bounds(nodes, start, compact)
+        window_first = np.concatenate([self.window_first, window_first])
+        window_last = np.concatenate([self.window_last, window_last])
+        grown = np.vstack([self.embeddings, embeddings]) if start else embeddings
+        registered = self._register(nodes, start)
+
+        self.nodes.extend(nodes)
+        self.window_first, self.window_last = window_first, window_last
+        self.embeddings = grown
+        self._publish(*registered)
+        # BM25 hits on rows the dense side does not have yet would be out of range - postings go last
+        self.lexical.add(node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes)
+        self.meta.update({"node_count": len(self.nodes), "dim": int(self.embeddings.shape[1])})
+
+    def _window_bounds(self, nodes, start, compact):
+        """(first, last) int32 window bounds of nodes added at start"""
+        # consecutive nodes from the same source page share their bounds
+        first, last = [], []
+        group = 0
+        for end in range(1, len(nodes) + 1):
+            if end < len(nodes) and nodes[end].ref_doc_id == nodes[group].ref_doc_id:
+                continue
+            for position in range(group, end):
+                metadata = nodes[position].metadata
+                if compact and "window" in metadata:
+                    for key in WINDOW_KEYS:
+                        metadata.pop(key, None)
+                    # source / prev / next links carry copies of the neighbours' metadata - windows included
+                    for related in nodes[position].relationships.values():
+                        if isinstance(related, RelatedNodeInfo):
+                            related.metadata = {}
+                    first.append(start + group)
+                    last.append(start + end - 1)
+                else:
+                    first.append(-1)
+                    last.append(-1)
+            group = end
+        return np.asarray(first, dtype=np.int32), np.asarray(last, dtype=np.int32)
+
+    def window(self, node, window_size):
+        """Sentence window around a node - the text SentenceWindowNodeParser would have stored"""
+        stored = node.metadata.get("window")
+        if stored is not None:
+            return stored
+        row = self.rows_by_id.get(node.node_id)
+        window_first, window_last = self.window_first, self.window_last
+        if row is None or window_first[row] < 0:
+            return None
+        first = max(int(window_first[row]), row - window_size)
+        last = min(int(window_last[row]), row + window_size)
+        return " ".join(self.text(r) for r in range(first, last + 1))
+
+    def text(self, row) -> str:
+        """Text of one row - read straight from disk for a loaded index"""
+        nodes = self.nodes
+        return nodes.text(row) if isinstance(nodes, NodeStore) else nodes[row].text
+
+    @property
+    def dim(self) -> int:
+        return int(self.embeddings.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory of the index - vectors, node text and objects, BM25 postings, page signatures"""
+        if isinstance(self.nodes, NodeStore):
+            text_bytes = self.nodes.nbytes + len(self.rows_by_id) * NODE_ID_BYTES
+        else:
+            text_bytes = sum(len(node.text) + NODE_OVERHEAD_BYTES for node in self.nodes)
+        return int(self.embeddings.nbytes) + text_bytes + self.lexical.nbytes + self.duplicates.nbytes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _check_dim(self, dim):
+        if self.embeddings.shape[0] and dim != self.embeddings.shape[1]:
+            raise ValueError(
+                f"Query embedding dimension {dim} does not match index dimension {self.embeddings.shape[1]} "
+                f"(built with {self.meta.get('index_config', {}).get('embed_model', 'another model')}) - reindex"
+            )
+
+    def _normalise(self, query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        self._check_dim(query.shape[-1])
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def similarity(self, query_embedding, rows):
+        """Cosine similarity of the query against specific rows"""
+        if not len(rows):
+            return np.zeros(0, dtype=np.float32)
+        return self.embeddings[np.asarray(rows)] @ self._normalise(query_embedding)
+
+    def search(self, query_embedding, top_k, rows=None):
+        """Return [(row, score)] for the top_k rows by cosine similarity, best first.
+
+        rows restricts scoring to that subset - only those vectors are read and scored.
+        """
+        if not self.nodes or top_k <= 0 or (rows is not None and not len(rows)):
+            return []
+        query = self._normalise(query_embedding)
+
+        scores = (self.embeddings if rows is None else self.embeddings[rows]) @ query
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def search_batch(self, query_embeddings, top_k, rows_list=None):
+        """search() for many queries - unscoped queries are scored with one matrix product
+
+        Queries are taken in blocks so the (queries x rows) score matrix stays bounded.
+        """
+        count = len(query_embeddings)
+        rows_list = rows_list or [None] * count
+        results = [None] * count
+        if not count or not self.nodes or top_k <= 0:
+            return [[] for _ in range(count)]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        self._check_dim(queries.shape[1])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+
+        unscoped = [i for i in range(count) if rows_list[i] is None]
+        k = min(top_k, len(self.nodes))
+        block = max(1, BATCH_SCORE_ELEMENTS // len(self.nodes))
+        for start in range(0, len(unscoped), block):
+            members = unscoped[start:start + block]
+            scores = queries[members] @ self.embeddings.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for member, member_rows, member_scores in zip(members, top.tolist(), top_scores.tolist()):
+                results[member] = list(zip(member_rows, member_scores))
+
+        # scoped queries each touch their own subset of rows
+        for i in range(count):
+            if results[i] is None:
+                results[i] = self.search(queries[i], top_k, rows_list[i])
+        return results
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "embeddings.npy", np.ascontiguousarray(self.embeddings))
+        nodes = self.nodes
+        offsets = [0]
+        with open(path / "nodes.jsonl", "wb") as f:
+            for line in nodes.lines() if isinstance(nodes, NodeStore) else map(node_line, nodes):
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(path / "node_offsets.npy", np.asarray(offsets, dtype=np.int64))
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        np.save(path / "windows.npy", np.stack([self.window_first, self.window_last]))
+        self.lexical.save(path)
+        self.duplicates.save(path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Saved index - embeddings mapped (unless mmap=False), nodes read from disk per row
+
+        Per worker, memory then holds the row index (node ids, per-file rows, pages and window
+        bounds) and BM25 term table, not the node text and objects.
+        """
+        path = Path(path)
+        embeddings = np.load(path / "embeddings.npy", mmap_mode="r" if mmap else None)
+        if (path / "nodes.jsonl").exists():
+            nodes = NodeStore(path)
+        else:
+            # versions saved before NodeStore keep all nodes in one JSON list
+            with open(path / "nodes.json", encoding="utf-8") as f:
+                nodes = [json_to_doc(data) for data in json.load(f)]
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        # versions saved before compact windows keep theirs in node metadata
+        windows_path = path / "windows.npy"
+        window_bounds = np.load(windows_path) if windows_path.exists() else None
+        duplicates = DuplicateIndex.load(
+            path, (meta.get("index_config") or {}).get("dedup_threshold", DEFAULT_DEDUP_THRESHOLD)
+        )
+        return cls(nodes, embeddings, meta, BM25Index.load(path), window_bounds, duplicates)
+
+
+def unique_rows(index, hits, limit):
+    """[(row, score)] hits past any whose node repeats the text of a better one, at most limit"""
+    hits, dropped = unique_hits(hits, lambda hit: index.text(hit[0]), limit)
+    if dropped:
+        RETRIEVAL_DUPLICATES_TOTAL.inc(dropped)
+    return hits
+
+
+class _RowScopedRetriever(BaseRetriever):
+    """Base for retrievers that can be scoped to a subset of index rows"""
+
+    _rows = None
+
+    def scoped(self, rows):
+        """Shallow copy that only scores the given rows (None = whole index)"""
+        scoped = copy.copy(self)
+        scoped._rows = rows
+        return scoped
+
+    def _query_embedding(self, query_bundle):
+        if query_bundle.embedding is not None:
+            return query_bundle.embedding
+        embed_model = self._embed_model or Settings.embed_model
+        return embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+
+    def retrieve_batch(self, query_bundles, rows_list=None):
+        """Retrieve for many (already embedded) queries; rows_list scopes each one"""
+        rows_list = rows_list or [None] * len(query_bundles)
+        return [self.scoped(rows).retrieve(bundle) for bundle, rows in zip(query_bundles, rows_list)]
+
+
+class DenseRetriever(_RowScopedRetriever):
+    """Top-k retriever over a DenseIndex - drop-in for VectorIndexRetriever"""
+
+    def __init__(self, index, similarity_top_k=5, embed_model=None, callback_manager=None):
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = embed_model
+        super().__init__(callback_manager=callback_manager)
+
+    def _nodes(self, hits):
+        # repeated sentences count once - over-fetched so top_k is still filled
+        hits = unique_rows(self._index, hits, self._similarity_top_k)
+        # hand out copies - postprocessors rewrite node text in place
+        return [NodeWithScore(node=self._index.nodes[row].copy(), score=score) for row, score in hits]
+
+    def _retrieve(self, query_bundle):
+        embedding = self._query_embedding(query_bundle)
+        return self._nodes(self._index.search(embedding, self._similarity_top_k * 2, self._rows))
+
+    def retrieve_batch(self, query_bundles, rows_list=None):
+        embeddings = [self._query_embedding(bundle) for bundle in query_bundles]
+        hits = self._index.search_batch(embeddings, self._similarity_top_k * 2, rows_list)
+        return [self._nodes(query_hits) for query_hits in hits]
+
+
+class HybridRetriever(_RowScopedRetriever):
+    """Vector + BM25 legs over the same rows, fused with reciprocal-rank fusion.
+
+    The similarity cutoff is applied to the vector leg here (RRF scores are not
+    comparable to it); lexical hits must score within lexical_min_ratio of the best
+    lexical hit. Returned scores are cosine similarities so sources stay comparable.
+    """
+
+    def __init__(self, index, similarity_top_k=5, similarity_cutoff=0.6, candidate_k=None,
+                 rrf_k=60, lexical_min_ratio=0.5, embed_model=None, callback_manager=None):
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        self._similarity_cutoff = similarity_cutoff
+        self._candidate_k = candidate_k or similarity_top_k * 2
+        self._rrf_k = rrf_k
+        self._lexical_min_ratio = lexical_min_ratio
+        self._embed_model = embed_model
+        super().__init__(callback_manager=callback_manager)
+
+    def _retrieve(self, query_bundle):
+        embedding = self._query_embedding(query_bundle)
+        with tracing.span("retrieve.vector") as vector_span, RETRIEVAL_SECONDS.time(retriever="vector"):
+            vector_hits = self._index.search(embedding, self._candidate_k, self._rows)
+            vector_span.set(candidates=len(vector_hits))
+        return self._fuse(query_bundle, embedding, vector_hits, self._rows)
+
+    def retrieve_batch(self, query_bundles, rows_list=None):
+        rows_list = rows_list or [None] * len(query_bundles)
+        embeddings = [self._query_embedding(bundle) for bundle in query_bundles]
+        with RETRIEVAL_SECONDS.time(retriever="vector_batch"):
+            vector_hits = self._index.search_batch(embeddings, self._candidate_k, rows_list)
+        return [
+            self._fuse(bundle, embedding, hits, rows)
+            for bundle, embedding, hits, rows in zip(query_bundles, embeddings, vector_hits, rows_list)
+        ]
+
+    def _fuse(self, query_bundle, embedding, vector_hits, rows):
+        vector_hits = [(row, score) for row, score in vector_hits if score >= self._similarity_cutoff]
+
+        with tracing.span("retrieve.bm25") as lexical_span, RETRIEVAL_SECONDS.time(retriever="bm25"):
+            lexical_hits = self._index.lexical.search(query_bundle.query_str, self._candidate_k, rows)
+            if lexical_hits:
+                floor = lexical_hits[0][1] * self._lexical_min_ratio
+                lexical_hits = [(row, score) for row, score in lexical_hits if score >= floor]
+            lexical_span.set(hits=len(lexical_hits))
+
+        fused = reciprocal_rank_fusion(
+            [[row for row, _ in vector_hits], [row for row, _ in lexical_hits]], k=self._rrf_k
+        )
+        fused = [row for row, _ in unique_rows(self._index, [(row, None) for row in fused], self._similarity_top_k)]
+        scores = self._index.similarity(embedding, fused)
+        return [
+            NodeWithScore(node=self._index.nodes[row].copy(), score=float(score))
+            for row, score in zip(fused, scores)
+        ]
+
+
+
+# - - - - -
+
+# Index build configuration - stored in the index meta ("index_config"), so a persisted index
+# carries the settings it was built with. window_size and dedup_threshold shape the nodes and
+# the embedding model / backend the vectors (changing any means a rebuild); top_k and cutoff
+# only shape retrieval and can change without re-embedding.
+
+DEFAULT_INDEX_CONFIG = {
+    "window_size": 5, "similarity_top_k": 5, "similarity_cutoff": 0.6,
+    "embed_model": "BAAI/bge-large-en-v1.5", "embed_backend": "torch",
+    "dedup_threshold": DEFAULT_DEDUP_THRESHOLD,
+}
+BUILD_KEYS = ("window_size", "embed_model", "embed_backend", "dedup_threshold")
+
+
+def index_config(**overrides) -> dict:
+    """DEFAULT_INDEX_CONFIG with the given (non-None) values replaced"""
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def same_build(config, other) -> bool:
+    """True when two configs produce the same nodes and embeddings"""
+    # indexes from before a key existed were built with its default
+    return all(
+        config.get(key, DEFAULT_INDEX_CONFIG[key]) == other.get(key, DEFAULT_INDEX_CONFIG[key]) for key in BUILD_KEYS
+    )
+
+
+def parse_nodes(documents, config):
+    """Sentence nodes carrying a window of surrounding sentences for synthesis"""
+    node_parser = SentenceWindowNodeParser.from_defaults(
+        window_size=config["window_size"],
+        window_metadata_key="window",
+        original_text_metadata_key="original_text"
+    )
+    return node_parser.get_nodes_from_documents(documents)
+
+
+def make_retriever(index, config, mode="hybrid"):
+    if mode == "hybrid":
+        # the similarity cutoff moves into the retriever - it gates the vector leg only
+        return HybridRetriever(
+            index,
+            similarity_top_k=config["similarity_top_k"],
+            similarity_cutoff=config["similarity_cutoff"]
+        )
+    return DenseRetriever(index, similarity_top_k=config["similarity_top_k"])
+
+
+class SentenceWindowPostprocessor(BaseNodePostprocessor):
+    """Swap each node's sentence for its window - MetadataReplacementPostProcessor for compact nodes"""
+
+    _index = PrivateAttr()
+    _window_size = PrivateAttr()
+
+    def __init__(self, index, window_size, **kwargs):
+        super().__init__(**kwargs)
+        self._index = index
+        self._window_size = window_size
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SentenceWindowPostprocessor"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        for node in nodes:
+            window = self._index.window(node.node, self._window_size)
+            if window is not None:
+                node.node.set_content(window)
+        return nodes
+
+
+class PartitionedRetriever(_RowScopedRetriever):
+    """Retrieve from several partitions (a tenant's and the shared one) and keep the best top_k
+
+    Each partition retriever returns cosine scores, so hits merge on score. Scoped rows are
+    a list with one entry (rows or None) per partition.
+    """
+
+    def __init__(self, retrievers, similarity_top_k=5, callback_manager=None):
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = None
+        super().__init__(callback_manager=callback_manager)
+
+    def _partition_rows(self, rows):
+        return rows if rows is not None else [None] * len(self._retrievers)
+
+    def _merge(self, hits):
+        # the same document may sit in the tenant's partition and the shared one
+        hits, dropped = unique_hits(
+            sorted(hits, key=lambda hit: hit.score or 0.0, reverse=True),
+            lambda hit: hit.node.get_content(metadata_mode=MetadataMode.NONE), self._similarity_top_k,
+        )
+        if dropped:
+            RETRIEVAL_DUPLICATES_TOTAL.inc(dropped)
+        return hits
+
+    def _retrieve(self, query_bundle):
+        hits = []
+        for retriever, rows in zip(self._retrievers, self._partition_rows(self._rows)):
+            if rows is None or len(rows):
+                hits.extend((retriever if rows is None else retriever.scoped(rows)).retrieve(query_bundle))
+        return self._merge(hits)
+
+    def retrieve_batch(self, query_bundles, rows_list=None):
+        rows_list = [self._partition_rows(rows) for rows in (rows_list or [None] * len(query_bundles))]
+        merged = [[] for _ in query_bundles]
+        for position, retriever in enumerate(self._retrievers):
+            results = retriever.retrieve_batch(query_bundles, [rows[position] for rows in rows_list])
+            for hits, result in zip(merged, results):
+                hits.extend(result)
+        return [self._merge(hits) for hits in merged]
+
+
+class PartitionedPostprocessor(BaseNodePostprocessor):
+    """Run each partition's postprocessors over the nodes retrieved from it, keeping the order"""
+
+    _partitions = PrivateAttr()
+
+    def __init__(self, partitions, **kwargs):
+        # partitions: [(DenseIndex, [postprocessor, ...])]
+        super().__init__(**kwargs)
+        self._partitions = partitions
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PartitionedPostprocessor"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        position = {id(node): i for i, node in enumerate(nodes)}
+        kept = []
+        for index, postprocessors in self._partitions:
+            own = [node for node in nodes if node.node.node_id in index.rows_by_id]
+            for postprocessor in postprocessors:
+                own = postprocessor.postprocess_nodes(own, query_bundle=query_bundle)
+            kept.extend(own)
+        return sorted(kept, key=lambda node: position.get(id(node), len(nodes)))
+
+
+def make_postprocessors(index, config, mode="hybrid"):
+    postprocessors = [
+        SimilarityPostprocessor(similarity_cutoff=config["similarity_cutoff"]),  # Filter low-quality matches
+        SentenceWindowPostprocessor(index, config["window_size"])
+    ]
+    if mode == "hybrid":
+        postprocessors = postprocessors[1:]
+    return postprocessors
+
+
+# - - - - -
+
+# Versioned on-disk store shared by worker processes
+#   <root>/versions/<version>/{embeddings.npy, nodes.jsonl, node_offsets.npy, meta.json, ...}
+#   <root>/CURRENT  - name of the live version, swapped with an atomic rename
+
+def directory_fingerprint(path, include=None) -> str:
+    """Cheap change detector for the documents directory (names, sizes, mtimes)
+
+    include(file name) narrows it to some of the files - one partition's documents.
+    """
+    digest = hashlib.sha1()
+    for entry in sorted(Path(path).iterdir()):
+        if entry.is_file() and not entry.name.startswith(".") and (include is None or include(entry.name)):
+            stat = entry.stat()
+            digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexStore:
+
+    def __init__(self, root, keep_versions=3):
+        self.root = Path(root).resolve()
+        self.versions_dir = self.root / "versions"
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_versions = keep_versions
+
+    @contextmanager
+    def build_lock(self):
+        """Serialise builds across processes - waiters then find the fresh version"""
+        with open(self.root / ".build.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current_version(self):
+        try:
+            return (self.root / "CURRENT").read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current_meta(self):
+        version = self.current_version()
+        if version is None:
+            return None
+        try:
+            with open(self.versions_dir / version / "meta.json", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, version):
+        return DenseIndex.load(self.versions_dir / version, mmap=True)
+
+    def publish(self, index) -> str:
+        """Write a new version and atomically make it current"""
+        version = f"{int(time.time() * 1000)}-{os.getpid()}"
+        index.meta["version"] = version
+        staging = self.versions_dir / f".{version}.tmp"
+        index.save(staging)
+        os.replace(staging, self.versions_dir / version)
+
+        pointer = self.root / "CURRENT.tmp"
+        pointer.write_text(version)
+        os.replace(pointer, self.root / "CURRENT")
+        self.prune()
+        return version
+
+    def prune(self):
+        # workers still mapping an old version keep their pages after unlink
+        current = self.current_version()
+        versions = sorted(
+            (p for p in self.versions_dir.iterdir() if p.is_dir() and not p.name.startswith(".")),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for old in versions[:-self.keep_versions]:
+            if old.name != current:
+                shutil.rmtree(old, ignore_errors=True)
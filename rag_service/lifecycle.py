@@ -0,0 +1,154 @@
+import time
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+
+# - - - - -
+
+# Service lifecycle, run from the FastAPI lifespan. Startup steps (load models, attach or
+# build the index, warm up) run in order in the background while the server already
+# answers probes; shutdown steps run in order once in-flight requests have drained - or the
+# drain timeout passed. Until the worker is ready (and again once it drains) other requests
+# get a 503 with Retry-After. /ready answers 200 only in the "ready" phase, so orchestrators
+# route traffic to a worker after its warmup; /health is the liveness check and fails only
+# when a required startup step did.
+#
+#   starting -> warming -> ready -> draining -> stopped
+#            -> failed (a required step raised)
+
+PHASES = ("starting", "warming", "ready", "draining", "stopped", "failed")
+
+
+class Lifecycle:
+
+    def __init__(self, drain_timeout=30.0):
+        self.phase = "starting"
+        self.drain_timeout = drain_timeout  # seconds to wait for in-flight requests, and per shutdown step
+        self.in_flight = 0
+        self.steps = {}      # step name -> {"seconds": ..., "error": ...}
+        self._startup = []   # (name, fn, phase, required)
+        self._shutdown = []  # (name, fn)
+        self._drained = None
+        self._started = time.monotonic()
+
+    def add_startup(self, name, fn, phase="starting", required=True):
+        """Run fn at startup - a failing required step fails the worker, others are only reported"""
+        self._startup.append((name, fn, phase, required))
+
+    def add_shutdown(self, name, fn):
+        self._shutdown.append((name, fn))
+
+    @property
+    def ready(self) -> bool:
+        return self.phase == "ready"
+
+    async def _run_step(self, name, fn, timeout=None):
+        started = time.perf_counter()
+        try:
+            # sync steps run off the event loop, so a stuck one can still time out
+            result = fn() if inspect.iscoroutinefunction(fn) else asyncio.to_thread(fn)
+            await asyncio.wait_for(result, timeout)
+        except Exception as e:
+            reason = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+            self.steps[name] = {"seconds": round(time.perf_counter() - started, 3), "error": reason}
+            raise
+        self.steps[name] = {"seconds": round(time.perf_counter() - started, 3), "error": None}
+
+    async def startup(self):
+        for name, fn, phase, required in self._startup:
+            self.phase = phase
+            try:
+                await self._run_step(name, fn)
+            except Exception as e:
+                if required:
+                    print(f"❌ Startup step {name} failed: {e}")
+                    self.phase = "failed"
+                    return
+                print(f"⚠️ Startup step {name} failed, continuing: {e}")
+        self.phase = "ready"
+        print(f"🟢 Ready in {time.monotonic() - self._started:.2f}s")
+
+    async def shutdown(self):
+        self.phase = "draining"
+        if self.in_flight:
+            print(f"⏳ Draining {self.in_flight} in-flight requests")
+            self._drained = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._drained.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ {self.in_flight} requests still running after {self.drain_timeout:.0f}s, shutting down anyway")
+        for name, fn in self._shutdown:
+            try:
+                await self._run_step(name, fn, self.drain_timeout)
+            except Exception as e:
+                print(f"⚠️ Shutdown step {name} failed: {e}")
+        self.phase = "stopped"
+        print("🔴 Stopped")
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        starting = asyncio.create_task(self.startup())
+        try:
+            yield
+        finally:
+            if not starting.done():
+                starting.cancel()
+                try:
+                    await starting
+                except asyncio.CancelledError:
+                    pass
+            await self.shutdown()
+
+    def request_started(self):
+        self.in_flight += 1
+
+    def request_finished(self):
+        self.in_flight -= 1
+        if not self.in_flight and self._drained is not None:
+            self._drained.set()
+
+    def stats(self) -> dict:
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "in_flight": self.in_flight,
+            "uptime_seconds": round(time.monotonic() - self._started, 1),
+            "steps": self.steps,
+        }
+
+
+class DrainMiddleware:
+    """Serves requests only while ready - counting them for the drain - and 503s the rest
+
+    exempt paths (probes, metrics) are always served and never counted.
+    """
+
+    def __init__(self, app, lifecycle, exempt=("/health", "/ready", "/metrics")):
+        self.app = app
+        self.lifecycle = lifecycle
+        self.exempt = set(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+        phase = self.lifecycle.phase
+        if phase != "ready":
+            if phase in ("starting", "warming"):
+                detail, headers = b"Service is starting", [(b"retry-after", b"5")]
+            elif phase == "failed":
+                detail, headers = b"Service failed to start", []
+            else:
+                detail, headers = b"Service is shutting down", [(b"connection", b"close"), (b"retry-after", b"1")]
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json")] + headers,
+            })
+            await send({"type": "http.response.body", "body": b'{"detail":"' + detail + b'"}'})
+            return
+        self.lifecycle.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lifecycle.request_finished()
@@ -0,0 +1,258 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import httpx
+
+from metrics import (
+    LLM_REQUEST_SECONDS, LLM_TOKENS_TOTAL, LLM_BACKEND_TOTAL, LLM_HEDGE_THRESHOLD_SECONDS, LLM_ABANDONED_TOTAL,
+    LLM_CALLS_IN_FLIGHT,
+)
+from deadlines import DeadlineExceeded
+import profiling
+
+# - - - - -
+
+# Local inference backend speaking the Ollama HTTP API (ollama serve, or the stand-in in
+# benchmarks/stub_groq.py) and hedged completion: the primary (Groq) call gets a head start,
+# a backup (the local model, else a duplicate request) is raced against it once the head
+# start runs out, and the local model takes over outright when the primary fails or is known
+# to be over quota.
+#
+# Every call gets what is left of the deadline as its own HTTP timeout, so a call that lost
+# the race (or outlived the request) gives its pool thread back soon after instead of holding
+# it for the full client timeout. The pool takes at most max_workers calls at a time: when it
+# is full, backups are skipped and the primary runs in the caller's thread, so new calls never
+# queue behind abandoned ones.
+
+
+class OllamaClient:
+
+    def __init__(self, base_url, model="gemma:2b", timeout=60.0, health_ttl=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.health_ttl = health_ttl
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout)
+        self._healthy = None
+        self._checked = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Cached reachability check (GET /api/tags)"""
+        with self._lock:
+            if self._healthy is not None and time.monotonic() - self._checked < self.health_ttl:
+                return self._healthy
+        return self._probe()
+
+    def known_available(self) -> bool:
+        """Last known reachability without blocking - safe on the event loop
+
+        a stale (or missing) result is refreshed in the background; unknown counts as unavailable.
+        """
+        with self._lock:
+            healthy = self._healthy
+            if not self._probing and (healthy is None or time.monotonic() - self._checked >= self.health_ttl):
+                self._probing = True
+                threading.Thread(target=self._probe, name="ollama-health", daemon=True).start()
+        return bool(healthy)
+
+    def _probe(self) -> bool:
+        try:
+            healthy = self._client.get("/api/tags", timeout=1.0).status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        with self._lock:
+            self._healthy, self._checked, self._probing = healthy, time.monotonic(), False
+        return healthy
+
+    def complete(self, prompt, max_tokens=None, timeout=None) -> str:
+        body = {"model": self.model, "prompt": prompt, "stream": False}
+        if max_tokens:
+            body["options"] = {"num_predict": max_tokens}
+        started = time.perf_counter()
+        try:
+            response = self._client.post(
+                "/api/generate", json=body, timeout=self.timeout if timeout is None else min(timeout, self.timeout)
+            )
+            response.raise_for_status()
+        except httpx.HTTPError:
+            with self._lock:
+                self._healthy, self._checked = False, time.monotonic()
+            raise
+        data = response.json()
+        label = f"ollama:{self.model}"
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=label)
+        LLM_TOKENS_TOTAL.inc(data.get("prompt_eval_count") or 0, model=label, kind="prompt")
+        LLM_TOKENS_TOTAL.inc(data.get("eval_count") or 0, model=label, kind="completion")
+        return data.get("response", "")
+
+    def close(self):
+        self._client.close()
+
+
+class LatencyTracker:
+    """Recent primary call latencies - calls are hedged once they outlast a high percentile"""
+
+    def __init__(self, percentile=95.0, window=200, min_samples=20, default=2.5, floor=0.25):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default = default    # threshold until enough samples are in
+        self.floor = floor        # never hedge sooner than this
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            threshold = self.default
+        else:
+            threshold = max(self.floor, samples[round(self.percentile / 100.0 * (len(samples) - 1))])
+        LLM_HEDGE_THRESHOLD_SECONDS.set(threshold)
+        return threshold
+
+
+class HedgedCompleter:
+    """Run primary(prompt); race a backup against it when it is slow, failing or over quota
+
+    The backup is the local model when it is up, else the hedge callable passed per call
+    (a duplicate request, possibly to a cheaper model). Only the local model takes over
+    from a failed primary - a duplicate of a failing call would most likely fail too.
+    """
+
+    def __init__(self, fallback=None, hedge_after=2.5, max_workers=16, latency=None):
+        self.fallback = fallback          # OllamaClient or None (no local fallback)
+        self.hedge_after = hedge_after    # seconds before racing the backup, unless latency says otherwise
+        self.latency = latency            # LatencyTracker -> percentile-based hedge threshold
+        self.max_in_flight = max_workers
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+
+    def close(self):
+        """Drop queued calls - running ones finish in the background"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def hedge_delay(self) -> float:
+        return self.latency.threshold() if self.latency is not None else self.hedge_after
+
+    def _submit(self, fn, *args):
+        """Future of fn(*args) in the pool - None when max_in_flight calls are already running"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            self._in_flight += 1
+            LLM_CALLS_IN_FLIGHT.set(self._in_flight)
+        # each call runs in a copy of the caller's context (trace, per-request LLM counter, deadline)
+        # and is sampled by the caller's profile, if any
+        future = self._pool.submit(contextvars.copy_context().run, profiling.bind(fn), *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            LLM_CALLS_IN_FLIGHT.set(self._in_flight)
+
+    @staticmethod
+    def _call(fn, prompt, deadline):
+        # the time left when the call actually starts bounds its HTTP request
+        timeout = _until(deadline)
+        if timeout == 0:
+            raise DeadlineExceeded("llm")
+        return fn(prompt, timeout=timeout)
+
+    def _timed(self, primary, prompt, deadline=None):
+        started = time.perf_counter()
+        text = self._call(primary, prompt, deadline)
+        if self.latency is not None:
+            self.latency.record(time.perf_counter() - started)
+        return text
+
+    @staticmethod
+    def _abandon(futures, reason):
+        """Drop calls nobody waits for - queued ones are cancelled, running ones end at their timeout"""
+        for future, backend in futures.items():
+            if not future.cancel():
+                LLM_ABANDONED_TOTAL.inc(backend=backend, reason=reason)
+
+    def complete(self, prompt, primary, skip_primary=False, hedge=None, timeout=None):
+        """Returns (text, backend) with backend "primary", "local" or "hedge"
+
+        primary, hedge and the fallback are called as fn(prompt, timeout=seconds left).
+        timeout bounds the whole call (DeadlineExceeded); calls still running then, or after
+        another backend answered, are abandoned and end at their own timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.fallback is not None and self.fallback.available():
+            backup, backup_name = self.fallback.complete, "local"
+        elif hedge is not None:
+            backup, backup_name = hedge, "hedge"
+        else:
+            backup, backup_name = None, None
+            if deadline is None:
+                LLM_BACKEND_TOTAL.inc(backend="primary", reason="no_fallback")
+                return self._timed(primary, prompt), "primary"
+
+        futures = {}
+        if skip_primary and backup_name == "local":
+            reason = "over_quota"
+            local_future = self._submit(self._call, backup, prompt, deadline)
+            if local_future is None:
+                LLM_BACKEND_TOTAL.inc(backend="local", reason="pool_full")
+                return self._call(backup, prompt, deadline), "local"
+            futures[local_future] = "local"
+        else:
+            reason = "fast" if backup is not None else "no_fallback"
+            primary_future = self._submit(self._timed, primary, prompt, deadline)
+            if primary_future is None:
+                # pool full of (mostly abandoned) calls - answer here, unhedged, rather than queue
+                LLM_BACKEND_TOTAL.inc(backend="primary", reason="pool_full")
+                return self._timed(primary, prompt, deadline), "primary"
+            futures[primary_future] = "primary"
+            if backup is not None:
+                done, _ = wait([primary_future], timeout=_until(deadline, self.hedge_delay()))
+                if not done and _until(deadline) != 0:
+                    backup_future = self._submit(self._call, backup, prompt, deadline)
+                    if backup_future is not None:
+                        reason = "hedge"
+                        futures[backup_future] = backup_name
+                elif done and primary_future.exception() is not None and backup_name == "local":
+                    print(f"⚠️ Primary LLM failed ({primary_future.exception()}), using local fallback")
+                    reason = "primary_error"
+                    local_future = self._submit(self._call, backup, prompt, deadline)
+                    if local_future is None:
+                        return self._call(backup, prompt, deadline), "local"
+                    futures[local_future] = "local"
+
+        # first successful answer wins; the loser is abandoned
+        errors = []
+        while futures:
+            finished, _ = wait(list(futures), timeout=_until(deadline), return_when=FIRST_COMPLETED)
+            if not finished:
+                self._abandon(futures, "deadline")
+                raise DeadlineExceeded("llm")
+            for future in finished:
+                backend = futures.pop(future)
+                if future.exception() is None:
+                    LLM_BACKEND_TOTAL.inc(backend=backend, reason=reason)
+                    self._abandon(futures, "lost_race")
+                    return future.result(), backend
+                errors.append(future.exception())
+        raise errors[-1]
+
+
+def _until(deadline, cap=None):
+    """Seconds to wait: what is left before deadline, capped - None means no limit"""
+    if deadline is None:
+        return cap
+    left = max(0.0, deadline - time.monotonic())
+    return left if cap is None else min(cap, left)
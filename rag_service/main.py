@@ -4,10 +4,8 @@ import random
 
 # local fallback setup 
 
-# pip3 install ollama
-# brew ollama
-# import ollama 
-# use gemma2B with ollama - local as a fallback mechanism 
+# ollama serve + ollama pull gemma:2b, then RAG_LOCAL_LLM_URL=http://127.0.0.1:11434
+# direct-LLM answers hedge / fail over to it - see local_llm.py and complete_text below
 
 
 
@@ -18,6 +16,8 @@ import random
 from userData import UserData
 user_data = UserData()
 GROQ_KEY = user_data.get("GROQ_API_KEY")
+# override to point at a local stand-in (see benchmarks/stub_groq.py)
+GROQ_API_BASE = user_data.get("GROQ_API_BASE") or "https://api.groq.com/openai/v1"
 # OPENAI_KEY = user_data.get("OPENAI_API_KEY")
 
 
@@ -68,7 +68,7 @@ class GroqClient :
 
     def __init__ (self, api_key) :
         self.api_key = api_key 
-        self.base_url = "https://api.groq.com/openai/v1/chat/completions"
+        self.base_url = f"{GROQ_API_BASE}/chat/completions"
         self.headers = {
             "Authorization" : f"Bearer {api_key}" ,
             "Content-Type" : "application/json" 
@@ -136,23 +136,156 @@ import json
 # set/select/choose model global 
 MODEL_GLOBAL = llama4_17
 
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import SimpleDirectoryReader, Settings
 from llama_index.llms.groq import Groq
 
-from llama_index.core import get_response_synthesizer
-from llama_index.core.response_synthesizers import ResponseMode
-
 from llama_index.core.prompts import PromptTemplate
-from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.core.postprocessor import SimilarityPostprocessor
+
+
+from llama_index.core.schema import QueryBundle, MetadataMode
+from llama_index.core.base.response.schema import Response as RAGResponse
+from llama_index.core.callbacks import CallbackManager, CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+import sys
+import hmac
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+import deadlines
+from deadlines import DeadlineExceeded
+from index_store import (
+    DenseIndex, IndexStore, clean_file_name, directory_fingerprint, node_source,
+    DEFAULT_INDEX_CONFIG, index_config, same_build, parse_nodes, make_retriever, make_postprocessors,
+    PartitionedRetriever, PartitionedPostprocessor
+)
+from dedup import DuplicateIndex
+from summaries import SummaryStore, file_hash
+from embeddings import DEFAULT_EMBED_MODEL, create_embed_model
+from uploads import UploadJobs, UploadRejected, receive_upload, safe_file_name
+from tenants import TenantDirectory, PartitionCache, tenant_key
+from answer_cache import AnswerCache, template_version
+from query_router import QueryHandler, QueryRouter
+from rate_limit import RateLimitExceeded, limiters_from_config
+from admission import AdmissionController, AdmissionRejected
+from speculation import SpeculationPolicy, Speculation
+from compression import CompressionMiddleware
+from lifecycle import Lifecycle, DrainMiddleware
+import profiling
+from profiling import Profiler
+from local_llm import OllamaClient, HedgedCompleter, LatencyTracker
+from metrics import (
+    REGISTRY, CONTENT_TYPE_LATEST, QUERY_SECONDS, QUERY_TYPE_TOTAL, CLASSIFICATION_SECONDS,
+    QUERY_EMBEDDING_SECONDS, RETRIEVAL_SECONDS, POSTPROCESS_SECONDS, LLM_CALLS_PER_REQUEST,
+    LLM_REQUEST_SECONDS, LLM_TOKENS_TOTAL, REINDEX_SECONDS, INDEX_DOCUMENTS, INDEX_NODES, DEADLINE_EXCEEDED_TOTAL,
+    INGEST_DUPLICATES_TOTAL
+)
+
+
+# LLM instrumentation - every llamaindex LLM call (direct complete + REFINE) passes through here
+# per-request call counter, set by process_query; mutable so copies of the context share it
+llm_call_counter = contextvars.ContextVar("llm_call_counter", default=None)
+
+# client-side limits from model_config - bulk work (llm_rate_wait set) waits for capacity,
+# interactive calls are only recorded so the limiter still sees all traffic
+RAG_RATE_LIMIT = os.getenv("RAG_RATE_LIMIT", "1") == "1"
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RAG_RATE_LIMIT_MAX_WAIT", "120"))
+# expected completion size, added to the prompt estimate until the real usage comes back
+RATE_LIMIT_COMPLETION_TOKENS = int(os.getenv("RAG_RATE_LIMIT_COMPLETION_TOKENS", "256"))
+rate_limiters = limiters_from_config(model_config, float(os.getenv("RAG_RATE_LIMIT_SCALE", "1.0"))) if RAG_RATE_LIMIT else {}
+llm_rate_wait = contextvars.ContextVar("llm_rate_wait", default=False)
+
+
+def estimate_llm_tokens(payload) -> int:
+    """Rough token count of an LLM call from its prompt (~4 chars per token)"""
+    payload = payload or {}
+    prompt = payload.get(EventPayload.PROMPT)
+    if prompt is None:
+        prompt = " ".join(str(getattr(m, "content", m)) for m in payload.get(EventPayload.MESSAGES) or [])
+    return len(str(prompt)) // 4 + RATE_LIMIT_COMPLETION_TOKENS
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._llm_starts = {}
+        self._llm_spans = {}
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        if event_type == CBEventType.LLM:
+            serialized = (payload or {}).get(EventPayload.SERIALIZED) or {}
+            model = serialized.get("model") or getattr(Settings.llm, "model", MODEL_GLOBAL)
+            estimated = 0
+            limiter = rate_limiters.get(model)
+            if limiter is not None:
+                estimated = estimate_llm_tokens(payload)
+                if llm_rate_wait.get():
+                    limiter.acquire(estimated, max_wait=RATE_LIMIT_MAX_WAIT)
+                else:
+                    limiter.record(estimated)
+            self._llm_starts[event_id] = (time.perf_counter(), model, estimated)
+            trace = tracing.current_trace()
+            if trace is not None:
+                self._llm_spans[event_id] = trace.begin("llm", model=model)
+            counter = llm_call_counter.get()
+            if counter is not None:
+                counter[0] += 1
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        if event_type != CBEventType.LLM or event_id not in self._llm_starts:
+            return
+        started, model, estimated = self._llm_starts.pop(event_id)
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=model)
+        llm_span = self._llm_spans.pop(event_id, None)
+
+        payload = payload or {}
+        llm_response = payload.get(EventPayload.COMPLETION) or payload.get(EventPayload.RESPONSE)
+        usage = None
+        raw = getattr(llm_response, "raw", None)
+        if isinstance(raw, dict):
+            usage = raw.get("usage")
+        elif raw is not None:
+            usage = getattr(raw, "usage", None)
+        if usage is not None and not isinstance(usage, dict):
+            usage = {k: getattr(usage, k, 0) for k in ("prompt_tokens", "completion_tokens")}
+        if llm_span is not None:
+            llm_span.end(**(usage or {}))
+        if usage is None:
+            return
+        LLM_TOKENS_TOTAL.inc(usage.get("prompt_tokens") or 0, model=model, kind="prompt")
+        LLM_TOKENS_TOTAL.inc(usage.get("completion_tokens") or 0, model=model, kind="completion")
+        limiter = rate_limiters.get(model)
+        if limiter is not None and estimated:
+            limiter.settle(estimated, (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0))
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
 
 
 # local embeddings - no OpenAI dependency - hidden process
-Settings.embed_model = HuggingFaceEmbedding (model_name="BAAI/bge-large-en-v1.5")
+# RAG_EMBED_BACKEND=onnx / onnx-int8 runs an exported (optionally int8 quantized) copy on onnxruntime
+EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", DEFAULT_EMBED_MODEL)
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
 # model selection - can be done locally in function but openAI is being referenced
-Settings.llm = Groq(model=MODEL_GLOBAL, api_key=GROQ_KEY)
+LLM_TIMEOUT = float(os.getenv("RAG_LLM_TIMEOUT", "60"))
+
+
+def load_models():
+    """Embedding model and default LLM - the first startup step (see Lifecycle at the end)"""
+    Settings.embed_model = create_embed_model(
+        EMBED_MODEL,
+        EMBED_BACKEND,
+        cache_dir=os.getenv("RAG_ONNX_DIR", "./onnx_models"),
+        threads=int(os.getenv("RAG_EMBED_THREADS", "0")) or None,
+    )
+    Settings.llm = Groq(model=MODEL_GLOBAL, api_key=GROQ_KEY, api_base=GROQ_API_BASE, timeout=LLM_TIMEOUT)
+    Settings.callback_manager = CallbackManager([MetricsCallbackHandler()])
 
 
 # Configuration for document directory
@@ -592,6 +725,23 @@ def classify_query(query: str) -> str:
         "character", "personality", "identity", "self-awareness", "mindfulness"
     ]
 
+    # Whole-document summary requests - answered from the precomputed summaries.
+    # Checked first since greeting substrings ("hi" in "this") would swallow them
+    summary_indicators = [
+        "summarize", "summarise", "summary", "summarization", "summarisation",
+        "tl;dr", "tldr", "overview of", "gist of", "key points of", "main points of",
+        "what is this document about", "what's this document about", "what is the document about"
+    ]
+    summary_targets = {
+        "document", "documents", "doc", "docs", "pdf", "pdfs", "file", "files", "upload", "uploaded",
+        "attached", "attachment", "report", "paper", "article", "resume", "cv", "manual", "contract",
+        "proposal", "thesis", "book", "this", "it", "them"
+    }
+    query_words = re.findall(r"[a-z;']+", query_lower)
+    if any(sum_ind in query_lower for sum_ind in summary_indicators) and (
+            len(query_words) == 1 or summary_targets.intersection(query_words)):
+        return "summary"
+
     # 1. HIGHEST PRIORITY: Exact phrase matches
     if any(greeting in query_lower for greeting in greeting_indicators):
         return "greeting"
@@ -666,72 +816,623 @@ REFINE_PROMPT = PromptTemplate(
 )
 
 
-from llama_index.core.response_synthesizers import ResponseMode
-from llama_index.core.node_parser import SentenceWindowNodeParser
-from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+# retrieval mode - "hybrid" fuses vector and BM25 legs (RRF), "vector" is embeddings only
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+
+# index build configuration (window size, top k, cutoff, embedding model) - pick values with benchmarks/tune_index.py
+INDEX_CONFIG = index_config(
+    window_size=int(os.getenv("RAG_WINDOW_SIZE", DEFAULT_INDEX_CONFIG["window_size"])),
+    similarity_top_k=int(os.getenv("RAG_SIMILARITY_TOP_K", DEFAULT_INDEX_CONFIG["similarity_top_k"])),
+    similarity_cutoff=float(os.getenv("RAG_SIMILARITY_CUTOFF", DEFAULT_INDEX_CONFIG["similarity_cutoff"])),
+    embed_model=EMBED_MODEL,
+    embed_backend=EMBED_BACKEND,
+    # duplicate pages (MinHash similarity at or above this) are indexed once - 0 keeps every page
+    dedup_threshold=float(os.getenv("RAG_DEDUP_THRESHOLD", DEFAULT_INDEX_CONFIG["dedup_threshold"])),
+)
 
 
 # Smart document processing function - REPLACES EXISTING create_enhanced_index
-def create_smart_index(docs):
+def create_smart_index(docs, config=None):
     """Create an intelligent index with advanced processing"""
-    
-    # Enhanced node parsing with larger windows for better context
-    node_parser = SentenceWindowNodeParser.from_defaults(
-        window_size=5,  # Increased from 3
-        window_metadata_key="window",
-        original_text_metadata_key="original_text"
-    )
-    
-    nodes = node_parser.get_nodes_from_documents(docs)
-    index = VectorStoreIndex(nodes)
-    
-    # Smart retriever with higher similarity threshold
-    retriever = VectorIndexRetriever(
-        index=index,
-        similarity_top_k=5,  # Increased from 3
-    )
-    
-    # Enhanced response synthesizer
-    response_synthesizer = get_response_synthesizer(
-        response_mode=ResponseMode.REFINE,
-        streaming=False,  # Disable streaming for better quality
-        use_async=True
+    config = dict(config or INDEX_CONFIG)
+
+    with REINDEX_SECONDS.time(stage="dedup"):
+        content_hashes = content_hashes_for(docs)
+        duplicates = DuplicateIndex(config["dedup_threshold"])
+        unique_docs = drop_duplicates(duplicates, docs, content_hashes)
+    with REINDEX_SECONDS.time(stage="parse"):
+        nodes = parse_nodes(unique_docs, config)
+    with REINDEX_SECONDS.time(stage="embed"):
+        index = DenseIndex.build(nodes, Settings.embed_model, meta={
+            "documents_count": len(content_hashes), "index_config": config, "content_hashes": content_hashes
+        }, duplicates=duplicates)
+
+    return index, create_query_engine(index)
+
+
+def content_hashes_for(docs) -> dict:
+    """{file name: sha256} of the files behind loaded documents (one document per page)"""
+    paths = {doc.metadata.get("file_path") for doc in docs}
+    return {os.path.basename(path): file_hash(path) for path in sorted(p for p in paths if p) if os.path.exists(path)}
+
+
+def drop_duplicates(duplicates, docs, content_hashes, known_hashes=None):
+    """Pages of docs not already in duplicates - copies of indexed files and pages are only aliased"""
+    kept, dropped = duplicates.filter_documents(docs, content_hashes, known_hashes)
+    for kind, count in dropped.items():
+        if count:
+            INGEST_DUPLICATES_TOTAL.inc(count, kind=kind)
+    if dropped["files"] or dropped["pages"]:
+        print(f"♻️ Skipped {dropped['files']} duplicate files and {dropped['pages']} duplicate pages")
+    return kept
+
+
+class RetrievalEngine:
+    """The retriever and postprocessors run_smart_query / finish_smart_query need over one index
+
+    synthesis is not part of it - refine_answer makes the LLM calls.
+    """
+
+    def __init__(self, retriever, node_postprocessors):
+        self.retriever = retriever
+        self.node_postprocessors = node_postprocessors
+
+
+def create_query_engine(index):
+    """Wire retriever and postprocessors over a built (or loaded) index
+
+    Retrieval settings come from the index's own config - indexes persisted before it was
+    stored were built with the defaults.
+    """
+    config = index.meta.get("index_config") or DEFAULT_INDEX_CONFIG
+    return RetrievalEngine(
+        make_retriever(index, config, RETRIEVAL_MODE),
+        make_postprocessors(index, config, RETRIEVAL_MODE),
     )
-    
-    # Smart post-processing
-    postprocessors = [
-        SimilarityPostprocessor(similarity_cutoff=0.6),  # Filter low-quality matches
-        MetadataReplacementPostProcessor(target_metadata_key="window")
+
+
+def run_smart_query(engine, query_str, rows=None):
+    """Run the RAG pipeline stage by stage so each stage can be measured.
+
+    rows scopes retrieval to a subset of index rows (document filters).
+    """
+    query_bundle, nodes = retrieve_nodes(engine, query_str, rows)
+    return finish_smart_query(engine, query_bundle, nodes)
+
+
+def retrieve_nodes(engine, query_str, rows=None):
+    """(query bundle, retrieved nodes) - the first two stages of run_smart_query"""
+
+    # embed once up front - the retriever reuses a precomputed embedding
+    with tracing.span("embed_query"), QUERY_EMBEDDING_SECONDS.time():
+        embedding = Settings.embed_model.get_query_embedding(query_str)
+    query_bundle = QueryBundle(query_str=query_str, embedding=embedding)
+
+    with tracing.span("retrieve", retriever=RETRIEVAL_MODE) as retrieve_span, \
+            RETRIEVAL_SECONDS.time(retriever=RETRIEVAL_MODE):
+        retriever = engine.retriever if rows is None else engine.retriever.scoped(rows)
+        nodes = retriever.retrieve(query_bundle)
+        retrieve_span.set(nodes=len(nodes), scoped_rows=-1 if rows is None else len(rows))
+    deadlines.check("retrieve")
+    return query_bundle, nodes
+
+
+def finish_smart_query(engine, query_bundle, nodes):
+    """Postprocess retrieved nodes and synthesize the answer"""
+    nodes = postprocess_nodes(engine, query_bundle, nodes)
+    deadlines.check("postprocess")
+
+    with tracing.span("synthesize", mode="refine") as synthesize_span:
+        response = refine_answer(query_bundle, nodes)
+        synthesize_span.set(steps=len(response.source_nodes), partial=response.metadata["partial"])
+    return response
+
+
+def postprocess_nodes(engine, query_bundle, nodes):
+    for postprocessor in engine.node_postprocessors:
+        name = type(postprocessor).__name__
+        with tracing.span(name) as postprocess_span, POSTPROCESS_SECONDS.time(postprocessor=name):
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+            postprocess_span.set(nodes=len(nodes))
+    return nodes
+
+
+def refine_answer(query_bundle, nodes, model=MODEL_GLOBAL):
+    """REFINE synthesis, one LLM call per node - stops with the answer so far at the deadline
+
+    Same prompts and call sequence as llamaindex's REFINE synthesizer (the engine's own
+    synthesizer only serves engine.query), run here so every step goes through complete_text:
+    deadline, hedging and the local fallback apply per call.
+    """
+    query_str = query_bundle.query_str
+    answer, used = None, []
+    served = {"model": model, "backend": None, "partial": False}
+    for node in nodes:
+        context = node.node.get_content(metadata_mode=MetadataMode.LLM)
+        if answer is None:
+            prompt = SMART_QA_PROMPT.format(context_str=context, query_str=query_str)
+        else:
+            prompt = REFINE_PROMPT.format(query_str=query_str, existing_answer=answer, context_msg=context)
+        try:
+            text, served["model"], served["backend"] = complete_text(prompt, model)
+        except DeadlineExceeded as e:
+            if answer is None:
+                raise
+            print(f"⏱️ Deadline hit after {len(used)}/{len(nodes)} REFINE steps, returning the answer so far")
+            DEADLINE_EXCEEDED_TOTAL.inc(stage=e.stage, outcome="partial")
+            served["partial"] = True
+            break
+        used.append(node)
+        if text.strip():
+            answer = text
+    return RAGResponse(answer if answer is not None else "Empty Response", source_nodes=used, metadata=served)
+
+
+
+def embed_queries(queries):
+    """Query embeddings for many queries, in one forward pass where the model allows it"""
+    embed_model = Settings.embed_model
+    batch_embed = getattr(embed_model, "_embed", None)
+    if batch_embed is not None:
+        try:
+            # HuggingFaceEmbedding applies the model's query instruction through prompt_name
+            return batch_embed(list(queries), prompt_name="query")
+        except TypeError:
+            pass
+    return [embed_model.get_query_embedding(query) for query in queries]
+
+
+# - - -
+
+# Shared index - with RAG_WORKERS > 1 (or RAG_INDEX_DIR set) the index is built once,
+# published under RAG_INDEX_DIR and memory-mapped read-only by every worker process
+
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "1"))
+# tenant partitions are persisted, so they need the index dir too
+RAG_TENANTS = os.getenv("RAG_TENANTS", "0") == "1"
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR") or ("./index_store" if RAG_WORKERS > 1 or RAG_TENANTS else None)
+index_store = IndexStore(RAG_INDEX_DIR) if RAG_INDEX_DIR else None
+index_version = None
+
+# Precomputed per-document summaries, kept next to the shared index when there is one
+RAG_SUMMARIES = os.getenv("RAG_SUMMARIES", "1") == "1"
+SUMMARY_DIR = os.getenv("RAG_SUMMARY_DIR") or (
+    str(Path(RAG_INDEX_DIR) / "summaries") if RAG_INDEX_DIR else "./summary_cache"
+)
+
+
+def summary_complete(prompt):
+    """LLM call of the summary builder - bulk work, so it waits for rate-limit capacity"""
+    wait_token = llm_rate_wait.set(True)
+    try:
+        return Settings.llm.complete(prompt).text
+    finally:
+        llm_rate_wait.reset(wait_token)
+
+
+summary_store = SummaryStore(SUMMARY_DIR, summary_complete) if RAG_SUMMARIES else None
+
+
+def attach_shared_index(version):
+    """Swap this worker onto a published version - in-flight queries keep the old engine"""
+    global index, query_engine, index_version
+    shared_index = index_store.load(version)
+    index, query_engine, index_version = shared_index, create_query_engine(shared_index), version
+    track_index(shared_index)
+    print(f"📦 Serving shared index version {version} ({len(shared_index)} nodes)")
+
+
+def track_index(served):
+    INDEX_DOCUMENTS.set(served.meta.get("documents_count", 0))
+    INDEX_NODES.set(len(served))
+
+
+def refresh_shared_index():
+    """Pick up a version another worker published (one small file read when unchanged)"""
+    if index_store is None:
+        return
+    version = index_store.current_version()
+    if version and version != index_version:
+        attach_shared_index(version)
+
+
+def build_index(reuse_published=False):
+    """(Re)build the index from the documents directory.
+
+    With a shared store the build runs under the store's lock and is published for all
+    workers; reuse_published attaches to an up-to-date published version instead.
+    """
+    global documents, index, query_engine
+
+    if index_store is None:
+        with REINDEX_SECONDS.time(stage="load"):
+            documents = SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
+        if documents:
+            index, query_engine = create_smart_index(documents)
+            track_index(index)
+            if summary_store is not None:
+                summary_store.refresh(documents)
+        return
+
+    fingerprint = directory_fingerprint(documents_path, shared_filter())
+    with index_store.build_lock():
+        meta = index_store.current_meta()
+        stored_config = (meta or {}).get("index_config") or DEFAULT_INDEX_CONFIG
+        if reuse_published and meta and meta.get("fingerprint") == fingerprint \
+                and same_build(stored_config, INDEX_CONFIG):
+            version = meta["version"]
+            if stored_config != INDEX_CONFIG:
+                # only retrieval settings changed - republish the same nodes and embeddings
+                with REINDEX_SECONDS.time(stage="publish"):
+                    retuned = index_store.load(version)
+                    retuned.meta["index_config"] = dict(INDEX_CONFIG)
+                    version = index_store.publish(retuned)
+        else:
+            with REINDEX_SECONDS.time(stage="load"):
+                documents = load_shared_documents()
+            if not documents:
+                return
+            new_index, _ = create_smart_index(documents)
+            if summary_store is not None:
+                # tenant documents are summarized too - only prune when the shared index is everything
+                if tenant_directory is None:
+                    summary_store.refresh(documents)
+                else:
+                    summary_store.add(documents)
+            new_index.meta["fingerprint"] = fingerprint
+            with REINDEX_SECONDS.time(stage="publish"):
+                version = index_store.publish(new_index)
+    # serve the memory-mapped copy, not the private one just built
+    attach_shared_index(version)
+
+
+# Tenant partitions (RAG_TENANTS=1) - documents reindexed or uploaded with a user_id belong to
+# that user and are indexed in the user's own partition; everything else stays in the shared
+# index. A query searches the caller's partition plus (RAG_TENANT_SHARED) the shared index,
+# so retrieval cost follows the tenant's corpus. Partitions load on first use and the least
+# recently used are dropped past RAG_PARTITION_MEMORY_MB.
+
+TENANT_SHARED = os.getenv("RAG_TENANT_SHARED", "1") == "1"
+TENANTS_DIR = Path(RAG_INDEX_DIR) / "tenants" if RAG_TENANTS else None
+tenant_directory = TenantDirectory(TENANTS_DIR / "owners.json") if RAG_TENANTS else None
+
+
+def shared_filter():
+    """File name predicate for the shared index - None (every file) without tenants"""
+    if tenant_directory is None:
+        return None
+    owned = tenant_directory.owned()
+    return lambda name: name not in owned
+
+
+def load_shared_documents():
+    if tenant_directory is None:
+        return SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
+    include = shared_filter()
+    files = [
+        str(path) for path in sorted(documents_path.iterdir())
+        if path.is_file() and not path.name.startswith(".") and include(path.name)
     ]
-    
-    # Create intelligent query engine
-    query_engine = RetrieverQueryEngine.from_args(
-        retriever=retriever,
-        response_synthesizer=response_synthesizer,
-        node_postprocessors=postprocessors
-    )
-    
-    # Apply smart prompts
-    query_engine.update_prompts({
-        "response_synthesizer:text_qa_template": SMART_QA_PROMPT,
-        "response_synthesizer:refine_template": REFINE_PROMPT
-    })
-    
-    return index, query_engine
+    return SimpleDirectoryReader(input_files=files).load_data() if files else []
+
+
+def visible_to(request, file_name) -> bool:
+    """Whether a document may be used to answer this request"""
+    if tenant_directory is None:
+        return True
+    owner = tenant_directory.owner(file_name)
+    return owner == tenant_key(request.user_id) or (owner is None and TENANT_SHARED)
+
+
+def partition_store(tenant):
+    return IndexStore(TENANTS_DIR / tenant)
+
+
+def partition_version(tenant):
+    # no store directory is created for users that never uploaded anything
+    return partition_store(tenant).current_version() if (TENANTS_DIR / tenant).exists() else None
+
+
+def build_partition(tenant):
+    """(Re)build a tenant's partition from its documents and publish it - returns the version"""
+    names = set(tenant_directory.files(tenant))
+    files = [str(documents_path / name) for name in sorted(names) if (documents_path / name).exists()]
+    if not files:
+        return None
+    store = partition_store(tenant)
+    with store.build_lock():
+        with REINDEX_SECONDS.time(stage="load"):
+            tenant_documents = SimpleDirectoryReader(input_files=files).load_data()
+        partition, _ = create_smart_index(tenant_documents)
+        partition.meta["fingerprint"] = directory_fingerprint(documents_path, names.__contains__)
+        partition.meta["tenant"] = tenant
+        with REINDEX_SECONDS.time(stage="publish"):
+            version = store.publish(partition)
+    partitions.invalidate(tenant)
+    if summary_store is not None:
+        summary_store.add(tenant_documents)
+    print(f"🏠 Built partition {tenant}: {len(files)} documents, {len(partition)} nodes")
+    return version
+
+
+class TenantPartition:
+    """A loaded tenant partition, with its engine merged with the shared index on demand"""
+
+    def __init__(self, partition_index, engine):
+        self.index = partition_index
+        self.engine = engine
+        self._merged = (None, None)  # (shared engine, merged engine)
+
+    def with_shared(self, shared_index, shared_engine):
+        partner, merged = self._merged
+        if partner is not shared_engine:
+            merged = PartitionedEngine([(self.index, self.engine), (shared_index, shared_engine)])
+            self._merged = (shared_engine, merged)
+        return merged
+
+
+class PartitionedEngine:
+    """The retriever and postprocessors run_smart_query / finish_smart_query need, over several partitions"""
+
+    def __init__(self, parts):
+        self.indexes = [part_index for part_index, _ in parts]
+        top_k = max(
+            (part_index.meta.get("index_config") or DEFAULT_INDEX_CONFIG)["similarity_top_k"] for part_index in self.indexes
+        )
+        self.retriever = PartitionedRetriever([engine.retriever for _, engine in parts], similarity_top_k=top_k)
+        self.node_postprocessors = [
+            PartitionedPostprocessor([(part_index, engine.node_postprocessors) for part_index, engine in parts])
+        ]
+
+
+def load_partition(tenant):
+    """(TenantPartition, version, bytes) for the partition cache - rebuilt first when missing or stale"""
+    names = set(tenant_directory.files(tenant))
+    if not names:
+        return None
+    store = partition_store(tenant)
+    meta = store.current_meta()
+    if meta is None or meta.get("fingerprint") != directory_fingerprint(documents_path, names.__contains__):
+        if build_partition(tenant) is None:
+            return None
+    version = store.current_version()
+    partition_index = store.load(version)
+    return TenantPartition(partition_index, create_query_engine(partition_index)), version, partition_index.nbytes
+
+
+partitions = PartitionCache(
+    load_partition, partition_version, int(float(os.getenv("RAG_PARTITION_MEMORY_MB", "1024")) * 2 ** 20)
+) if RAG_TENANTS else None
+
+
+def partition_scope(request):
+    """(engine, indexes) a request retrieves from - None when it has no documents at all"""
+    own = partitions.get(tenant_key(request.user_id)) if partitions is not None else None
+    shared = query_engine is not None and (own is None or TENANT_SHARED)
+    if own is not None and shared:
+        return own.with_shared(index, query_engine), [own.index, index]
+    if own is not None:
+        return own.engine, [own.index]
+    if shared and (tenant_directory is None or TENANT_SHARED):
+        return query_engine, [index]
+    return None
+
+
+# Incremental ingestion - one uploaded file parsed, embedded and appended to the live index
+# (published as a new version when shared) instead of a full rebuild. One file at a time.
+ingest_lock = threading.Lock()
+ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+
+def searched_tenants(tenant):
+    """Upload destinations whose documents a tenant's queries search - None is the shared index"""
+    if tenant is None:
+        return (None,)
+    return (tenant, None) if TENANT_SHARED else (tenant,)
+
+
+def indexed_copy_of(content_hash, tenant=None):
+    """Name of an indexed file with this content, if any - among the documents the uploader can search"""
+    hashes = {}
+    if None in searched_tenants(tenant):
+        refresh_shared_index()
+        hashes.update(index.meta.get("content_hashes", {}) if index is not None else {})
+    if tenant is not None:
+        meta = partition_store(tenant).current_meta() if partition_version(tenant) else None
+        hashes.update((meta or {}).get("content_hashes", {}))
+    return next((name for name, known in hashes.items() if known == content_hash), None)
+
+
+def ingest_file(path, content_hash, tenant=None) -> int:
+    """Append one file to the index (or the tenant's partition); returns the number of nodes added"""
+    global documents
+
+    with ingest_lock:
+        with REINDEX_SECONDS.time(stage="load"):
+            new_documents = SimpleDirectoryReader(input_files=[str(path)]).load_data()
+        if not new_documents:
+            return 0
+
+        if tenant is not None:
+            tenant_directory.assign([path.name], tenant)
+            store = partition_store(tenant)
+            with store.build_lock():
+                meta = store.current_meta()
+                if meta is not None:
+                    target = store.load(meta["version"])
+                    nodes_added = append_documents(target, new_documents, path.name, content_hash)
+                    target.meta["fingerprint"] = directory_fingerprint(
+                        documents_path, set(tenant_directory.files(tenant)).__contains__
+                    )
+                    with REINDEX_SECONDS.time(stage="publish"):
+                        store.publish(target)
+            if meta is None:
+                # first document of this tenant - build_partition summarizes it
+                build_partition(tenant)
+                return (partition_store(tenant).current_meta() or {}).get("node_count", 0)
+        elif index_store is None:
+            if index is None:
+                build_index()
+                return len(index) if index is not None else 0
+            # the live index grows in place - DenseIndex.add orders its updates for readers
+            nodes_added = append_documents(index, new_documents, path.name, content_hash)
+            documents = (documents or []) + new_documents
+            INDEX_DOCUMENTS.set(index.meta["documents_count"])
+            INDEX_NODES.set(len(index))
+        else:
+            with index_store.build_lock():
+                refresh_shared_index()
+                if index is None:
+                    target = None
+                else:
+                    target = index_store.load(index_version)
+                    nodes_added = append_documents(target, new_documents, path.name, content_hash)
+                    target.meta["fingerprint"] = directory_fingerprint(documents_path, shared_filter())
+                    with REINDEX_SECONDS.time(stage="publish"):
+                        version = index_store.publish(target)
+            if target is None:
+                build_index()
+                return len(index) if index is not None else 0
+            attach_shared_index(version)
+
+    if summary_store is not None:
+        summary_store.add(new_documents)
+    return nodes_added
+
+
+def append_documents(target, new_documents, file_name, content_hash) -> int:
+    config = target.meta.get("index_config") or DEFAULT_INDEX_CONFIG
+    if not same_build(config, INDEX_CONFIG):
+        raise ValueError(
+            f"Index was built with {config.get('embed_model')} ({config.get('embed_backend')}, "
+            f"window {config.get('window_size')}) - reindex before adding documents"
+        )
+    with REINDEX_SECONDS.time(stage="dedup"):
+        unique_documents = drop_duplicates(
+            target.duplicates, new_documents, {file_name: content_hash}, target.meta.get("content_hashes")
+        )
+    with REINDEX_SECONDS.time(stage="parse"):
+        nodes = parse_nodes(unique_documents, config)
+    with REINDEX_SECONDS.time(stage="embed"):
+        target.add(nodes, Settings.embed_model)
+    target.meta.setdefault("content_hashes", {})[file_name] = content_hash
+    target.meta["documents_count"] = len(target.meta["content_hashes"])
+    return len(nodes)
 
 
+SUMMARY_ANSWER_PROMPT = (
+    "Answer the user's request using only these precomputed document summaries.\n"
+    "---------------------\n"
+    "{summaries}\n"
+    "---------------------\n"
+    "Request: {query}\n"
+    "Answer:"
+)
 
-# Initialize documents only if directory has files
-try:
-    documents = SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
-    if documents:
-        # Updated initialization
-        index, query_engine = create_smart_index(documents)
-        print(f"✅ Loaded {len(documents)} documents successfully")
+# requests that want the stored summary as-is - returned without any LLM call
+PLAIN_SUMMARY_WORDS = {
+    "summarize", "summarise", "summary", "tl;dr", "tldr", "give", "me", "a", "an", "the", "this", "that",
+    "it", "of", "my", "please", "document", "doc", "pdf", "file", "report", "uploaded", "can", "you",
+    "could", "short", "brief", "quick"
+}
+
+
+# summary requests naming none of the documents that want several of them
+MULTI_DOCUMENT_WORDS = {"all", "every", "each", "documents", "files", "them"}
+
+
+def plain_summary_request(request):
+    return set(re.findall(r"[a-z;']+", request.query.lower())) <= PLAIN_SUMMARY_WORDS
+
+
+def summary_targets(request):
+    """Summaries to answer from: filtered files, files named in the query, else the latest upload"""
+    available = [summary_store.get(name) for name in summary_store.file_names() if visible_to(request, name)]
+    available = [summary for summary in available if summary]
+    if not available:
+        return []
+    if request.filters is not None and request.filters.file_names:
+        wanted = {clean_file_name(name) for name in request.filters.file_names}
+        wanted |= set(request.filters.file_names)
+        return [s for s in available if s["file_name"] in wanted or s["title"] in wanted]
+
+    # whole words only - "all" must not match "small", a title "AI" not "explain"
+    words = summary_words(request.query)
+    named = [s for s in available if contains_phrase(words, summary_words(Path(s["title"]).stem))]
+    if named:
+        return named
+    latest_first = sorted(available, key=lambda s: s.get("uploaded") or 0, reverse=True)
+    if MULTI_DOCUMENT_WORDS.intersection(words):
+        return latest_first[:5]
+    return latest_first[:1]
+
+
+def summary_words(text):
+    """Lowercase words - underscores and other punctuation separate them"""
+    return re.findall(r"[^\W_]+", text.lower())
+
+
+def contains_phrase(words, phrase):
+    """phrase (a word list) appears in words as a contiguous run"""
+    size = len(phrase)
+    return size > 0 and any(words[i:i + size] == phrase for i in range(len(words) - size + 1))
+
+
+def answer_from_summaries(request, start_time):
+    """Answer a summary request from the cache - None when no summaries are ready yet"""
+    if summary_store is None:
+        return None
+    with tracing.span("summary_lookup") as lookup_span:
+        targets = summary_targets(request)
+        lookup_span.set(documents=len(targets))
+    if not targets:
+        return None
+
+    model, backend = MODEL_GLOBAL, "cache"
+    if plain_summary_request(request):
+        response_text = "\n\n".join(
+            s["document"] if len(targets) == 1 else f"{s['title']}:\n{s['document']}" for s in targets
+        )
+    else:
+        context = "\n\n".join(
+            f"Document: {s['title']}\n{s['document']}\n"
+            + "\n".join(f"[{section['pages']}] {section['summary']}" for section in s["sections"])
+            for s in targets
+        )
+        with tracing.span("synthesize", mode="summary"):
+            response_text, model, backend = complete_text(
+                SUMMARY_ANSWER_PROMPT.format(summaries=context, query=request.query)
+            )
+
+    sources = [
+        SourceInfo(
+            file_name=s["title"],
+            original_filename=s["file_name"],
+            page_label=f"1-{s['pages'][-1]['page_label']}" if s["pages"] else "N/A",
+            file_size=s["file_size"],
+            document_title=s["title"],
+            content_preview=s["document"][:100] + "..." if len(s["document"]) > 100 else s["document"],
+            relevance_score=1.0
+        )
+        for s in targets
+    ]
+    return QueryResponse(
+        response=response_text,
+        sources=sources,
+        model_used=model,
+        processing_time=time.time() - start_time,
+        backend=backend
+    )
+
+
+# Initialize documents only if directory has files - a startup step; a failed load is
+# retried by the first query that needs the index
+def load_index():
+    build_index(reuse_published=True)
+    if index is not None:
+        print(f"✅ Loaded {index.meta.get('documents_count', 0)} documents successfully")
     else:
         print("⚠️ No documents found in directory")
-except Exception as e:
-    print(f"⚠️ Error loading documents: {e}")
 
 # - - -
 
@@ -768,13 +1469,18 @@ except Exception as e:
 
 # FAST_API STUFF - setup and settings
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse, FileResponse
+from pydantic import BaseModel, field_validator
 import uvicorn
 from typing import Optional, List, Dict, Any
+from datetime import datetime
 
-app = FastAPI(title="RAG Service API", version="1.0.0")
+# startup / shutdown phases and readiness - steps are registered at the end of this file
+lifecycle = Lifecycle(drain_timeout=float(os.getenv("RAG_DRAIN_TIMEOUT", "30")))
+
+app = FastAPI(title="RAG Service API", version="1.0.0", lifespan=lifecycle.lifespan)
 
 # CORS middleware for frontend communication
 app.add_middleware(
@@ -788,6 +1494,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip / brotli (when installed) by Accept-Encoding - bodies under RAG_COMPRESS_MIN_BYTES go out as they are
+if os.getenv("RAG_COMPRESSION", "1") == "1":
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("RAG_COMPRESS_MIN_BYTES", "500")))
+
+# outermost - requests wait for readiness and are counted for the shutdown drain
+app.add_middleware(DrainMiddleware, lifecycle=lifecycle)
+
+# admin-only endpoints and headers need X-Admin-Token to match RAG_ADMIN_TOKEN (unset = no admin access)
+ADMIN_TOKEN = os.getenv("RAG_ADMIN_TOKEN")
+
+
+def is_admin(token) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(token):
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+# sampling profiler around /query and /reindex - per request with "X-Profile: 1" (admins only)
+# or for RAG_PROFILE_SAMPLE_RATE of all traffic; profiles are listed under /admin/profiles
+profiler = Profiler(
+    out_dir=os.getenv("RAG_PROFILE_DIR", "./profiles"),
+    interval=float(os.getenv("RAG_PROFILE_INTERVAL_MS", "10")) / 1000.0,
+    keep=int(os.getenv("RAG_PROFILE_KEEP", "50")),
+    sample_rate=float(os.getenv("RAG_PROFILE_SAMPLE_RATE", "0")),
+    fmt=os.getenv("RAG_PROFILE_FORMAT", "speedscope"),
+)
+
+
+def start_profile(target, x_profile, x_admin_token):
+    """Profile for this operation, or None - asking for one without the admin token is a 403"""
+    requested = x_profile is not None and x_profile.lower() in ("1", "true", "yes")
+    if requested:
+        require_admin(x_admin_token)
+    return profiler.start(target, requested=requested)
+
 class SourceInfo(BaseModel):
     file_name: str
     original_filename: Optional[str] = None
@@ -798,16 +1542,40 @@ class SourceInfo(BaseModel):
     relevance_score: Optional[float] = 0.0
 
 # Request/Response models
+class QueryFilters(BaseModel):
+    # scope retrieval to specific documents - names match with or without the upload prefix
+    file_names: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
 class QueryRequest(BaseModel):
     query: str
     user_id: str
     session_id: Optional[str] = None
+    filters: Optional[QueryFilters] = None
+    debug: bool = False  # return the per-stage timing breakdown
+    deadline_ms: Optional[int] = None  # time budget for this request - RAG_REQUEST_DEADLINE_MS when unset
+    fields: Optional[List[str]] = None  # QueryResponse fields to return - response is always included
+    slim: bool = False  # sources carry only file name, page and score
+
+    @field_validator("fields")
+    @classmethod
+    def known_fields(cls, fields):
+        unknown = sorted(set(fields or ()) - set(QueryResponse.model_fields))
+        if unknown:
+            raise ValueError(f"Unknown response fields: {', '.join(unknown)}")
+        return fields
 
 class QueryResponse(BaseModel):
     response: str
     sources: List[SourceInfo] = []  
     model_used: str
     processing_time: float
+    backend: Optional[str] = None  # "groq", "local" (fallback model) or "cache"; None for canned answers
+    partial: bool = False  # deadline hit mid-REFINE - the answer only covers the listed sources
+    debug: Optional[Dict[str, Any]] = None
 
 
 
@@ -824,13 +1592,29 @@ documents_path.mkdir(exist_ok=True)
 
 print(f"📁 Using documents directory: {documents_path}")
 
-# Update document loading
-documents = SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
-
 # Update reindex endpoint
 @app.post("/reindex")
-async def reindex_documents(request: dict = None):
+async def reindex_documents(
+    response: Response,
+    request: dict = None,
+    x_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+):
     """Reindex all documents in the configured directory"""
+    profile = start_profile("reindex", x_profile, x_admin_token)
+    if profile is None:
+        return reindex_all(request)
+
+    # reindexing runs on the event loop thread, which is what gets sampled
+    async with profile:
+        with profile.attach():
+            result = reindex_all(request)
+    if profile.file_name:
+        response.headers["X-Profile-Id"] = profile.file_name
+    return result
+
+
+def reindex_all(request):
     try:
         start_time = time.time()
         if not documents_path.exists():
@@ -848,16 +1632,22 @@ async def reindex_documents(request: dict = None):
         
         print(f"🔄 Reindexing {len(pdf_files)} documents from {documents_path}...")
         
-        # Reload documents from configured path
-        global documents, index, response_synthesizer, query_engine
-        documents = SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
-        
-        # Recreate index
-
-        # Updated initialization
-        index, query_engine = create_smart_index(documents)
+        # with tenant partitions, files reindexed for a user go to that user's partition
+        user_id = (request or {}).get("user_id")
+        new_files = [name for name in (request or {}).get("new_files") or [] if (documents_path / name).is_file()]
+        if tenant_directory is not None and user_id and new_files:
+            tenant = tenant_key(user_id)
+            tenant_directory.assign(new_files, tenant)
+            build_partition(tenant)
+            # files the shared index already picked up move out of it
+            if index is not None and set(new_files) & set(index.meta.get("content_hashes", {})):
+                build_index()
+        else:
+            # Reload documents and recreate index (published to all workers when shared)
+            build_index()
         
         processing_time = time.time() - start_time
+        REINDEX_SECONDS.observe(processing_time, stage="total")
         
         print(f"✅ Reindexing completed in {processing_time:.2f}s")
         
@@ -867,7 +1657,8 @@ async def reindex_documents(request: dict = None):
             "documents_count": len(pdf_files),
             "processing_time": processing_time,
             "indexed_files": [f.name for f in pdf_files],
-            "documents_path": str(documents_path)
+            "documents_path": str(documents_path),
+            "index_version": index_version
         }
         
     except Exception as e:
@@ -894,6 +1685,9 @@ async def get_documents_status():
                 "size": file_stat.st_size,
                 "modified": datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
                 "status": "indexed",
+                "summary_ready": summary_store is not None and summary_store.get(file_path.name) is not None,
+                "tenant": tenant_directory.owner(file_path.name) if tenant_directory is not None else None,
+                "duplicate_of": index.duplicates.files.get(file_path.name) if index is not None else None,
                 "path": str(file_path)
             })
         
@@ -901,7 +1695,10 @@ async def get_documents_status():
             "success": True,
             "documents": document_info,
             "total_count": len(document_info),
-            "documents_directory": str(documents_path)
+            "documents_directory": str(documents_path),
+            "index_config": index.meta.get("index_config") if index is not None else None,
+            "duplicates": index.duplicates.stats() if index is not None else None,
+            "partitions": partitions.stats() if partitions is not None else None
         }
         
     except Exception as e:
@@ -911,119 +1708,395 @@ async def get_documents_status():
         }
 
 
+# Streaming upload + incremental ingest - the frontend polls the returned job id
 
+UPLOAD_MAX_BYTES = int(os.getenv("RAG_UPLOAD_MAX_MB", "50")) * 2 ** 20
+upload_jobs = UploadJobs(Path(RAG_INDEX_DIR) / "uploads" if RAG_INDEX_DIR else None)
 
-# - - - 
 
-# Fast API - respone generation 
+@app.post("/documents/upload", status_code=202)
+async def upload_document(request: Request, user_id: Optional[str] = None):
+    """Stream a PDF (multipart field "file") into the documents directory and ingest it
 
-@app.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
+    With tenant partitions, user_id makes it that user's document.
+    """
+    tenant = tenant_key(user_id) if tenant_directory is not None and user_id else None
+    job = upload_jobs.create(total_bytes=int(request.headers.get("content-length") or 0) or None, tenant=tenant)
+    job_id = job["id"]
     try:
-        start_time = time.time()
-        
-        # Smart query classification
-        query_type = classify_query(request.query)
-        print(f"🧠 Query classified as: {query_type}")
-        
-        global documents, index, query_engine
-        
-        # Handle general knowledge queries directly when no documents available
-        # Handle greetings with personalized and contextual responses
+        part_path, file_name, content_hash = await receive_upload(
+            request, upload_jobs, job_id, documents_path, UPLOAD_MAX_BYTES
+        )
+    except UploadRejected as e:
+        upload_jobs.update(job_id, status="failed", error=str(e))
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    file_name = safe_file_name(file_name)
+    upload_jobs.update(job_id, file_name=file_name, sha256=content_hash)
+    if not file_name.lower().endswith(".pdf"):
+        part_path.unlink(missing_ok=True)
+        upload_jobs.update(job_id, status="failed", error="Only PDF documents are supported")
+        raise HTTPException(status_code=415, detail="Only PDF documents are supported")
+
+    duplicate = await asyncio.to_thread(indexed_copy_of, content_hash, tenant) \
+        or upload_jobs.active_with_hash(content_hash, exclude=job_id, tenants=searched_tenants(tenant))
+    if duplicate:
+        part_path.unlink(missing_ok=True)
+        print(f"♻️ Upload {file_name} matches {duplicate}, skipping ingestion")
+        return upload_jobs.view(upload_jobs.update(job_id, status="duplicate", duplicate_of=duplicate))
+
+    # same <ms timestamp>-<id>-<name> convention as frontend uploads
+    stored_name = f"{int(time.time() * 1000)}-{job_id[:9]}-{file_name}"
+    stored_path = documents_path / stored_name
+    os.replace(part_path, stored_path)
+    upload_jobs.update(job_id, status="queued", stored_name=stored_name)
+    ingest_pool.submit(run_ingest_job, job_id, stored_path, content_hash, tenant)
+    return upload_jobs.get(job_id)
+
+
+def run_ingest_job(job_id, path, content_hash, tenant=None):
+    upload_jobs.update(job_id, status="ingesting")
+    started = time.time()
+    try:
+        nodes_added = ingest_file(path, content_hash, tenant)
+    except Exception as e:
+        print(f"❌ Ingesting {path.name} failed: {e}")
+        upload_jobs.update(job_id, status="failed", error=f"Ingestion failed: {e}")
+        return
+    print(f"✅ Ingested {path.name} ({nodes_added} nodes) in {time.time() - started:.2f}s")
+    upload_jobs.update(job_id, status="indexed", nodes_added=nodes_added)
 
-        if query_type not in ["greeting", "farewell", "help_request", "creative", "comparison", 
-                      "conversational", "unclear", "general", "technical", "educational", 
-                      "personal", "transactional", "hybrid", "document_specific"]:
-            print(f"⚠️ Unhandled query type: {query_type}, defaulting to general knowledge")
-            query_type = "general"
-            
-        if query_type == "greeting":
-            greeting_responses = [
-                "Hello! I'm your intelligent AI assistant, ready to help you explore knowledge and analyze your documents. What would you like to discover today?",
-                "Hi there! I'm here to assist you with document analysis, answer questions, and provide insights. How can I help you?",
-                "Greetings! I'm your AI companion for research, analysis, and knowledge exploration. What's on your mind?",
-                "Welcome! I'm equipped to help you with document queries, general knowledge, creative brainstorming, and much more. What can I do for you?"
-            ]
-            
-            selected_response = random.choice(greeting_responses)
-            
-            return QueryResponse(
-                response=selected_response,
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle farewell messages
-        if query_type == "farewell":
-            farewell_responses = [
-                "Goodbye! It was great helping you today. Feel free to return anytime you need assistance with documents or have questions!",
-                "Take care! I'm always here when you need help with analysis, research, or just want to chat about interesting topics.",
-                "Until next time! Remember, I'm here 24/7 for all your document analysis and knowledge needs.",
-                "Farewell! Thanks for the engaging conversation. Come back anytime for more insights and assistance!"
-            ]
-            
-            selected_response = random.choice(farewell_responses)
-            
-            return QueryResponse(
-                response=selected_response,
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
+@app.get("/documents/upload/{job_id}")
+async def upload_status(job_id: str):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload id")
+    return job
 
-        # Enhanced help requests with comprehensive guidance
-        if query_type == "help_request":
-            help_response = """I'm here to provide comprehensive assistance! Here's what I can help you with:
 
-        📄 **Document Analysis & Research**
-        • Summarize and analyze uploaded documents (PDFs, reports, papers)
-        • Extract key information and insights from your files
-        • Answer specific questions about document content
-        • Compare information across multiple documents
 
-        🧠 **Knowledge & Information**
-        • Answer factual questions on any topic
-        • Provide detailed explanations of concepts
-        • Offer historical context and background information
-        • Define terms and explain complex ideas
 
-        💡 **Creative & Brainstorming**
-        • Generate creative ideas and solutions
-        • Help with writing and content creation
-        • Provide inspiration for projects
-        • Assist with problem-solving approaches
+# - - -
 
-        🔍 **Research & Analysis**
-        • Conduct comparative analysis
-        • Provide pros and cons evaluations
-        • Help with decision-making processes
-        • Offer different perspectives on topics
+# Answer cache for the direct-LLM branches - shared by all workers through one SQLite file
 
-        🛠️ **Technical Support**
-        • Troubleshoot issues and problems
-        • Explain technical concepts
-        • Provide step-by-step guidance
-        • Help with learning new skills
+RAG_ANSWER_CACHE = os.getenv("RAG_ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_PATH = os.getenv("RAG_ANSWER_CACHE_PATH") or str(Path(RAG_INDEX_DIR or ".") / "answer_cache.sqlite3")
+answer_cache = AnswerCache(
+    ANSWER_CACHE_PATH,
+    ttl_seconds=float(os.getenv("RAG_ANSWER_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("RAG_ANSWER_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=int(os.getenv("RAG_ANSWER_CACHE_MAX_MB", "50")) * 2 ** 20,
+) if RAG_ANSWER_CACHE else None
 
-        **How to get the best results:**
-        • Be specific about what you need
-        • Ask follow-up questions for clarification
-        • Upload relevant documents for analysis
-        • Feel free to ask for examples or elaboration
 
-        What specific area would you like help with today?"""
-            
-            return QueryResponse(
-                response=help_response,
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
+def cached_complete(branch, template, query, model=MODEL_GLOBAL):
+    """complete_text of template (a {query} prompt) through the answer cache; empty answers are never stored
+
+    Local fallback answers are stored under the local model, so a Groq answer is never
+    shadowed by one from the smaller model.
+    """
+    prompt = template.format(query=query)
+    if answer_cache is None:
+        return complete_text(prompt, model)
+    version = template_version(template)
+    key = AnswerCache.make_key(branch, model, query, version)
+    with tracing.span("answer_cache", branch=branch) as cache_span:
+        cached = answer_cache.get(key)
+        cache_span.set(hit=cached is not None)
+    if cached is not None:
+        return cached, model, "cache"
+    answer, model_used, backend = complete_text(prompt, model)
+    if answer.strip():
+        if model_used != model:
+            key = AnswerCache.make_key(branch, model_used, query, version)
+        answer_cache.put(key, branch, model_used, answer)
+    return answer, model_used, backend
+
+
+# - - -
+
+# Query handlers - one per classified query type, dispatched through query_router
+
+# model tiers handlers can ask for - all default to MODEL_GLOBAL until overridden
+MODEL_TIERS = {
+    "fast": os.getenv("RAG_MODEL_FAST") or MODEL_GLOBAL,
+    "default": MODEL_GLOBAL,
+    "large": os.getenv("RAG_MODEL_LARGE") or MODEL_GLOBAL,
+}
+_tier_llms = {}
+
+
+def llm_for(model):
+    """LLM client for a model name - Settings.llm for MODEL_GLOBAL, one cached Groq client per other model"""
+    if model == MODEL_GLOBAL:
+        return Settings.llm
+    llm = _tier_llms.get(model)
+    if llm is None:
+        llm = _tier_llms[model] = Groq(model=model, api_key=GROQ_KEY, api_base=GROQ_API_BASE, timeout=LLM_TIMEOUT)
+    return llm
+
+
+# local fallback - unset RAG_LOCAL_LLM_URL means Groq only
+LOCAL_LLM_URL = os.getenv("RAG_LOCAL_LLM_URL")
+LOCAL_LLM_MODEL = os.getenv("RAG_LOCAL_LLM_MODEL", "gemma:2b")
+local_llm = OllamaClient(
+    LOCAL_LLM_URL, LOCAL_LLM_MODEL, timeout=float(os.getenv("RAG_LOCAL_LLM_TIMEOUT", "60"))
+) if LOCAL_LLM_URL else None
+# hedging - a Groq call outlasting the RAG_HEDGE_PERCENTILE latency of recent calls is raced
+# against the local model, or without one a duplicate request to RAG_HEDGE_MODEL (same model
+# by default). RAG_HEDGE_AFTER_MS is the head start until enough latencies are recorded.
+# On by default only with a backup that has its own capacity - a local model or a distinct
+# hedge model; a duplicate to the same model spends the same quota just when Groq is slow.
+HEDGE_MODEL = os.getenv("RAG_HEDGE_MODEL")
+RAG_HEDGE = os.getenv(
+    "RAG_HEDGE", "1" if LOCAL_LLM_URL or (HEDGE_MODEL and HEDGE_MODEL != MODEL_GLOBAL) else "0"
+) == "1"
+HEDGE_AFTER = float(os.getenv("RAG_HEDGE_AFTER_MS", "2500")) / 1000.0
+hedged_llm = HedgedCompleter(
+    local_llm,
+    hedge_after=HEDGE_AFTER,
+    latency=LatencyTracker(
+        percentile=float(os.getenv("RAG_HEDGE_PERCENTILE", "95")),
+        default=HEDGE_AFTER,
+        floor=float(os.getenv("RAG_HEDGE_MIN_MS", "250")) / 1000.0,
+    ) if RAG_HEDGE else None,
+)
+
+
+def groq_complete(model):
+    """Completion callable for hedged_llm - timeout (seconds left) bounds the HTTP request"""
+    def complete(prompt, timeout=None):
+        # timeout=None would mean "no timeout" to the client - leave its own default then
+        return str(llm_for(model).complete(prompt, **({"timeout": timeout} if timeout is not None else {})))
+    return complete
+
+
+def complete_text(prompt, model=MODEL_GLOBAL):
+    """Direct completion within the request deadline, hedged - returns (text, model used, backend)"""
+    deadlines.check("llm")
+    estimated = estimate_llm_tokens({EventPayload.PROMPT: prompt})
+    limiter = rate_limiters.get(model)
+    # no point queueing behind the quota when the local model can answer right away
+    over_quota = limiter is not None and limiter.wait_time(estimated) > hedged_llm.hedge_delay()
+    hedge_model = HEDGE_MODEL or model
+    # a duplicate request is only sent while its model's quota has room for it
+    hedge_limiter = rate_limiters.get(hedge_model)
+    can_hedge = RAG_HEDGE and (hedge_limiter is None or hedge_limiter.wait_time(estimated) <= 0)
+    text, backend = hedged_llm.complete(
+        prompt,
+        groq_complete(model),
+        skip_primary=over_quota,
+        hedge=groq_complete(hedge_model) if can_hedge else None,
+        timeout=deadlines.remaining(),
+    )
+    if backend == "local":
+        return text, f"ollama:{local_llm.model}", "local"
+    return text, hedge_model if backend == "hedge" else model, "groq"
+
+
+def respond(text, start_time, sources=None, model=MODEL_GLOBAL, backend=None):
+    return QueryResponse(
+        response=text,
+        sources=sources or [],
+        model_used=model,
+        processing_time=time.time() - start_time,
+        backend=backend
+    )
+
+
+class CannedHandler(QueryHandler):
+    """Fixed answers, no LLM call - one picked at random when several are given"""
+
+    def __init__(self, query_type, responses):
+        super().__init__(query_type, cheap=True)
+        self.responses = responses
+
+    def handle(self, request, start_time):
+        return respond(random.choice(self.responses), start_time)
+
+
+class PromptHandler(QueryHandler):
+    """Direct LLM answer from the handler's prompt template"""
+
+    def model(self):
+        return MODEL_TIERS.get(self.model_tier, MODEL_GLOBAL)
+
+    def calls_llm(self, request):
+        if self.cache_policy != "answer" or answer_cache is None:
+            return True
+        key = AnswerCache.make_key(self.query_type, self.model(), request.query, template_version(self.prompt_template))
+        return not answer_cache.contains(key)
+
+    def complete(self, request):
+        """(text, model used, backend) for the request"""
+        if self.cache_policy == "answer":
+            return cached_complete(self.query_type, self.prompt_template, request.query, self.model())
+        return complete_text(self.prompt_template.format(query=request.query), self.model())
+
+    def handle(self, request, start_time):
+        text, model, backend = self.complete(request)
+        return respond(text, start_time, model=model, backend=backend)
+
+
+class GeneralHandler(PromptHandler):
+    """General knowledge - falls back to the raw Groq client on empty answers and apologises on errors"""
+
+    def handle(self, request, start_time):
+        print("🔄 Processing general knowledge query directly...")
+        try:
+            # Use direct LLM call for general knowledge
+            direct_response, model, backend = self.complete(request)
+
+            # Debug: Check if response is empty
+            print(f"DEBUG: Direct LLM response: {str(direct_response)[:100]}...")
+
+            if not str(direct_response).strip():
+                # Fallback if response is empty
+                try:
+                    groq_client = GroqClient(GROQ_KEY)
+                    direct_response = groq_client.chat(request.query, model=MODEL_GLOBAL)
+                    model, backend = MODEL_GLOBAL, "groq"
+                except Exception as groq_error:
+                    print(f"GroqClient also failed: {groq_error}")
+                    direct_response = "I apologize, but I'm having trouble processing your question right now."
+                    backend = None
+
+            return respond(str(direct_response), start_time, model=model, backend=backend)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"❌ Direct LLM call failed: {e}")
+            # Fallback response
+            return respond(
+                "I apologize, but I'm having trouble processing your general knowledge question right now.",
+                start_time
             )
 
-        # Enhanced creative requests with structured brainstorming
-        if query_type == "creative":
-            enhanced_prompt = f"""
+
+class SummaryHandler(QueryHandler):
+    """Whole-document summaries from the ingest-time cache (at most one LLM call)"""
+
+    def calls_llm(self, request):
+        # a plain "summarize" is the stored summary as-is; no summaries yet means retrieval
+        return summary_store is None or not plain_summary_request(request) or not summary_targets(request)
+
+    def handle(self, request, start_time):
+        summary_response = answer_from_summaries(request, start_time)
+        if summary_response is None:
+            print("⚠️ No precomputed summaries yet, answering through retrieval")
+        return summary_response
+
+
+class RetrievalHandler(QueryHandler):
+    """RAG over the document index - retrieval, postprocessing and REFINE synthesis"""
+
+    def handle(self, request, start_time):
+        print(f"🔍 Processing {self.query_type} query: {request.query[:50]}...")
+        scope = self.scope(request, start_time)
+        if isinstance(scope, QueryResponse):
+            return scope
+        engine, rows = scope
+        response = self.with_retries(lambda: run_smart_query(engine, request.query, rows))
+        return self.respond(response, start_time)
+
+    def scope(self, request, start_time):
+        """(engine, index rows) to answer from - or the final response when filters match nothing"""
+        global documents, index, query_engine
+
+        # Pick up an index another worker published after a reindex
+        refresh_shared_index()
+
+        # Initialize RAG system if needed (a tenant's own partition can do without the shared index)
+        own_partition = partitions is not None and partition_version(tenant_key(request.user_id)) is not None
+        if query_engine is None and not own_partition:
+            try:
+                print("🔄 Initializing smart RAG system...")
+                build_index(reuse_published=True)
+                if query_engine is None:
+                    raise HTTPException(
+                        status_code=503, 
+                        detail="No documents available. Please upload documents first."
+                    )
+                print(f"✅ Smart RAG system initialized with {index.meta.get('documents_count', 0)} documents")
+            except Exception as init_error:
+                print(f"❌ RAG initialization error: {str(init_error)}")
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Failed to initialize RAG system: {str(init_error)}"
+                )
+
+        scope = partition_scope(request)
+        if scope is None:
+            raise HTTPException(status_code=503, detail="No documents available. Please upload documents first.")
+        engine, active_indexes = scope
+
+        # resolve document filters to index rows before anything is scored
+        rows = None
+        if request.filters is not None:
+            filters = request.filters.model_dump()
+            rows = [active_index.rows_for(**filters) for active_index in active_indexes]
+            if all(part_rows is not None and not len(part_rows) for part_rows in rows):
+                return QueryResponse(
+                    response="No indexed documents match the requested filters. "
+                             "Check the file names, upload dates or page range.",
+                    sources=[],
+                    model_used=MODEL_GLOBAL,
+                    processing_time=time.time() - start_time
+                )
+            if len(active_indexes) == 1:
+                rows = rows[0]
+        return engine, rows
+
+    def answer_retrieved(self, engine, query_bundle, nodes, start_time):
+        """Finish a query whose nodes were already retrieved (batch and speculative paths)"""
+        print(f"🔍 Processing {self.query_type} query: {query_bundle.query_str[:50]}...")
+        response = self.with_retries(lambda: finish_smart_query(engine, query_bundle, nodes))
+        return self.respond(response, start_time)
+
+    @staticmethod
+    def with_retries(run, max_retries=2):
+        # Enhanced query processing with retry logic
+        for attempt in range(max_retries):
+            try:
+                return run()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                left = deadlines.remaining()
+                if attempt == max_retries - 1 or (left is not None and left <= 1):
+                    raise e
+                # under pressure a retry only adds load - let the client back off instead
+                if admission.queued or quota_wait() > 0:
+                    raise e
+                print(f"⚠️ Query attempt {attempt + 1} failed, retrying...")
+                time.sleep(1)
+
+    def respond(self, response, start_time):
+        processing_time = time.time() - start_time
+
+        # source fields are precomputed on each node at ingest - this is only a lookup
+        with tracing.span("format_sources", sources=len(response.source_nodes)):
+            enhanced_sources = [
+                SourceInfo(**node_source(node.node), relevance_score=node.score or 0.0)
+                for node in response.source_nodes
+            ]
+
+        print(f"✅ Smart query processed successfully in {processing_time:.2f}s")
+
+        served = response.metadata or {}
+        return QueryResponse(
+            response=str(response),
+            sources=enhanced_sources,
+            model_used=served.get("model", MODEL_GLOBAL),
+            processing_time=processing_time,
+            backend=served.get("backend", "groq"),
+            partial=served.get("partial", False)
+        )
+
+
+CREATIVE_PROMPT = """
             You are a highly creative AI assistant specializing in innovative thinking and brainstorming. 
             The user is seeking creative ideas, inspiration, or innovative solutions.
             
@@ -1034,22 +2107,12 @@ async def process_query(request: QueryRequest):
             4. Inspiration sources and references
             5. Next steps for development
             
-            User's creative request: {request.query}
+            User's creative request: {query}
             
             Deliver an inspiring, actionable, and comprehensive creative response:
             """
-            
-            direct_response = Settings.llm.complete(enhanced_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle comparison requests
-        if query_type == "comparison":
-            comparison_prompt = f"""
+COMPARISON_PROMPT = """
             You are an analytical AI assistant specializing in comparative analysis.
             Provide a comprehensive comparison that includes:
             1. Key similarities and differences
@@ -1058,117 +2121,106 @@ async def process_query(request: QueryRequest):
             4. Recommendations based on different needs
             5. Summary with clear conclusions
             
-            Comparison request: {request.query}
+            Comparison request: {query}
             
             Provide a detailed comparative analysis:
             """
-            
-            direct_response = Settings.llm.complete(comparison_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
-        
-        # Handle technical queries
-        if query_type == "technical":
-            technical_prompt = f"""
+
+TECHNICAL_PROMPT = """
             You are a technical support specialist. Provide detailed technical guidance and solutions.
             Address the technical issue comprehensively with troubleshooting steps and explanations.
             
-            Technical query: {request.query}
+            Technical query: {query}
             
             Provide comprehensive technical assistance:
             """
-            
-            direct_response = Settings.llm.complete(technical_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle educational queries
-        if query_type == "educational":
-            educational_prompt = f"""
+EDUCATIONAL_PROMPT = """
             You are an educational instructor. Provide comprehensive learning guidance and information.
             Structure your response to be educational, informative, and easy to understand.
             
-            Educational query: {request.query}
+            Educational query: {query}
             
             Provide detailed educational content:
             """
-            
-            direct_response = Settings.llm.complete(educational_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle personal queries
-        if query_type == "personal":
-            personal_prompt = f"""
+PERSONAL_PROMPT = """
             You are a personal advisor and coach. Provide helpful, personalized guidance and recommendations.
             Address the personal aspect of the query with empathy and practical advice.
             
-            Personal query: {request.query}
+            Personal query: {query}
             
             Provide personalized guidance and recommendations:
             """
-            
-            direct_response = Settings.llm.complete(personal_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle transactional queries
-        if query_type == "transactional":
-            transactional_prompt = f"""
+TRANSACTIONAL_PROMPT = """
             You are a shopping and purchasing advisor. Provide helpful guidance about products, services, and purchasing decisions.
             Include recommendations, comparisons, and practical purchasing advice.
             
-            Transactional query: {request.query}
+            Transactional query: {query}
             
             Provide comprehensive purchasing guidance:
             """
-            
-            direct_response = Settings.llm.complete(transactional_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # Handle conversational responses
-        if query_type == "conversational":
-            conversational_prompt = f"""
+CONVERSATIONAL_PROMPT = """
             You are a friendly, conversational AI assistant. Respond naturally and engagingly to the user's message.
             Maintain a helpful and positive tone while being informative.
             
-            User message: {request.query}
+            User message: {query}
             
             Provide a natural, conversational response:
             """
+
+GENERAL_PROMPT = """
+            You are a knowledgeable AI assistant. Provide a comprehensive, detailed answer to this question.
+            Be specific, include examples, and explain concepts clearly.
             
-            direct_response = Settings.llm.complete(conversational_prompt)
-            return QueryResponse(
-                response=str(direct_response),
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
+            Question: {query}
+            
+            Provide a thorough response:
+            """
 
-        # Handle unclear queries with clarification requests
-        if query_type == "unclear":
-            clarification_response = """I'd be happy to help, but I need a bit more information to provide the best assistance. 
+HELP_RESPONSE = """I'm here to provide comprehensive assistance! Here's what I can help you with:
+
+        📄 **Document Analysis & Research**
+        • Summarize and analyze uploaded documents (PDFs, reports, papers)
+        • Extract key information and insights from your files
+        • Answer specific questions about document content
+        • Compare information across multiple documents
+
+        🧠 **Knowledge & Information**
+        • Answer factual questions on any topic
+        • Provide detailed explanations of concepts
+        • Offer historical context and background information
+        • Define terms and explain complex ideas
+
+        💡 **Creative & Brainstorming**
+        • Generate creative ideas and solutions
+        • Help with writing and content creation
+        • Provide inspiration for projects
+        • Assist with problem-solving approaches
+
+        🔍 **Research & Analysis**
+        • Conduct comparative analysis
+        • Provide pros and cons evaluations
+        • Help with decision-making processes
+        • Offer different perspectives on topics
+
+        🛠️ **Technical Support**
+        • Troubleshoot issues and problems
+        • Explain technical concepts
+        • Provide step-by-step guidance
+        • Help with learning new skills
+
+        **How to get the best results:**
+        • Be specific about what you need
+        • Ask follow-up questions for clarification
+        • Upload relevant documents for analysis
+        • Feel free to ask for examples or elaboration
+
+        What specific area would you like help with today?"""
+
+CLARIFICATION_RESPONSE = """I'd be happy to help, but I need a bit more information to provide the best assistance. 
             Could you please:
             • Be more specific about what you're looking for
             • Provide more context about your question
@@ -1182,180 +2234,605 @@ async def process_query(request: QueryRequest):
             • "Compare the advantages of different approaches"
 
             What would you like to know more about?"""
-            
-            return QueryResponse(
-                response=clarification_response,
-                sources=[],
-                model_used=MODEL_GLOBAL,
-                processing_time=time.time() - start_time
-            )
 
-        # ADD THIS MISSING GENERAL KNOWLEDGE HANDLER ⬇️
-        if query_type == "general":
-            print("🔄 Processing general knowledge query directly...")
-            
-            enhanced_prompt = f"""
-            You are a knowledgeable AI assistant. Provide a comprehensive, detailed answer to this question.
-            Be specific, include examples, and explain concepts clearly.
-            
-            Question: {request.query}
-            
-            Provide a thorough response:
-            """
-            
-            try:
-                # Use direct LLM call for general knowledge
-                direct_response = Settings.llm.complete(enhanced_prompt)
-                processing_time = time.time() - start_time
-                
-                # Debug: Check if response is empty
-                print(f"DEBUG: Direct LLM response: {str(direct_response)[:100]}...")
-                
-                if not str(direct_response).strip():
-                    # Fallback if response is empty
-                    try:
-                        groq_client = GroqClient(GROQ_KEY)
-                        direct_response = groq_client.chat(request.query, model=MODEL_GLOBAL)
-                    except Exception as groq_error:
-                        print(f"GroqClient also failed: {groq_error}")
-                        direct_response = "I apologize, but I'm having trouble processing your question right now."
-                
-                return QueryResponse(
-                    response=str(direct_response),
-                    sources=[],
-                    model_used=MODEL_GLOBAL,
-                    processing_time=processing_time
-                )
-            except Exception as e:
-                print(f"❌ Direct LLM call failed: {e}")
-                # Fallback response
-                return QueryResponse(
-                    response="I apologize, but I'm having trouble processing your general knowledge question right now.",
-                    sources=[],
-                    model_used=MODEL_GLOBAL,
-                    processing_time=time.time() - start_time
-                )
+query_router = QueryRouter(default_type="general")
+query_router.register(CannedHandler("greeting", [
+    "Hello! I'm your intelligent AI assistant, ready to help you explore knowledge and analyze your documents. What would you like to discover today?",
+    "Hi there! I'm here to assist you with document analysis, answer questions, and provide insights. How can I help you?",
+    "Greetings! I'm your AI companion for research, analysis, and knowledge exploration. What's on your mind?",
+    "Welcome! I'm equipped to help you with document queries, general knowledge, creative brainstorming, and much more. What can I do for you?"
+]))
+query_router.register(CannedHandler("farewell", [
+    "Goodbye! It was great helping you today. Feel free to return anytime you need assistance with documents or have questions!",
+    "Take care! I'm always here when you need help with analysis, research, or just want to chat about interesting topics.",
+    "Until next time! Remember, I'm here 24/7 for all your document analysis and knowledge needs.",
+    "Farewell! Thanks for the engaging conversation. Come back anytime for more insights and assistance!"
+]))
+query_router.register(CannedHandler("help_request", [HELP_RESPONSE]))
+query_router.register(CannedHandler("unclear", [CLARIFICATION_RESPONSE]))
+query_router.register(PromptHandler("creative", CREATIVE_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("comparison", COMPARISON_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("technical", TECHNICAL_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("educational", EDUCATIONAL_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("personal", PERSONAL_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("transactional", TRANSACTIONAL_PROMPT, cache_policy="answer"))
+query_router.register(PromptHandler("conversational", CONVERSATIONAL_PROMPT, cache_policy="answer"))
+query_router.register(GeneralHandler("general", GENERAL_PROMPT, cache_policy="answer"))
+query_router.register(SummaryHandler("summary", uses_documents=True, fallback="document_specific"))
+query_router.register(RetrievalHandler("hybrid", SMART_QA_PROMPT, needs_retrieval=True))
+query_router.register(RetrievalHandler("document_specific", SMART_QA_PROMPT, needs_retrieval=True))
 
 
-        # Initialize RAG system if needed
-        if query_engine is None:
-            try:
-                print("🔄 Initializing smart RAG system...")
-                documents = SimpleDirectoryReader(input_dir=str(documents_path)).load_data()
-                if not documents:
-                    raise HTTPException(
-                        status_code=503, 
-                        detail="No documents available. Please upload documents first."
-                    )
-                index, query_engine = create_smart_index(documents)  # Using smart index
-                print(f"✅ Smart RAG system initialized with {len(documents)} documents")
-            except Exception as init_error:
-                print(f"❌ RAG initialization error: {str(init_error)}")
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"Failed to initialize RAG system: {str(init_error)}"
-                )
+# - - - 
 
-        print(f"🔍 Processing {query_type} query: {request.query[:50]}...")
-        
-        # Enhanced query processing with retry logic
-        max_retries = 2
-        response = None
-        for attempt in range(max_retries):
-            try:
-                response = query_engine.query(request.query)
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise e
-                print(f"⚠️ Query attempt {attempt + 1} failed, retrying...")
-                time.sleep(1)
-        
-        processing_time = time.time() - start_time
+# Fast API - respone generation 
 
-        # Enhanced source processing (keep your existing source processing logic)
-        enhanced_sources = []
-        try:
-            for node in response.source_nodes:
-                try:
-                    # Extract metadata safely
-                    metadata = getattr(node.node, 'metadata', {}) if hasattr(node.node, 'metadata') else {}
-                    
-                    # Get file information
-                    file_path = metadata.get('file_path', '')
-                    file_name = metadata.get('file_name', '')
-                    
-                    if not file_name and file_path:
-                        file_name = os.path.basename(file_path)
-                    
-                    # Clean filename (remove timestamp prefix)
-                    if file_name:
-                        clean_name = re.sub(r'^\d+-[a-z0-9]+-', '', file_name)
-                        if not clean_name:
-                            clean_name = file_name
-                    else:
-                        clean_name = "Unknown Document"
-
-                    # Get content preview safely
-                    content_text = getattr(node.node, 'text', '') if hasattr(node.node, 'text') else ''
-                    content_preview = content_text[:100] + "..." if len(content_text) > 100 else content_text
-
-                    # Create SourceInfo object
-                    source_info = SourceInfo(
-                        file_name=clean_name,
-                        original_filename=file_name,
-                        page_label=metadata.get('page_label', 'N/A'),
-                        file_size=metadata.get('file_size', 0),
-                        document_title=metadata.get('document_title', clean_name),
-                        content_preview=content_preview,
-                        relevance_score=getattr(node, 'score', 0.0) if hasattr(node, 'score') else 0.0
-                    )
-                    
-                    enhanced_sources.append(source_info)
-                    
-                except Exception as e:
-                    print(f"Error processing individual source: {e}")
-                    enhanced_sources.append(SourceInfo(
-                        file_name="Document Reference",
-                        page_label="N/A",
-                        file_size=0,
-                        content_preview="Content not available",
-                        relevance_score=0.0
-                    ))
-        except Exception as e:
-            print(f"Error processing sources: {e}")
-            enhanced_sources = []
+# default time budget per /query, from arrival to response - 0 disables the deadline
+REQUEST_DEADLINE_MS = float(os.getenv("RAG_REQUEST_DEADLINE_MS", "30000"))
 
-        print(f"✅ Smart query processed successfully in {processing_time:.2f}s")
+
+def request_budget(request, default_ms=REQUEST_DEADLINE_MS):
+    """Seconds a request may take, or None for no deadline"""
+    budget_ms = request.deadline_ms if request.deadline_ms is not None else default_ms
+    return budget_ms / 1000.0 if budget_ms and budget_ms > 0 else None
+
+
+def quota_wait() -> float:
+    """Seconds until the default model's quota has room for a call - 0 when the local model can take over"""
+    limiter = rate_limiters.get(MODEL_GLOBAL)
+    if limiter is None:
+        return 0.0
+    wait = limiter.wait_time(RATE_LIMIT_COMPLETION_TOKENS)
+    # called on the event loop - the cached health flag only, never a probe
+    if wait and local_llm is not None and local_llm.known_available():
+        return 0.0
+    return wait
+
+
+# admission control - queries needing the LLM or retrieval wait for one of a fixed number of
+# slots (per worker process); canned answers skip it. Queue time counts against the deadline.
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("RAG_MAX_CONCURRENT_QUERIES", "8")),
+    per_user=int(os.getenv("RAG_MAX_QUERIES_PER_USER", "2")),
+    max_queue=int(os.getenv("RAG_QUERY_QUEUE_SIZE", "32")),
+    queue_timeout=float(os.getenv("RAG_QUERY_QUEUE_TIMEOUT_MS", "5000")) / 1000.0,
+    quota_wait=quota_wait if RAG_RATE_LIMIT else None,
+)
+
+# speculative retrieval - off, always, or adaptive (only while most speculations get used)
+speculation_policy = SpeculationPolicy(
+    mode=os.getenv("RAG_SPECULATIVE_RETRIEVAL", "adaptive"),
+    min_words=int(os.getenv("RAG_SPECULATION_MIN_WORDS", "3")),
+    min_hit_rate=float(os.getenv("RAG_SPECULATION_MIN_HIT_RATE", "0.3")),
+)
+
+@app.post("/query", response_model=QueryResponse)
+async def process_query(
+    request: QueryRequest,
+    x_request_id: Optional[str] = Header(None),
+    x_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+):
+    profile = start_profile("query", x_profile, x_admin_token)
+    if profile is None:
+        return await traced_query(request, x_request_id)
+
+    # the profile is written off the event loop; the header only names a file that exists
+    async with profile:
+        result = await traced_query(request, x_request_id)
+    if profile.file_name:
+        result.headers["X-Profile-Id"] = profile.file_name
+    return result
+
+
+async def traced_query(request, x_request_id):
+    # traced when asked for (debug=true) or sampled via RAG_TRACE_SAMPLE_RATE
+    trace = tracing.start_trace(x_request_id, force=request.debug)
+    if trace is None:
+        return query_json(await answer_query(request), request)
+
+    with trace:
+        response = await answer_query(request)
+    if request.debug:
+        response.debug = trace.summary()
+    return query_json(response, request)
+
+
+SLIM_SOURCE_FIELDS = {"original_filename", "file_size", "document_title", "content_preview"}
+
+
+def response_exclude(request):
+    """model_dump exclude spec for the fields / slim options of a request"""
+    exclude = {}
+    if request.fields is not None:
+        keep = set(request.fields) | {"response"} | ({"debug"} if request.debug else set())
+        exclude.update({name: True for name in QueryResponse.model_fields if name not in keep})
+    if request.slim and "sources" not in exclude:
+        exclude["sources"] = {"__all__": SLIM_SOURCE_FIELDS}
+    return exclude or None
+
+
+def query_json(response, request):
+    # serialized once by pydantic-core - skips the response_model revalidation and jsonable_encoder pass
+    return Response(response.model_dump_json(exclude=response_exclude(request)), media_type="application/json")
+
+
+def retrieve_scoped(request, start_time):
+    """(engine, query bundle, nodes) for a document query - or the final response when filters match nothing"""
+    scope = query_router.resolve("document_specific").scope(request, start_time)
+    if isinstance(scope, QueryResponse):
+        return scope
+    engine, rows = scope
+    return (engine, *retrieve_nodes(engine, request.query, rows))
+
+
+def retrieval_ready(request):
+    """An index to retrieve from is loaded - speculation must never be what builds one"""
+    if query_engine is not None:
+        return True
+    return partitions is not None and partition_version(tenant_key(request.user_id)) is not None
+
+
+def speculate(request, start_time):
+    """Start retrieve_scoped in a worker thread right away - before the caller's next await"""
+    def run():
+        with tracing.span("speculative_retrieval"):
+            return retrieve_scoped(request, start_time)
+
+    # run_in_executor submits immediately (to_thread would wait for the next loop turn);
+    # the copied context carries the deadline, trace and LLM call counter over
+    context = contextvars.copy_context()
+    future = asyncio.get_running_loop().run_in_executor(None, context.run, profiling.bind(run))
+    return Speculation(speculation_policy, future)
+
+
+def dispatch_retrieved(handler, request, start_time, retrieved=None):
+    """query_router.dispatch, finishing from an earlier retrieval when there is one"""
+    if retrieved is None:
+        return query_router.dispatch(handler, request, start_time)
+    if isinstance(retrieved, QueryResponse):
+        return handler, retrieved
+    return handler, handler.answer_retrieved(*retrieved, start_time)
+
+
+def select_handler(request, query_type):
+    handler = query_router.resolve(query_type)
+    if handler.query_type != query_type:
+        print(f"⚠️ Unhandled query type: {query_type}, defaulting to general knowledge")
+
+    # document filters are an explicit ask to answer from those documents
+    if request.filters is not None and not handler.uses_documents:
+        print(f"📎 Filters present, routing {query_type} query to document retrieval")
+        handler = query_router.resolve("document_specific")
+    return handler
+
+
+async def answer_query(request: QueryRequest) -> QueryResponse:
+    start_time = time.time()
+    query_type = "unclassified"
+
+    # count every LLM call made on behalf of this request
+    llm_calls = [0]
+    counter_token = llm_call_counter.set(llm_calls)
+    deadline_token = deadlines.start(request_budget(request))
+    speculation = None
+
+    try:
+        # retrieval starts now, in parallel with everything up to the handler - dropped if unused
+        busy = admission.queued > 0 or (admission.max_concurrent and admission.in_flight >= admission.max_concurrent)
+        if retrieval_ready(request) and speculation_policy.should_speculate(
+                request.query, filtered=request.filters is not None, busy=busy):
+            speculation = speculate(request, start_time)
+
+        # Smart query classification
+        with tracing.span("classify_query") as classify_span, CLASSIFICATION_SECONDS.time():
+            query_type = classify_query(request.query)
+            classify_span.set(query_type=query_type)
+        QUERY_TYPE_TOTAL.inc(query_type=query_type)
+        print(f"🧠 Query classified as: {query_type}")
         
-        return QueryResponse(
-            response=str(response),
-            sources=enhanced_sources,
-            model_used=MODEL_GLOBAL,
-            processing_time=processing_time
-        )
+        handler = select_handler(request, query_type)
+        if speculation is not None and not handler.needs_retrieval:
+            speculation.discard()
+        if handler.cheap:
+            handler, response = query_router.dispatch(handler, request, start_time)
+        else:
+            # over quota, answers needing no LLM call (cached, stored summaries) are still served
+            calls_llm = True
+            if admission.quota_exhausted():
+                calls_llm = await asyncio.to_thread(handler.calls_llm, request)
+            async with admission.admit(request.user_id, max_wait=deadlines.remaining(), calls_llm=calls_llm):
+                retrieved = await speculation.take() if speculation is not None and handler.needs_retrieval else None
+                # off the event loop, so queued requests can still time out and be turned away
+                # (bound to the request's profile, if any - the worker thread is what gets sampled)
+                handler, response = await asyncio.to_thread(
+                    profiling.bind(dispatch_retrieved), handler, request, start_time, retrieved
+                )
+        query_type = handler.query_type
+        return response
         
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        print(f"🚦 Query rejected ({e.reason}), retry after {e.retry_after}s")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        print(f"⏱️ {e}")
+        DEADLINE_EXCEEDED_TOTAL.inc(stage=e.stage, outcome="failed")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"❌ Query processing error: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
+    finally:
+        if speculation is not None:
+            speculation.discard()  # rejected or failed before the handler got to it
+        deadlines.reset(deadline_token)
+        llm_call_counter.reset(counter_token)
+        LLM_CALLS_PER_REQUEST.observe(llm_calls[0])
+        QUERY_SECONDS.observe(time.time() - start_time, query_type=query_type)
+
+
+
+# NDJSON records are plain dicts - orjson when installed
+try:
+    import orjson
+
+    dump_json = orjson.dumps
+except ImportError:
+    def dump_json(record):
+        return json.dumps(record).encode("utf-8")
+
+
+# - - -
+
+# Batch queries - one classification pass, one embedding batch and one matrix retrieval for
+# every RAG-bound item, then items answered concurrently with LLM calls held to the rate limits
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    concurrency: int = 4  # items answered at once
+
+
+@app.post("/query/batch")
+async def process_query_batch(batch: BatchQueryRequest):
+    """Answer many queries; results stream back as NDJSON lines in completion order"""
+    items = batch.queries
+    started = [time.time()] * len(items)
+
+    with CLASSIFICATION_SECONDS.time():
+        query_types = [classify_query(item.query) for item in items]
+    handlers = [select_handler(item, query_type) for item, query_type in zip(items, query_types)]
+    for query_type in query_types:
+        QUERY_TYPE_TOTAL.inc(query_type=query_type)
+
+    async def stream():
+        retrieved = await asyncio.to_thread(retrieve_batch_items, items, handlers, started)
+        semaphore = asyncio.Semaphore(max(1, batch.concurrency))
 
+        async def run(i):
+            async with semaphore:
+                return await asyncio.to_thread(answer_batch_item, i, items[i], handlers[i], started[i], retrieved.get(i))
+
+        for finished in asyncio.as_completed([run(i) for i in range(len(items))]):
+            yield dump_json(await finished) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def retrieve_batch_items(items, handlers, started):
+    """Embed and retrieve every RAG-bound item at once: {item index: (engine, bundle, nodes) or response}"""
+    retrieved = {}
+    pending = []
+    for i, (item, handler) in enumerate(zip(items, handlers)):
+        if not handler.needs_retrieval:
+            continue
+        try:
+            scope = handler.scope(item, started[i])
+        except HTTPException as e:
+            retrieved[i] = e
+            continue
+        if isinstance(scope, QueryResponse):
+            retrieved[i] = scope
+        else:
+            pending.append((i, scope))
+    if not pending:
+        return retrieved
+
+    try:
+        with QUERY_EMBEDDING_SECONDS.time():
+            embeddings = embed_queries([items[i].query for i, _ in pending])
+        bundles = [QueryBundle(query_str=items[i].query, embedding=emb) for (i, _), emb in zip(pending, embeddings)]
+
+        # one retrieve_batch per engine - normally all items share the live one
+        by_engine = {}
+        for position, (i, (engine, rows)) in enumerate(pending):
+            by_engine.setdefault(id(engine), (engine, []))[1].append((position, i, rows))
+        for engine, members in by_engine.values():
+            with RETRIEVAL_SECONDS.time(retriever=f"{RETRIEVAL_MODE}_batch"):
+                results = engine.retriever.retrieve_batch(
+                    [bundles[position] for position, _, _ in members], [rows for _, _, rows in members]
+                )
+            for (position, i, _), nodes in zip(members, results):
+                retrieved[i] = (engine, bundles[position], nodes)
+    except Exception as e:
+        # items without a batch result are answered one by one through their handler
+        print(f"⚠️ Batch retrieval failed, answering items individually: {e}")
+    return retrieved
+
+
+def answer_batch_item(position, item, handler, start_time, retrieved):
+    """One batch item as an NDJSON record (runs in a worker thread)"""
+    llm_calls = [0]
+    counter_token = llm_call_counter.set(llm_calls)
+    wait_token = llm_rate_wait.set(True)
+    # bulk items only get a deadline when they ask for one
+    deadline_token = deadlines.start(request_budget(item, default_ms=0))
+    query_type = handler.query_type
+    record = {"index": position, "query_type": query_type}
+    try:
+        if isinstance(retrieved, Exception):
+            raise retrieved
+        if isinstance(retrieved, QueryResponse):
+            response = retrieved
+        elif retrieved is not None:
+            response = handler.answer_retrieved(*retrieved, start_time)
+        else:
+            handler, response = query_router.dispatch(handler, item, start_time)
+            query_type = record["query_type"] = handler.query_type
+        record.update(status=200, result=response.model_dump(exclude=response_exclude(item)))
+    except HTTPException as e:
+        record.update(status=e.status_code, error=str(e.detail))
+    except RateLimitExceeded as e:
+        record.update(status=429, error=str(e), retry_after=round(e.retry_after, 1))
+    except DeadlineExceeded as e:
+        DEADLINE_EXCEEDED_TOTAL.inc(stage=e.stage, outcome="failed")
+        record.update(status=504, error=str(e))
+    except Exception as e:
+        print(f"❌ Batch item {position} failed: {str(e)}")
+        record.update(status=500, error=f"Query processing failed: {str(e)}")
+    finally:
+        deadlines.reset(deadline_token)
+        llm_rate_wait.reset(wait_token)
+        llm_call_counter.reset(counter_token)
+        LLM_CALLS_PER_REQUEST.observe(llm_calls[0])
+        QUERY_SECONDS.observe(time.time() - start_time, query_type=query_type)
+    return record
+
+
+# - - -
+
+# Retrieval only - the passages /query would answer from (same scoping, retriever and
+# postprocessors) without any LLM call. Batches embed every query in one pass and retrieve
+# with one matrix product per engine, like /query/batch.
+
+class RetrieveRequest(BaseModel):
+    query: str
+    user_id: str
+    filters: Optional[QueryFilters] = None
+    top_k: Optional[int] = None  # passages returned - the index's similarity_top_k caps it
+    include_text: bool = True  # passage text; sources and scores only when false
+
+class RetrievedPassage(BaseModel):
+    text: Optional[str] = None      # sentence window, as the LLM would have seen it
+    sentence: Optional[str] = None  # the matched sentence itself
+    score: float
+    source: SourceInfo
+
+class RetrieveResponse(BaseModel):
+    query: str
+    passages: List[RetrievedPassage] = []
+    processing_time: float
+
+class RetrieveBatchRequest(BaseModel):
+    queries: List[RetrieveRequest]
+
+
+def retrieve_passages(request, start_time, retrieved=None):
+    """Postprocessed passages for one request - retrieved here unless the batch path already did"""
+    if retrieved is None:
+        retrieved = retrieve_scoped(request, start_time)
+    if isinstance(retrieved, QueryResponse):
+        return RetrieveResponse(query=request.query, processing_time=time.time() - start_time)
+    engine, query_bundle, nodes = retrieved
+
+    # the window postprocessor replaces node text - keep the matched sentences first
+    sentences = {node.node.node_id: node.node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes}
+    nodes = postprocess_nodes(engine, query_bundle, nodes)
+    if request.top_k is not None:
+        nodes = nodes[:max(0, request.top_k)]
+    passages = [
+        RetrievedPassage(
+            text=node.node.get_content(metadata_mode=MetadataMode.NONE) if request.include_text else None,
+            sentence=sentences.get(node.node.node_id) if request.include_text else None,
+            score=node.score or 0.0,
+            source=SourceInfo(**node_source(node.node), relevance_score=node.score or 0.0),
+        )
+        for node in nodes
+    ]
+    processing_time = time.time() - start_time
+    QUERY_SECONDS.observe(processing_time, query_type="retrieve")
+    return RetrieveResponse(query=request.query, passages=passages, processing_time=processing_time)
+
+
+def retrieve_batch(items, start_time):
+    """/retrieve for every item (in a worker thread) - one record per item, in request order"""
+    handlers = [query_router.resolve("document_specific")] * len(items)
+    retrieved = retrieve_batch_items(items, handlers, [start_time] * len(items))
+    records = []
+    for position, item in enumerate(items):
+        record = {"index": position}
+        try:
+            found = retrieved.get(position)
+            if isinstance(found, Exception):
+                raise found
+            # items without a batch result are retrieved one by one
+            response = retrieve_passages(item, start_time, found)
+            record.update(status=200, result=response.model_dump())
+        except HTTPException as e:
+            record.update(status=e.status_code, error=str(e.detail))
+        except Exception as e:
+            print(f"❌ Batch retrieval item {position} failed: {str(e)}")
+            record.update(status=500, error=f"Retrieval failed: {str(e)}")
+        records.append(record)
+    return records
+
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def retrieve(request: RetrieveRequest):
+    """Passages, scores and sources for a query - no answer synthesis"""
+    start_time = time.time()
+    try:
+        # embedding and scoring are CPU work - off the event loop, but no admission slot:
+        # that queue is for LLM-bound work
+        response = await asyncio.to_thread(profiling.bind(retrieve_passages), request, start_time)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Retrieval error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Retrieval failed: {str(e)}")
+    return Response(response.model_dump_json(), media_type="application/json")
+
+
+@app.post("/retrieve/batch")
+async def retrieve_many(batch: RetrieveBatchRequest):
+    """/retrieve for many queries at once - {"results": [record per query, in order]}"""
+    start_time = time.time()
+    records = await asyncio.to_thread(retrieve_batch, batch.queries, start_time)
+    return Response(dump_json({"results": records, "processing_time": time.time() - start_time}),
+                    media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
+    """Liveness - fails only when a required startup step did"""
+    if lifecycle.phase == "failed":
+        return Response(dump_json({"status": "failed", "lifecycle": lifecycle.stats()}),
+                        status_code=503, media_type="application/json")
+    if lifecycle.ready:
+        refresh_shared_index()
     return {
         "status": "healthy", 
+        "lifecycle": lifecycle.stats(),
         "model": MODEL_GLOBAL,
-        "documents_loaded": len(documents) if documents else 0,
-        "documents_directory": str(documents_path)
+        "documents_loaded": index.meta.get("documents_count", 0) if index is not None else 0,
+        "documents_directory": str(documents_path),
+        "index_version": index_version,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "local_llm": {"model": local_llm.model, "available": local_llm.available()} if local_llm is not None else None,
+        "admission": admission.stats(),
+        "speculation": speculation_policy.stats(),
+        "partitions": partitions.stats() if partitions is not None else None,
+        "pid": os.getpid()
     }
 
+@app.get("/ready")
+async def readiness():
+    """Readiness - 200 once models, index and warmup are done, 503 before that and while draining"""
+    stats = lifecycle.stats()
+    return Response(dump_json(stats), status_code=200 if lifecycle.ready else 503, media_type="application/json")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Stored profiles, newest first"""
+    require_admin(x_admin_token)
+    return {"format": profiler.fmt, "keep": profiler.keep, "profiles": profiler.profiles()}
+
+
+@app.get("/admin/profiles/{name}")
+async def get_profile(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Download a profile - open speedscope files at https://www.speedscope.app, feed collapsed
+    stacks to flamegraph.pl"""
+    require_admin(x_admin_token)
+    path = profiler.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
+
+
+# - - -
+
+# Lifecycle - startup steps run in this order in the background from the lifespan, shutdown
+# steps in this order once requests have drained (see lifecycle.py)
+
+WARMUP_QUERY = "According to the document, what are the key points of the report?"
+
+
+def warmup():
+    """One synthetic query through classification, embedding, retrieval and postprocessing (no LLM
+    call), so the first real request does not pay for lazy init, kernel selection and first allocations"""
+    classify_query(WARMUP_QUERY)
+    embedding = Settings.embed_model.get_query_embedding(WARMUP_QUERY)
+    Settings.embed_model.get_text_embedding_batch([WARMUP_QUERY])
+    if query_engine is not None:
+        query_bundle = QueryBundle(query_str=WARMUP_QUERY, embedding=embedding)
+        nodes = query_engine.retriever.retrieve(query_bundle)
+        for postprocessor in query_engine.node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+        sources = [SourceInfo(**node_source(node.node), relevance_score=node.score or 0.0) for node in nodes]
+    else:
+        sources = []
+    QueryResponse(response="", sources=sources, model_used=MODEL_GLOBAL, processing_time=0.0).model_dump_json()
+    print(f"🔥 Warmed up ({len(sources)} nodes retrieved)")
+
+
+def drain_ingest():
+    # queued uploads still run - their jobs would otherwise stay "queued" forever
+    ingest_pool.shutdown(wait=True)
+
+
+def close_summaries():
+    summary_store.close(timeout=lifecycle.drain_timeout)
+
+
+def close_llm_clients():
+    hedged_llm.close()
+    if local_llm is not None:
+        local_llm.close()
+    for llm in [Settings.llm, *_tier_llms.values()]:
+        client = getattr(llm, "_client", None)  # the OpenAI-compatible http client of llamaindex's Groq
+        if client is not None:
+            client.close()
+
+
+lifecycle.add_startup("models", load_models)
+lifecycle.add_startup("index", load_index, required=False)
+if os.getenv("RAG_WARMUP", "1") == "1":
+    lifecycle.add_startup("warmup", warmup, phase="warming", required=False)
+
+lifecycle.add_shutdown("ingest", drain_ingest)
+if summary_store is not None:
+    lifecycle.add_shutdown("summaries", close_summaries)
+lifecycle.add_shutdown("llm_clients", close_llm_clients)
+if answer_cache is not None:
+    lifecycle.add_shutdown("answer_cache", answer_cache.close)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if RAG_WORKERS > 1:
+        # build and publish the shared index once here, then hand over to the uvicorn
+        # supervisor (exec drops this process's private copy of model and index) - each
+        # worker's startup attaches to the published version
+        load_models()
+        load_index()
+        print(f"🚀 Starting {RAG_WORKERS} workers on shared index {index_version}")
+        os.execv(sys.executable, [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--app-dir", str(Path(__file__).resolve().parent),
+            "--host", "0.0.0.0", "--port", "8000",
+            "--workers", str(RAG_WORKERS),
+            "--timeout-graceful-shutdown", str(int(lifecycle.drain_timeout))
+        ])
+    # open connections get the drain timeout to finish before the lifespan shutdown runs
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=int(lifecycle.drain_timeout))
 
 
 # - - - - -
@@ -0,0 +1,270 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# - - - - -
+
+# Minimal Prometheus-style metrics registry
+# text exposition format : https://prometheus.io/docs/instrumenting/exposition_formats/
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (non cumulative), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, [("le", repr(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+
+# - - - - -
+
+# RAG pipeline instruments
+
+QUERY_SECONDS = Histogram(
+    "rag_query_seconds", "End-to-end /query latency", ["query_type"]
+)
+QUERY_TYPE_TOTAL = Counter(
+    "rag_query_type_total", "Queries by classified type", ["query_type"]
+)
+CLASSIFICATION_SECONDS = Histogram(
+    "rag_classification_seconds", "Time spent in classify_query",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+QUERY_EMBEDDING_SECONDS = Histogram(
+    "rag_query_embedding_seconds", "Time spent embedding the query text"
+)
+RETRIEVAL_SECONDS = Histogram(
+    "rag_retrieval_seconds", "Time spent in the retriever", ["retriever"]
+)
+POSTPROCESS_SECONDS = Histogram(
+    "rag_postprocess_seconds", "Time spent in each node postprocessor", ["postprocessor"]
+)
+LLM_CALLS_PER_REQUEST = Histogram(
+    "rag_llm_calls_per_request", "Number of LLM calls made while serving one request",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "rag_llm_request_seconds", "LLM call latency", ["model"]
+)
+LLM_TOKENS_TOTAL = Counter(
+    "rag_llm_tokens_total", "LLM tokens consumed", ["model", "kind"]
+)
+LLM_BACKEND_TOTAL = Counter(
+    "rag_llm_backend_total", "Completions by serving backend (primary/local/hedge) and why", ["backend", "reason"]
+)
+LLM_ABANDONED_TOTAL = Counter(
+    "rag_llm_abandoned_total", "Calls left running after another backend answered or the deadline passed", ["backend", "reason"]
+)
+LLM_CALLS_IN_FLIGHT = Gauge(
+    "rag_llm_calls_in_flight", "Calls running (or queued) in the hedging pool, abandoned ones included"
+)
+LLM_HEDGE_THRESHOLD_SECONDS = Gauge(
+    "rag_llm_hedge_threshold_seconds", "Current primary latency after which a call is hedged"
+)
+DEADLINE_EXCEEDED_TOTAL = Counter(
+    "rag_deadline_exceeded_total", "Requests that ran out of time, by stage and outcome (partial/failed)",
+    ["stage", "outcome"]
+)
+ADMISSION_TOTAL = Counter(
+    "rag_admission_total", "/query admission decisions (admitted/queued/user_limit/rate_limited/queue_full/queue_timeout)",
+    ["outcome"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth", "Queries waiting for a slot"
+)
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "rag_admission_queue_seconds", "Time admitted queries spent waiting for a slot"
+)
+QUERIES_IN_FLIGHT = Gauge(
+    "rag_queries_in_flight", "Queries currently holding a slot"
+)
+PARTITIONS_LOADED = Gauge(
+    "rag_partitions_loaded", "Tenant index partitions currently loaded"
+)
+PARTITION_BYTES = Gauge(
+    "rag_partition_bytes", "Estimated memory held by loaded tenant partitions"
+)
+PARTITION_LOADS_TOTAL = Counter(
+    "rag_partition_loads_total", "Tenant partitions loaded (or reloaded after a new version)"
+)
+PARTITION_EVICTIONS_TOTAL = Counter(
+    "rag_partition_evictions_total", "Tenant partitions evicted to stay within the memory budget"
+)
+CACHE_REQUESTS_TOTAL = Counter(
+    "rag_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"]
+)
+CACHE_HIT_RATIO = Gauge(
+    "rag_cache_hit_ratio", "Hit ratio since process start, per cache", ["cache"]
+)
+CACHE_ENTRIES = Gauge(
+    "rag_cache_entries", "Entries currently held, per cache", ["cache"]
+)
+REINDEX_SECONDS = Histogram(
+    "rag_reindex_seconds", "Reindex duration by stage", ["stage"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+)
+INDEX_DOCUMENTS = Gauge(
+    "rag_index_documents", "Documents currently in the index"
+)
+INDEX_NODES = Gauge(
+    "rag_index_nodes", "Nodes currently in the index"
+)
+PROFILES_TOTAL = Counter(
+    "rag_profiles_total", "Operations run under the sampling profiler", ["target", "trigger"]
+)
+INGEST_DUPLICATES_TOTAL = Counter(
+    "rag_ingest_duplicates_total", "Files (exact copies) and pages (near duplicates) skipped at ingest", ["kind"]
+)
+RETRIEVAL_DUPLICATES_TOTAL = Counter(
+    "rag_retrieval_duplicates_total", "Retrieved hits dropped for repeating the text of a better hit"
+)
+SPECULATIVE_RETRIEVAL_TOTAL = Counter(
+    "rag_speculative_retrieval_total",
+    "Retrievals started before classification by outcome (used/discarded/failed), and queries not speculated (skipped)",
+    ["outcome"]
+)
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+from metrics import PROFILES_TOTAL
+
+# - - - - -
+
+# On-demand sampling profiler - for a request (or reindex) being profiled, one background
+# thread reads the stacks of the threads doing its work (sys._current_frames) every few ms
+# and the result is written as a speedscope profile or as collapsed stacks (flamegraph.pl,
+# speedscope and most flame graph viewers read both). Nothing runs while no profile is open.
+#
+# Only threads attached to a profile are sampled, so concurrent requests stay out of it -
+# attach() the current thread, or bind() a function before handing it to a thread pool.
+# Samples land at the interpreter's switch interval at best (5 ms by default) when the
+# profiled thread holds the GIL.
+
+PROFILE_FORMATS = ("speedscope", "collapsed")
+PROFILE_SUFFIXES = {"speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}
+MAX_DEPTH = 128
+MAX_SAMPLES = 100_000  # per profile - about 16 minutes at 10 ms
+
+_current_profile = contextvars.ContextVar("rag_profile", default=None)
+
+
+def short_path(filename) -> str:
+    """Frame file name without the install prefix (site-packages/..., or the file name for our code)"""
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.rsplit(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+class Profile:
+    """Stacks sampled from the threads attached to one profiled operation"""
+
+    def __init__(self, profiler, target, trigger):
+        self.profiler = profiler
+        self.target = target
+        self.trigger = trigger
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.file_name = None
+        self.threads = Counter()  # thread ident -> attach depth
+        self.frames = {}          # (name, file, line) -> frame index
+        self.samples = []         # (stack of frame indices, root first; seconds since the previous sample)
+        self.started = None
+        self.duration = 0.0
+        self._token = None
+
+    @contextmanager
+    def attach(self):
+        """Sample the current thread while the block runs"""
+        ident = threading.get_ident()
+        with self.profiler._lock:
+            self.threads[ident] += 1
+        try:
+            yield self
+        finally:
+            with self.profiler._lock:
+                self.threads[ident] -= 1
+                if not self.threads[ident]:
+                    del self.threads[ident]
+
+    def _record(self, frame, elapsed):
+        if len(self.samples) >= MAX_SAMPLES:
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self.frames.get(key)
+            if index is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append((tuple(stack), elapsed))
+
+    def collapsed(self) -> str:
+        names = [
+            f"{name} ({short_path(filename)}:{line})".replace(";", ":")
+            for name, filename, line in self.frames
+        ]
+        counts = Counter(stack for stack, _ in self.samples)
+        return "".join(f"{';'.join(names[i] for i in stack)} {count}\n" for stack, count in counts.items())
+
+    def speedscope(self) -> dict:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.target} {self.profile_id}",
+            "exporter": "rag_service",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [{"name": name, "file": filename, "line": line} for name, filename, line in self.frames],
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": self.target,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": [list(stack) for stack, _ in self.samples],
+                "weights": [round(elapsed, 6) for _, elapsed in self.samples],
+            }],
+        }
+
+    def _begin(self):
+        self._token = _current_profile.set(self)
+        self.started = time.perf_counter()
+        self.profiler._open(self)
+        return self
+
+    def _end(self):
+        self.profiler._close(self)
+        self.duration = time.perf_counter() - self.started
+        _current_profile.reset(self._token)
+
+    # `async with` on the event loop - serializing and writing the profile happens in a
+    # worker thread, so a profiled request does not stall the others; file_name is set once
+    # the write is done. Plain `with` (worker threads) saves inline.
+
+    async def __aenter__(self):
+        return self._begin()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._end()
+        await asyncio.to_thread(self.profiler.save, self)
+        return False
+
+    def __enter__(self):
+        return self._begin()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._end()
+        self.profiler.save(self)
+        return False
+
+
+class Profiler:
+
+    def __init__(self, out_dir="./profiles", interval=0.01, keep=50, sample_rate=0.0, fmt="speedscope"):
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format {fmt!r}, expected one of {PROFILE_FORMATS}")
+        self.out_dir = Path(out_dir)
+        self.interval = interval        # seconds between samples
+        self.keep = keep                # newest profiles kept on disk, older ones are deleted
+        self.sample_rate = sample_rate  # fraction of operations profiled without asking
+        self.fmt = fmt
+        self._open_profiles = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def start(self, target, requested=False):
+        """A Profile to run the operation under, or None when this one is not profiled"""
+        if requested:
+            return Profile(self, target, "header")
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return Profile(self, target, "sampled")
+        return None
+
+    def _open(self, profile):
+        with self._lock:
+            self._open_profiles.append(profile)
+            if self._sampler is None:
+                self._wake.clear()
+                self._sampler = threading.Thread(target=self._sample_loop, name="rag-profiler", daemon=True)
+                self._sampler.start()
+
+    def _close(self, profile):
+        with self._lock:
+            self._open_profiles.remove(profile)
+            if not self._open_profiles:
+                self._wake.set()  # sampler exits on its next tick
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while True:
+            self._wake.wait(self.interval)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            with self._lock:
+                if not self._open_profiles:
+                    self._sampler = None
+                    return
+                frames = sys._current_frames()
+                for profile in self._open_profiles:
+                    for ident in profile.threads:
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            profile._record(frame, elapsed)
+            del frames
+
+    def save(self, profile):
+        """Write the profile to out_dir, then drop the oldest past the keep limit"""
+        PROFILES_TOTAL.inc(target=profile.target, trigger=profile.trigger)
+        if not profile.samples:
+            print(f"🔬 Profile {profile.profile_id} ({profile.target}) has no samples, not written")
+            return None
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"profile-{stamp}-{profile.target}-{os.getpid()}-{profile.profile_id}{PROFILE_SUFFIXES[self.fmt]}"
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            path = self.out_dir / name
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                if self.fmt == "speedscope":
+                    json.dump(profile.speedscope(), f)
+                else:
+                    f.write(profile.collapsed())
+            os.replace(tmp, path)
+            self.prune()
+        except OSError as e:
+            print(f"⚠️ Failed to write profile {profile.profile_id}: {e}")
+            return None
+        profile.file_name = name
+        print(f"🔬 Profile {profile.target} ({len(profile.samples)} samples, {profile.duration:.2f}s) -> {path}")
+        return path
+
+    def profiles(self) -> list:
+        """Profiles on disk, newest first"""
+        if not self.out_dir.is_dir():
+            return []
+        files = []
+        for path in self.out_dir.glob("profile-*"):
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # pruned by another worker meanwhile
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        files.sort(reverse=True)
+        return [{"name": name, "bytes": size, "created": mtime} for mtime, name, size in files]
+
+    def prune(self):
+        for entry in self.profiles()[self.keep:]:
+            (self.out_dir / entry["name"]).unlink(missing_ok=True)
+
+    def path_for(self, name):
+        """Path of a stored profile by file name, or None (also for anything outside out_dir)"""
+        if not name.startswith("profile-") or Path(name).name != name:
+            return None
+        path = self.out_dir / name
+        return path if path.is_file() else None
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def bind(fn):
+    """fn attached to the active profile wherever it runs (e.g. asyncio.to_thread); fn itself when none"""
+    profile = _current_profile.get()
+    if profile is None:
+        return fn
+
+    def attached(*args, **kwargs):
+        with profile.attach():
+            return fn(*args, **kwargs)
+
+    return attached
@@ -0,0 +1,66 @@
+# - - - - -
+
+# Table-driven query routing - every classified query type maps to one handler object that
+# declares how it is answered (prompt template, model tier, cache policy, retrieval) and
+# dispatch is a single dict lookup. New types plug in with router.register(handler).
+
+
+class QueryHandler:
+    """How one query type is answered - subclasses implement handle()"""
+
+    def __init__(self, query_type, prompt_template=None, model_tier="default", cache_policy=None,
+                 needs_retrieval=False, uses_documents=None, fallback=None, cheap=False):
+        self.query_type = query_type
+        self.prompt_template = prompt_template  # {query} template for direct answers, the QA prompt for RAG
+        self.model_tier = model_tier            # resolved to a model name by the service
+        self.cache_policy = cache_policy        # "answer" -> answer cache, None -> never cached
+        self.needs_retrieval = needs_retrieval
+        # document filters keep a query on this handler only when it answers from documents
+        self.uses_documents = needs_retrieval if uses_documents is None else uses_documents
+        self.fallback = fallback                # query type to hand over to when handle() returns None
+        self.cheap = cheap                      # answered without LLM or retrieval - skips admission control
+
+    def handle(self, request, start_time):
+        """Return the response, or None to pass the request on to the fallback handler"""
+        raise NotImplementedError
+
+    def calls_llm(self, request):
+        """Will handle() need the LLM for this request? - asked only while the LLM quota is exhausted"""
+        return not self.cheap
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.query_type!r})"
+
+
+class QueryRouter:
+
+    def __init__(self, default_type="general"):
+        self.default_type = default_type
+        self._handlers = {}
+
+    def register(self, handler):
+        self._handlers[handler.query_type] = handler
+        return handler
+
+    def __contains__(self, query_type):
+        return query_type in self._handlers
+
+    def types(self):
+        return list(self._handlers)
+
+    def resolve(self, query_type):
+        """Handler for a query type - unknown types go to the default handler"""
+        handler = self._handlers.get(query_type)
+        if handler is None:
+            handler = self._handlers[self.default_type]
+        return handler
+
+    def dispatch(self, handler, request, start_time):
+        """Run a handler, following fallbacks; returns (handler that answered, response)"""
+        seen = set()
+        while True:
+            seen.add(handler.query_type)
+            response = handler.handle(request, start_time)
+            if response is not None or handler.fallback is None or handler.fallback in seen:
+                return handler, response
+            handler = self.resolve(handler.fallback)
@@ -0,0 +1,137 @@
+import time
+import asyncio
+import threading
+
+# - - - - -
+
+# Client-side rate limiting against the provider's published limits (model_config in main.py)
+# requests/minute and tokens/minute are token buckets refilled continuously; requests/day is a
+# rolling 24h budget. Callers either wait for capacity (acquire / acquire_async - bulk work)
+# or just record what they used (record - interactive calls), so one limiter sees all traffic.
+
+DAY_SECONDS = 86400.0
+
+
+class RateLimitExceeded(Exception):
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Bucket:
+
+    def __init__(self, per_minute, clock):
+        self.capacity = float(per_minute) if per_minute else None
+        self.rate = self.capacity / 60.0 if self.capacity else None
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount) -> float:
+        if self.capacity is None:
+            return 0.0
+        self._refill()
+        # a request larger than the whole bucket only has to wait for a full bucket
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount):
+        if self.capacity is not None:
+            self._refill()
+            # debt is capped at one full bucket - calls recorded past the limit were mostly
+            # turned away by the provider anyway, and unbounded debt locks callers out for minutes
+            self.level = max(self.level - amount, -self.capacity)
+
+
+class RateLimiter:
+    """Requests/minute, tokens/minute and requests/day limits for one model"""
+
+    def __init__(self, rpm=None, tpm=None, rpd=None, clock=time.monotonic):
+        self._requests = _Bucket(rpm, clock)
+        self._tokens = _Bucket(tpm, clock)
+        self.rpd = rpd
+        self._clock = clock
+        self._day_started = clock()
+        self._day_count = 0
+        self._lock = threading.Lock()
+
+    def _day_wait(self) -> float:
+        now = self._clock()
+        if now - self._day_started >= DAY_SECONDS:
+            self._day_started, self._day_count = now, 0
+        if self.rpd and self._day_count >= self.rpd:
+            return self._day_started + DAY_SECONDS - now
+        return 0.0
+
+    def _wait_time(self, tokens) -> float:
+        return max(self._day_wait(), self._requests.wait_time(1), self._tokens.wait_time(tokens))
+
+    def _take(self, tokens):
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self._day_count += 1
+
+    def wait_time(self, tokens=0) -> float:
+        """Seconds until a call using `tokens` could start (0 = now)"""
+        with self._lock:
+            return self._wait_time(tokens)
+
+    def try_acquire(self, tokens=0) -> float:
+        """Take capacity if available and return 0, else return the seconds to wait"""
+        with self._lock:
+            wait = self._wait_time(tokens)
+            if wait <= 0:
+                self._take(tokens)
+            return wait
+
+    def acquire(self, tokens=0, max_wait=None):
+        """Block until the call may start; RateLimitExceeded when that is beyond max_wait"""
+        deadline = None if max_wait is None else self._clock() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if deadline is not None and self._clock() + wait > deadline:
+                raise RateLimitExceeded(f"Rate limit would delay this call by {wait:.1f}s", wait)
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, tokens=0, max_wait=None):
+        deadline = None if max_wait is None else self._clock() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if deadline is not None and self._clock() + wait > deadline:
+                raise RateLimitExceeded(f"Rate limit would delay this call by {wait:.1f}s", wait)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def record(self, tokens=0):
+        """Account for a call that was made without waiting"""
+        with self._lock:
+            self._take(tokens)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the real usage of a call is known"""
+        with self._lock:
+            self._tokens.take(actual_tokens - estimated_tokens)
+
+
+def limiters_from_config(model_config, scale=1.0) -> dict:
+    """{model name: RateLimiter} from main.model_config entries (rpm / tpm / rpd)
+
+    scale < 1 leaves headroom for other clients sharing the same API key.
+    """
+    limiters = {}
+    for entry in model_config.values():
+        limiters[entry["model"]] = RateLimiter(
+            rpm=(entry.get("rpm") or 0) * scale or None,
+            tpm=(entry.get("tpm") or 0) * scale or None,
+            rpd=int((entry.get("rpd") or 0) * scale) or None,
+        )
+    return limiters
@@ -0,0 +1,108 @@
+from collections import deque
+
+from metrics import SPECULATIVE_RETRIEVAL_TOTAL
+
+# - - - - -
+
+# Speculative retrieval for /query - embedding and retrieval for a query start in a worker
+# thread as it arrives, concurrently with classification, handler selection and the wait for
+# an admission slot. A query classified as RAG-bound (hybrid, document_specific, or anything
+# with document filters) picks up the finished retrieval; a canned or direct-LLM one discards it.
+#
+# A discarded speculation cost an embedding and a retrieval for nothing, so the policy only
+# speculates while it pays off: not for very short queries (greetings, farewells, "help"),
+# not while admission has no free slot (the work would run outside the cap), and in adaptive
+# mode only while enough recent speculations were used - below that, every probe_every-th
+# query still speculates so the hit rate can recover when the traffic mix changes.
+# Runs on the event loop (one policy per worker process), so no locking is needed.
+
+SPECULATION_MODES = ("off", "always", "adaptive")
+
+
+class SpeculationPolicy:
+
+    def __init__(self, mode="adaptive", min_words=3, min_hit_rate=0.3, window=100, min_samples=20, probe_every=10):
+        if mode not in SPECULATION_MODES:
+            raise ValueError(f"Unknown speculation mode {mode!r}, expected one of {SPECULATION_MODES}")
+        self.mode = mode
+        self.min_words = min_words        # shorter queries are rarely document questions
+        self.min_hit_rate = min_hit_rate  # adaptive: fraction of recent speculations that were used
+        self.min_samples = min_samples    # adaptive: outcomes needed before the hit rate counts
+        self.probe_every = probe_every
+        self._recent = deque(maxlen=window)  # True = used
+        self._declined = 0
+        self.totals = {"used": 0, "discarded": 0, "failed": 0, "skipped": 0}
+
+    @property
+    def hit_rate(self):
+        return sum(self._recent) / len(self._recent) if self._recent else None
+
+    def should_speculate(self, query, filtered=False, busy=False) -> bool:
+        """Start retrieval before the query is classified?
+
+        filtered: the query has document filters (it is answered from documents whatever its type)
+        busy: admission has no free slot
+        """
+        if self.mode == "off":
+            return False
+        if self.mode == "always" or filtered:
+            return True
+        if busy or len(query.split()) < self.min_words:
+            return self._skip()
+        hit_rate = self.hit_rate
+        if len(self._recent) >= self.min_samples and hit_rate < self.min_hit_rate:
+            self._declined += 1
+            if self._declined % self.probe_every:
+                return self._skip()
+        return True
+
+    def _skip(self):
+        self.totals["skipped"] += 1
+        SPECULATIVE_RETRIEVAL_TOTAL.inc(outcome="skipped")
+        return False
+
+    def record(self, outcome):
+        """Outcome of a speculation - used, discarded or failed"""
+        self._recent.append(outcome == "used")
+        self.totals[outcome] += 1
+        SPECULATIVE_RETRIEVAL_TOTAL.inc(outcome=outcome)
+
+    def stats(self) -> dict:
+        hit_rate = self.hit_rate
+        return {
+            "mode": self.mode,
+            "hit_rate": round(hit_rate, 3) if hit_rate is not None else None,
+            "recent": len(self._recent),
+            **self.totals,
+        }
+
+
+class Speculation:
+    """One speculative retrieval (an asyncio future) - taken or discarded, recorded once"""
+
+    def __init__(self, policy, future):
+        self.policy = policy
+        self.future = future
+        self.outcome = None
+        # a discarded retrieval may still fail later with nobody awaiting it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def take(self):
+        """The retrieval result, or None when it failed - the caller then retrieves as usual"""
+        try:
+            result = await self.future
+        except Exception as e:
+            print(f"⚠️ Speculative retrieval failed, retrieving again: {e}")
+            self._settle("failed")
+            return None
+        self._settle("used")
+        return result
+
+    def discard(self):
+        """Not needed after all - a no-op once taken"""
+        self._settle("discarded")
+
+    def _settle(self, outcome):
+        if self.outcome is None:
+            self.outcome = outcome
+            self.policy.record(outcome)
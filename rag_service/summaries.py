@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+from index_store import clean_file_name, upload_time
+
+# - - - - -
+
+# Precomputed hierarchical document summaries
+#   page     - extractive lead sentences (no LLM call)
+#   section  - one LLM call per group of consecutive pages, over the pages' own text
+#   document - one LLM call combining the section summaries (skipped for one section)
+# Stored per content hash under <root>/<sha256>.json, with <root>/index.json mapping the
+# stored file name to its current hash - a changed file gets a new hash and is redone.
+
+SECTION_PAGES = int(os.getenv("RAG_SUMMARY_SECTION_PAGES", "8"))
+SECTION_CHAR_BUDGET = int(os.getenv("RAG_SUMMARY_SECTION_CHARS", "12000"))
+
+SECTION_PROMPT = (
+    "You are summarizing part of the document \"{title}\" ({pages}).\n"
+    "---------------------\n"
+    "{text}\n"
+    "---------------------\n"
+    "Write a concise summary of this section covering its main points, key facts and figures:\n"
+)
+
+DOCUMENT_PROMPT = (
+    "Below are summaries of consecutive sections of the document \"{title}\".\n"
+    "---------------------\n"
+    "{sections}\n"
+    "---------------------\n"
+    "Combine them into one coherent summary of the whole document: its purpose, "
+    "main points and conclusions:\n"
+)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def file_hash(path, chunk_size=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extractive_summary(text, max_sentences=2, max_chars=300) -> str:
+    sentences = [s.strip() for s in SENTENCE_PATTERN.split(" ".join(text.split())) if s.strip()]
+    summary = " ".join(sentences[:max_sentences])
+    return summary[:max_chars]
+
+
+class SummaryStore:
+
+    def __init__(self, root, complete):
+        """complete(prompt) -> str is the LLM call used for section/document summaries"""
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.complete = complete
+        self._cache = {}
+        self._index = {}
+        self._index_mtime = None
+        self._pending = None
+        self._additions = []
+        self._condition = threading.Condition()
+        self._worker = None
+        self._closed = False
+
+    # - lookups (any worker process) -
+
+    def _load_index(self):
+        path = self.root / "index.json"
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._index
+        if mtime != self._index_mtime:
+            with open(path, encoding="utf-8") as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def get(self, file_name):
+        content_hash = self._load_index().get(file_name)
+        if content_hash is None:
+            return None
+        summary = self._cache.get(content_hash)
+        if summary is None:
+            try:
+                with open(self.root / f"{content_hash}.json", encoding="utf-8") as f:
+                    summary = self._cache[content_hash] = json.load(f)
+            except FileNotFoundError:
+                return None
+        return summary
+
+    def file_names(self):
+        return list(self._load_index())
+
+    # - building (background thread) -
+
+    def refresh(self, documents):
+        """Summarize new or changed files in the background; latest request wins"""
+        with self._condition:
+            self._pending = documents
+            self._additions = []
+            self._start_worker()
+
+    def add(self, documents):
+        """Summarize extra files (incremental ingest) without dropping the others"""
+        with self._condition:
+            self._additions.extend(documents)
+            self._start_worker()
+
+    def close(self, timeout=None):
+        """Stop after the file being summarized - queued files are left for the next refresh"""
+        with self._condition:
+            self._closed = True
+            self._pending, self._additions = None, []
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def _start_worker(self):
+        if self._closed:
+            return
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="summary-builder", daemon=True)
+            self._worker.start()
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._pending is None and not self._additions:
+                    self._worker = None
+                    return
+                if self._pending is not None:
+                    documents, prune, self._pending = self._pending, True, None
+                else:
+                    documents, prune, self._additions = self._additions, False, []
+            try:
+                self.summarize_documents(documents, prune)
+            except Exception as e:
+                print(f"⚠️ Summary build failed: {e}")
+
+    def summarize_documents(self, documents, prune=True):
+        files = {}
+        for doc in documents:
+            file_path = doc.metadata.get("file_path")
+            if file_path:
+                files.setdefault(file_path, []).append(doc)
+
+        index = {}
+        for file_path, pages in files.items():
+            if self._closed:
+                return  # shutting down - no prune from a partial pass
+            if not os.path.exists(file_path):
+                continue
+            content_hash = file_hash(file_path)
+            file_name = os.path.basename(file_path)
+            index[file_name] = content_hash
+            if not (self.root / f"{content_hash}.json").exists():
+                started = time.time()
+                summary = self.build_summary(file_name, content_hash, pages, os.path.getsize(file_path))
+                self._write_json(self.root / f"{content_hash}.json", summary)
+                print(f"📝 Summarized {file_name} in {time.time() - started:.1f}s")
+            # publish progressively so finished documents are usable straight away
+            self._write_json(self.root / "index.json", {**self._load_index(), **index})
+
+        if prune:
+            self._write_json(self.root / "index.json", index)
+            self._prune(set(index.values()))
+
+    def build_summary(self, file_name, content_hash, pages, file_size):
+        title = clean_file_name(file_name)
+        page_entries = []
+        for number, page in enumerate(pages, start=1):
+            text = page.get_content()
+            if text.strip():
+                page_entries.append({
+                    "page_label": str(page.metadata.get("page_label", number)),
+                    "text": text,
+                    "summary": extractive_summary(text),
+                })
+
+        sections = []
+        for start in range(0, len(page_entries), SECTION_PAGES):
+            group = page_entries[start:start + SECTION_PAGES]
+            per_page = max(200, SECTION_CHAR_BUDGET // len(group))
+            label = f"pages {group[0]['page_label']}-{group[-1]['page_label']}"
+            text = "\n\n".join(entry["text"][:per_page] for entry in group)
+            sections.append({
+                "pages": label,
+                "summary": str(self.complete(SECTION_PROMPT.format(title=title, pages=label, text=text))).strip(),
+            })
+
+        if len(sections) > 1:
+            joined = "\n\n".join(f"[{s['pages']}] {s['summary']}" for s in sections)
+            document = str(self.complete(DOCUMENT_PROMPT.format(title=title, sections=joined))).strip()
+        else:
+            document = sections[0]["summary"] if sections else ""
+
+        return {
+            "file_name": file_name,
+            "title": title,
+            "content_hash": content_hash,
+            "file_size": file_size,
+            "uploaded": upload_time(file_name, pages[0].metadata) if pages else None,
+            "created": time.time(),
+            "pages": [{"page_label": e["page_label"], "summary": e["summary"]} for e in page_entries],
+            "sections": sections,
+            "document": document,
+        }
+
+    def _write_json(self, path, payload):
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    def _prune(self, live_hashes):
+        for path in self.root.glob("*.json"):
+            if path.name != "index.json" and path.stem not in live_hashes:
+                path.unlink(missing_ok=True)
+                self._cache.pop(path.stem, None)
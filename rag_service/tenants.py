@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from metrics import PARTITIONS_LOADED, PARTITION_BYTES, PARTITION_LOADS_TOTAL, PARTITION_EVICTIONS_TOTAL
+
+# - - - - -
+
+# Per-tenant index partitions. Every document belongs to one tenant (the uploading user) or
+# to nobody - the shared partition, which is the service's regular index. Ownership is a
+# small JSON map next to the partitions; each tenant partition is its own IndexStore under
+# <index dir>/tenants/<tenant key>/, loaded on first use and evicted least recently used once
+# the loaded partitions outgrow the memory budget.
+
+TENANT_KEY_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def tenant_key(user_id) -> str:
+    """Directory-safe key for a user id - kept as is when already safe, else hashed"""
+    user_id = str(user_id)
+    if TENANT_KEY_PATTERN.fullmatch(user_id):
+        return user_id
+    return "h" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+
+
+class TenantDirectory:
+    """{file name: tenant key} for every tenant-owned document, persisted as JSON
+
+    Re-read when another process rewrote it (mtime check), so all workers agree on owners.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._owners = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self.path, encoding="utf-8") as f:
+                self._owners = json.load(f)
+            self._mtime = mtime
+
+    def owner(self, file_name):
+        with self._lock:
+            self._refresh()
+            return self._owners.get(file_name)
+
+    def files(self, tenant) -> list:
+        with self._lock:
+            self._refresh()
+            return sorted(name for name, owner in self._owners.items() if owner == tenant)
+
+    def owned(self) -> set:
+        with self._lock:
+            self._refresh()
+            return set(self._owners)
+
+    def assign(self, file_names, tenant):
+        """Record tenant as the owner of file_names (None hands them back to the shared partition)"""
+        with self._lock:
+            self._refresh()
+            for name in file_names:
+                if tenant is None:
+                    self._owners.pop(name, None)
+                else:
+                    self._owners[name] = tenant
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._owners, f)
+            os.replace(tmp, self.path)
+            self._mtime = self.path.stat().st_mtime_ns
+
+
+class PartitionCache:
+    """Loaded tenant partitions, least recently used first out past a memory budget
+
+    load(tenant) returns (partition, version, size in bytes) or None when the tenant has no
+    documents; current_version(tenant) is asked on every get so a version published by
+    another worker replaces the cached one.
+    """
+
+    def __init__(self, load, current_version, budget_bytes=1 << 30):
+        self.load = load
+        self.current_version = current_version
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # tenant -> (partition, version, size)
+        self._loading = {}             # tenant -> lock, so a partition is loaded once
+        self._lock = threading.Lock()
+
+    def get(self, tenant):
+        version = self.current_version(tenant)
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None and entry[1] == version:
+                self._entries.move_to_end(tenant)
+                return entry[0]
+            load_lock = self._loading.setdefault(tenant, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(tenant)
+                if entry is not None and entry[1] == self.current_version(tenant):
+                    self._entries.move_to_end(tenant)
+                    return entry[0]
+            started = time.perf_counter()
+            loaded = self.load(tenant)
+            if loaded is None:
+                self.invalidate(tenant)
+                return None
+            PARTITION_LOADS_TOTAL.inc()
+            print(f"📦 Loaded partition {tenant} ({loaded[2] / 2 ** 20:.1f} MB) in {time.perf_counter() - started:.2f}s")
+            with self._lock:
+                self._entries[tenant] = loaded
+                self._entries.move_to_end(tenant)
+                self._evict(keep=tenant)
+            return loaded[0]
+
+    def _evict(self, keep):
+        total = sum(size for _, _, size in self._entries.values())
+        while total > self.budget_bytes and len(self._entries) > 1:
+            tenant = next(iter(self._entries))
+            if tenant == keep:
+                break
+            _, _, size = self._entries.pop(tenant)
+            total -= size
+            PARTITION_EVICTIONS_TOTAL.inc()
+            print(f"♻️ Evicted partition {tenant} ({size / 2 ** 20:.1f} MB)")
+        PARTITIONS_LOADED.set(len(self._entries))
+        PARTITION_BYTES.set(total)
+
+    def invalidate(self, tenant):
+        with self._lock:
+            self._entries.pop(tenant, None)
+            PARTITIONS_LOADED.set(len(self._entries))
+            PARTITION_BYTES.set(sum(size for _, _, size in self._entries.values()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = {tenant: size for tenant, (_, _, size) in self._entries.items()}
+        return {
+            "loaded": len(sizes),
+            "bytes": sum(sizes.values()),
+            "budget_bytes": self.budget_bytes,
+        }
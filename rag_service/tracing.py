@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+
+# - - - - -
+
+# Lightweight per-request tracing
+# spans are only recorded while a trace is active - with tracing off span() hands back
+# a shared no-op object, so instrumented code pays one contextvar lookup per stage
+
+# fraction of /query requests traced without asking (0 = only requests with debug=true)
+TRACE_SAMPLE_RATE = float(os.getenv("RAG_TRACE_SAMPLE_RATE", "0"))
+# finished traces are appended here as zipkin v2 json (one POST /api/v2/spans body per line)
+TRACE_FILE = os.getenv("RAG_TRACE_FILE")
+SERVICE_NAME = "rag_service"
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_current_span = contextvars.ContextVar("rag_span", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end_time", "attributes", "_token")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end_time = None
+        self.attributes = attributes or {}
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, **attributes):
+        if attributes:
+            self.attributes.update(attributes)
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+
+    @property
+    def duration(self):
+        return (self.end_time or time.perf_counter()) - self.start
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        _current_span.reset(self._token)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.started = time.perf_counter()
+        self.started_wall = time.time()
+        self._token = None
+
+    def begin(self, name, **attributes):
+        """Open a span that is ended explicitly - used where start/end are separate callbacks"""
+        parent = _current_span.get()
+        span = Span(self, name, parent.span_id if parent else None, attributes)
+        self.spans.append(span)
+        return span
+
+    def summary(self) -> dict:
+        """Timing breakdown returned in QueryResponse.debug"""
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "start_ms": round((span.start - self.started) * 1000, 3),
+                    "duration_ms": round(span.duration * 1000, 3),
+                    "attributes": span.attributes,
+                }
+                for span in self.spans
+            ],
+        }
+
+    def to_zipkin(self) -> list:
+        spans = []
+        for span in self.spans:
+            tags = {key: str(value) for key, value in span.attributes.items()}
+            tags["request_id"] = self.request_id
+            entry = {
+                "traceId": self.trace_id,
+                "id": span.span_id,
+                "name": span.name,
+                "timestamp": int((self.started_wall + (span.start - self.started)) * 1_000_000),
+                "duration": max(1, int(span.duration * 1_000_000)),
+                "localEndpoint": {"serviceName": SERVICE_NAME},
+                "tags": tags,
+            }
+            if span.parent_id:
+                entry["parentId"] = span.parent_id
+            spans.append(entry)
+        return spans
+
+    def export(self):
+        if not TRACE_FILE:
+            return
+        line = json.dumps(self.to_zipkin())
+        try:
+            with _export_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ Failed to export trace {self.request_id}: {e}")
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        for span in self.spans:
+            span.end()
+        self.export()
+        return False
+
+
+def start_trace(request_id=None, force=False):
+    """Return a Trace for this request, or None when the request is not traced"""
+    if not force and (TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE):
+        return None
+    return Trace(request_id or uuid.uuid4().hex)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def span(name, **attributes):
+    """Context manager timing one pipeline stage of the active trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    new_span = Span(trace, name, parent.span_id if parent else None, attributes)
+    trace.spans.append(new_span)
+    return new_span
@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# - - - - -
+
+# Streaming document uploads - the multipart body is parsed as it arrives and the file part
+# goes straight to disk, hashed on the way, so only one network chunk is ever held in memory.
+# Every upload gets a job id the frontend polls (receiving -> queued -> ingesting -> indexed,
+# or duplicate / failed). With a shared index dir the job files live there, so any worker
+# process can answer the poll.
+
+SAFE_NAME_PATTERN = re.compile(r"[^A-Za-z0-9._ ()-]+")
+ACTIVE_STATUSES = ("receiving", "queued", "ingesting")
+PROGRESS_WRITE_SECONDS = 0.5
+
+
+class UploadRejected(Exception):
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def safe_file_name(file_name) -> str:
+    """Base name of a client-supplied file name with anything unusual replaced"""
+    name = SAFE_NAME_PATTERN.sub("_", os.path.basename(file_name.replace("\\", "/"))).strip(" .")
+    return name or "upload"
+
+
+class UploadJobs:
+    """Upload / ingestion status by job id - kept in memory, mirrored to root when given"""
+
+    def __init__(self, root=None, max_jobs=500):
+        self.root = Path(root).resolve() if root else None
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def create(self, total_bytes=None, tenant=None) -> dict:
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "tenant": tenant,            # partition the file goes to, None = shared index
+            "status": "receiving",
+            "file_name": None,
+            "stored_name": None,
+            "bytes_received": 0,
+            "total_bytes": total_bytes,  # request Content-Length - includes the multipart framing
+            "sha256": None,
+            "duplicate_of": None,
+            "nodes_added": None,
+            "error": None,
+            "created": now,
+            "updated": now,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            while len(self._jobs) > self.max_jobs:
+                old_id, _ = self._jobs.popitem(last=False)
+                self._written.pop(old_id, None)
+                if self.root is not None:
+                    (self.root / f"{old_id}.json").unlink(missing_ok=True)
+        self._write(job, force=True)
+        return job
+
+    def update(self, job_id, **fields) -> dict:
+        with self._lock:
+            job = self._jobs[job_id]
+            status_changed = "status" in fields and fields["status"] != job["status"]
+            job.update(fields, updated=time.time())
+            job = dict(job)
+        self._write(job, force=status_changed)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self.view(job)
+        if self.root is None or not re.fullmatch(r"[0-9a-f]{12}", job_id):
+            return None
+        try:
+            with open(self.root / f"{job_id}.json", encoding="utf-8") as f:
+                return self.view(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def active_with_hash(self, content_hash, exclude=None, tenants=(None,)):
+        """Stored name of another in-flight upload with the same content, if any
+
+        only uploads headed for one of tenants count - the same file going to another
+        tenant's partition does not make this one redundant.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job["id"] != exclude and job["sha256"] == content_hash and job["status"] in ACTIVE_STATUSES \
+                        and job.get("tenant") in tenants:
+                    return job["stored_name"] or job["file_name"]
+        return None
+
+    @staticmethod
+    def view(job) -> dict:
+        view = dict(job)
+        view.pop("tenant", None)  # whoever polls the job id need not learn whose upload it is
+        total = job.get("total_bytes")
+        if job["status"] == "receiving":
+            view["progress"] = min(0.99, job["bytes_received"] / total) if total else None
+        else:
+            view["progress"] = 1.0
+        return view
+
+    def _write(self, job, force=False):
+        # progress updates are throttled; status changes always land
+        if self.root is None:
+            return
+        now = time.time()
+        if not force and now - self._written.get(job["id"], 0.0) < PROGRESS_WRITE_SECONDS:
+            return
+        self._written[job["id"]] = now
+        path = self.root / f"{job['id']}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+
+async def receive_upload(request, jobs, job_id, target_dir, max_bytes=None, field="file"):
+    """Stream the multipart `field` part of a request into target_dir
+
+    Returns (partial file path, client file name, sha256). The file keeps a hidden
+    .upload-<id>.part name until the caller decides what to do with it.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejected("Expected a multipart/form-data body")
+
+    part_path = Path(target_dir) / f".upload-{job_id}.part"
+    digest = hashlib.sha256()
+    state = {"headers": {}, "field": b"", "value": b"", "in_file": False, "file_name": None, "size": 0, "done": False}
+    out = None
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        nonlocal out
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        file_name = disposition.get(b"filename")
+        state["in_file"] = (
+            not state["done"] and disposition.get(b"name", b"").decode("utf-8", "replace") == field
+            and file_name is not None
+        )
+        if state["in_file"]:
+            state["file_name"] = file_name.decode("utf-8", "replace")
+            out = open(part_path, "wb")
+
+    def on_part_data(data, start, end):
+        if not state["in_file"]:
+            return
+        chunk = data[start:end]
+        state["size"] += len(chunk)
+        if max_bytes is not None and state["size"] > max_bytes:
+            raise UploadRejected(f"File exceeds the {max_bytes // 2 ** 20} MB upload limit", status_code=413)
+        digest.update(chunk)
+        out.write(chunk)
+
+    def on_part_end():
+        if state["in_file"]:
+            out.close()
+            state["in_file"], state["done"] = False, True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            received += len(chunk)
+            jobs.update(job_id, bytes_received=received)
+        parser.finalize()
+    except BaseException:
+        if out is not None:
+            out.close()
+        part_path.unlink(missing_ok=True)
+        raise
+
+    if not state["done"]:
+        part_path.unlink(missing_ok=True)
+        raise UploadRejected(f"No file part named '{field}' in the upload")
+    return part_path, state["file_name"], digest.hexdigest()